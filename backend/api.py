@@ -10,6 +10,8 @@ import pytz # affected by daylight saving?
 import base64
 from typing import List
 from src.classes.Pi import Pi
+from src.pi_health import pi_health_monitor
+from src.pi_broker import using_pi_broker
 
 
 from src.viewing_functions import *
@@ -42,12 +44,17 @@ from src.database.database import create_db_and_tables
 from src.database.models import Camera as CameraTable, CameraSettingsLink
 
 import os
+import asyncio
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     get_host_IP_address()
     create_db_and_tables() 
+    # With several workers the broker process connects to the Pis and polls their health
+    pi_health_task = None if using_pi_broker() else asyncio.create_task(pi_health_monitor.run())
     yield 
+    if pi_health_task is not None:
+        pi_health_task.cancel()
     print("API closed")
 
 app = FastAPI(lifespan=lifespan)
@@ -118,8 +125,8 @@ app.include_router(camera_analysis_plot_router.router)
 
 @app.get("/get_pi_disk_space/{username}")
 def get_pi_disk_space_api(username: str):
-    if connected_pi := Pi.get_pi_with_username(username): 
-        return {"used space / total space": connected_pi.get_pi_disk_space()}
+    if (disk_space := get_pi_disk_space(username)) is not None:
+        return {"used space / total space": disk_space}
     return {"Error": "No Pi connected with that username"}
 
 @app.post("/add_pi")
@@ -228,9 +235,9 @@ def perform_distortion_calibration_api(setup_id, username):
     
 
 @app.get("/stream/{username}")
-def stream_api(username: str):
+def stream_api(username: str, width: int | None = None):
     # Might want to add a fastapi background task which waits until stream cleanup is needed
-    return StreamingResponse(stream_video_feed(username),
+    return StreamingResponse(stream_video_feed(username, width),
                              media_type="multipart/x-mixed-replace; boundary=frame")
     
 
@@ -349,6 +356,7 @@ def fill_photos_for_beam_run(beam_run_id: int, camera_id: int, directory: Direct
         camera_settings_id = camera_settings.id
         general_file_name = directory.directory + "*.jp*g"
         file_names = glob.glob(general_file_name)
-        for file_name in file_names:
-            photo_bytes = read_image_as_bytes(file_name)
-            cdi.add_photo(camera_settings_id, photo_bytes)
\ No newline at end of file
+        with cdi.PhotoIngest() as photo_ingest:
+            for file_name in file_names:
+                photo_bytes = read_image_as_bytes(file_name)
+                photo_ingest.add(camera_settings_id, photo_bytes)
\ No newline at end of file
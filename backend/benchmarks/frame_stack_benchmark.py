@@ -0,0 +1,100 @@
+"""
+Time to average a run's frames (as image_processing.average_pixel_over_multiple_images
+does) from the JPEGs against from the frame stack written at ingest, and the
+disk space each takes.
+
+    python -m benchmarks.frame_stack_benchmark -num 100
+
+Frames are synthetic 12 MP (4056x3040, HQ camera) JPEGs of a noisy beam spot.
+Each read pass follows the last, so both are mostly from the page cache - with
+a cold cache the frame stack reads ~20x the bytes of the JPEGs from disk.
+"""
+import argparse
+import io
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+import cv2
+
+from src.frame_stack_store import FrameStack, FrameStackIngest
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark reanalysis from the frame stack against decoding JPEGs")
+    parser.add_argument("-num", "--num_of_images", type=int, default=100)
+    parser.add_argument("-cs", "--chunk_size", type=int, default=8)
+    parser.add_argument("-dir", "--directory_name", type=str, help="Parent directory of the temporary frame stack", default=None)
+    return parser.parse_args()
+
+
+def make_frames(num_of_images: int, width=4056, height=3040):
+    from PIL import Image
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    beam_spot = 180 * np.exp(-((x - width / 2)**2 + (y - height / 2)**2) / (2 * 300**2))
+    frames = []
+    for _ in range(num_of_images):
+        intensity = np.clip(beam_spot + rng.normal(10, 3, (height, width)), 0, 255).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(np.stack([intensity] * 3, axis=-1)).save(buffer, format="jpeg", quality=90)
+        frames.append(buffer.getvalue())
+    return frames
+
+
+def average_blue_channel(images):
+    cumulative_pixel_val_sum = None
+    num_of_images = 0
+    for image in images:
+        if cumulative_pixel_val_sum is None:
+            cumulative_pixel_val_sum = np.zeros(image.shape[:2], dtype=np.float64)
+        cumulative_pixel_val_sum += image[:, :, 0]
+        num_of_images += 1
+    return cumulative_pixel_val_sum / num_of_images
+
+
+def get_disk_usage(directory_name: str):
+    """
+    Allocated bytes - the unwritten end of the last chunk is sparse.
+    """
+    return sum(os.stat(os.path.join(root, filename)).st_blocks * 512
+               for root, _, filenames in os.walk(directory_name) for filename in filenames)
+
+
+def main():
+    args = parse_arguments()
+    print(f"Encoding {args.num_of_images} frames...")
+    frames = make_frames(args.num_of_images)
+    jpeg_size = sum(len(frame) for frame in frames) / 10**6
+    stack_directory = tempfile.mkdtemp(dir=args.directory_name, prefix="frame_stack_benchmark_")
+    try:
+        start_time = time.perf_counter()
+        with FrameStackIngest(stack_directory, args.chunk_size) as frame_stack_ingest:
+            for photo_id, frame in enumerate(frames):
+                frame_stack_ingest.add_frame(1, photo_id, frame)
+        ingest_time = time.perf_counter() - start_time
+        stack_size = get_disk_usage(stack_directory) / 10**6
+
+        start_time = time.perf_counter()
+        jpeg_average = average_blue_channel(cv2.imdecode(np.frombuffer(frame, np.uint8), cv2.IMREAD_COLOR) for frame in frames)
+        jpeg_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        frame_stack = FrameStack.open(1, stack_directory)
+        stack_average = average_blue_channel(frame_stack.get_frame(photo_id) for photo_id in frame_stack.photo_ids)
+        stack_time = time.perf_counter() - start_time
+        if not np.array_equal(jpeg_average, stack_average):
+            raise RuntimeError("Averages from the JPEGs and the frame stack differ")
+    finally:
+        shutil.rmtree(stack_directory)
+
+    print(f"Ingest (decode and write): {ingest_time / len(frames) * 1000:.0f} ms per frame")
+    print(f"{'':<14}{'average (s)':>12}{'ms/frame':>10}{'disk (MB)':>11}")
+    print(f"{'JPEGs':<14}{jpeg_time:>12.2f}{jpeg_time / len(frames) * 1000:>10.1f}{jpeg_size:>11.0f}")
+    print(f"{'frame stack':<14}{stack_time:>12.2f}{stack_time / len(frames) * 1000:>10.1f}{stack_size:>11.0f}")
+    print(f"Reanalysis is {jpeg_time / stack_time:.1f}x faster for {stack_size / jpeg_size:.1f}x the disk space of the JPEGs")
+
+
+if __name__ == "__main__":
+    main()
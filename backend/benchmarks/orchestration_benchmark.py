@@ -0,0 +1,170 @@
+"""
+Per-Pi and total latency of a multi-Pi command issued one Pi at a time and
+through pi_orchestration, against a local mock SSH server (no Pis needed).
+
+Each mock Pi runs any command by printing a progress line per image and then
+exiting, taking longer the higher its number, so the slowest Pi sets the total.
+
+    python -m benchmarks.orchestration_benchmark -p 4 -d 0.5
+
+With -s, that many extra mock Pis stall part way through the command and never
+exit, like a Pi hung in a run. With a deadline (-dl) they are cancelled - their
+channel closed, as Camera.cancel_run does - and reported as timed out while the
+other Pis' results come back in full. -c limits how many Pis run at once.
+
+    python -m benchmarks.orchestration_benchmark -p 3 -s 1 -dl 3 -c 2
+
+tests/test_pi_orchestration.py checks the deadline and cancel handling against
+these mock Pis.
+"""
+import argparse
+import asyncio
+import socket
+import threading
+import time
+import paramiko
+
+from src.pi_orchestration import PiOperation, gather_from_pis
+
+
+class MockPiServer(paramiko.ServerInterface):
+    """
+    Accepts any password, and runs any exec request on a thread.
+    """
+
+    def __init__(self, command_duration: float, num_of_images: int, stall=False):
+        self.command_duration = command_duration
+        self.num_of_images = num_of_images
+        self.stall = stall
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self.run_command, args=(channel,), daemon=True).start()
+        return True
+
+    def run_command(self, channel):
+        for i in range(1, self.num_of_images + 1):
+            time.sleep(self.command_duration / self.num_of_images)
+            if channel.closed:
+                return
+            channel.sendall(f"Capturing image {i}\n".encode())
+            if self.stall and i == self.num_of_images // 2:
+                while not channel.closed: # Hung until cancelled
+                    time.sleep(0.1)
+                return
+        channel.send_exit_status(0)
+        channel.close()
+
+
+def serve_mock_pi(listening_socket: socket.socket, host_key, command_duration: float, num_of_images: int, stall=False):
+    while True:
+        connection, _ = listening_socket.accept()
+        transport = paramiko.Transport(connection)
+        transport.add_server_key(host_key)
+        transport.start_server(server=MockPiServer(command_duration, num_of_images, stall))
+
+
+def start_mock_pi(host_key, command_duration: float, num_of_images: int, stall=False):
+    """
+    Returns the port the mock Pi listens on.
+    """
+    listening_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listening_socket.bind(("127.0.0.1", 0))
+    listening_socket.listen()
+    threading.Thread(target=serve_mock_pi, args=(listening_socket, host_key, command_duration, num_of_images, stall),
+                     daemon=True).start()
+    return listening_socket.getsockname()[1]
+
+
+def connect_to_mock_pi(port: int, username: str):
+    ssh_client = paramiko.SSHClient()
+    ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    ssh_client.connect(hostname="127.0.0.1", port=port, username=username, password="password",
+                       look_for_keys=False, allow_agent=False)
+    return ssh_client
+
+
+run_channels = {} # Username: channel of its running command, closed to cancel it
+
+
+def run_remote_command(ssh_client, command: str, username: str = None):
+    """
+    Prints each line of the command's stdout as it arrives, like a run's progress.
+    """
+    _, stdout, _ = ssh_client.exec_command(command)
+    run_channels[username] = stdout.channel
+    for line in stdout:
+        print(line.rstrip())
+    if (exit_status := stdout.channel.recv_exit_status()) != 0:
+        raise Exception(f"Command exited with status {exit_status}")
+    return exit_status
+
+
+def cancel_remote_command(username: str):
+    run_channels[username].close()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark multi-Pi orchestration against mock SSH servers")
+    parser.add_argument("-p", "--num_of_pis", type=int, default=4)
+    parser.add_argument("-d", "--command_duration", type=float, help="Duration (s) of the fastest Pi's command - Pi n takes n times this", default=0.5)
+    parser.add_argument("-num", "--num_of_images", type=int, help="Progress lines printed per command", default=5)
+    parser.add_argument("-s", "--num_of_stalled_pis", type=int, help="Extra mock Pis that hang part way through the command", default=0)
+    parser.add_argument("-dl", "--deadline", type=float, help="Per-Pi deadline (s) for the orchestrated run", default=None)
+    parser.add_argument("-c", "--max_concurrent", type=int, help="Maximum Pis running at once in the orchestrated run", default=None)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    host_key = paramiko.RSAKey.generate(2048)
+    ssh_clients = {}
+    for pi_number in range(1, args.num_of_pis + args.num_of_stalled_pis + 1):
+        stall = pi_number > args.num_of_pis
+        username = f"stalledpi{pi_number}" if stall else f"mockpi{pi_number}"
+        port = start_mock_pi(host_key, pi_number * args.command_duration, args.num_of_images, stall)
+        ssh_clients[username] = connect_to_mock_pi(port, username)
+    command = "python video_script.py main_run"
+
+    sequential_duration = None
+    if args.num_of_stalled_pis == 0: # One at a time would never finish
+        print("One Pi at a time:")
+        start_time = time.perf_counter()
+        for username, ssh_client in ssh_clients.items():
+            pi_start_time = time.perf_counter()
+            run_remote_command(ssh_client, command, username)
+            print(f"{username} finished after {time.perf_counter() - start_time:.2f} s (its command took {time.perf_counter() - pi_start_time:.2f} s)")
+        sequential_duration = time.perf_counter() - start_time
+
+    print("\nAll Pis at once:")
+    operations = {username: PiOperation(username, run_remote_command, (ssh_client, command, username),
+                                        deadline=args.deadline, cancel=lambda username=username: cancel_remote_command(username))
+                  for username, ssh_client in ssh_clients.items()}
+    start_time = time.perf_counter()
+    pi_results = asyncio.run(gather_from_pis(operations, args.max_concurrent))
+    orchestrated_duration = time.perf_counter() - start_time
+
+    print(f"\n{'Pi':<12}{'status':>12}{'latency (s)':>14}{'progress lines':>16}")
+    for username, pi_result in pi_results.items():
+        print(f"{username:<12}{pi_result.status:>12}{pi_result.latency:>14.2f}{len(pi_result.output):>16}")
+    if sequential_duration is not None:
+        print(f"\nTotal: {sequential_duration:.2f} s one at a time, {orchestrated_duration:.2f} s at once")
+    else:
+        print(f"\nTotal: {orchestrated_duration:.2f} s at once")
+
+    for ssh_client in ssh_clients.values():
+        ssh_client.close()
+
+
+if __name__ == "__main__":
+    main()
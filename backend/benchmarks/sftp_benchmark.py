@@ -0,0 +1,73 @@
+"""
+Per-image latency of a calibration style capture loop (capture a still, read it
+back over SFTP) with the Pi's SFTP session reopened for every image, as before
+PersistentSFTP, and kept open between images.
+
+Nothing is written to the database. Run from backend/ against a connected Pi:
+
+    python -m benchmarks.sftp_benchmark <ip_address> <username> <password> -n 20
+"""
+import argparse
+import time
+import numpy as np
+
+from src.classes.Pi import Pi
+from src.classes.Camera import ImageSettings, PhotoContext
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark per-image SFTP transfer latency")
+    parser.add_argument("ip_address", type=str)
+    parser.add_argument("username", type=str)
+    parser.add_argument("password", type=str)
+    parser.add_argument("-m", "--camera_model", type=str, default="benchmark")
+    parser.add_argument("-n", "--num_of_images", type=int, help="Images per mode", default=20)
+    parser.add_argument("-f", "--format", type=str, choices=["png", "jpg", "jpeg"], default="jpeg")
+    return parser.parse_args()
+
+
+def run_capture_loop(pi: Pi, image_settings: ImageSettings, num_of_images: int, reopen_sftp: bool):
+    """
+    Returns the capture and transfer time (s) of each image.
+    """
+    camera = pi.camera
+    file_path = camera.check_image_directory_exists(PhotoContext.GENERAL)
+    full_file_path = f"{file_path}/{image_settings.filename}"
+    capture_durations, transfer_durations = [], []
+    for _ in range(num_of_images):
+        if reopen_sftp:
+            pi.sftp.close()
+        start_time = time.perf_counter()
+        camera.capture_still(full_file_path, image_settings)
+        capture_end_time = time.perf_counter()
+        camera.transfer_image_without_writing_to_database(image_settings, None, full_file_path)
+        capture_durations.append(capture_end_time - start_time)
+        transfer_durations.append(time.perf_counter() - capture_end_time)
+    return np.array(capture_durations), np.array(transfer_durations)
+
+
+def print_durations(label: str, durations: np.ndarray):
+    print(f"  {label:<10} mean {1000 * np.mean(durations):8.1f} ms   " +
+          f"median {1000 * np.median(durations):8.1f} ms   " +
+          f"p95 {1000 * np.percentile(durations, 95):8.1f} ms")
+
+
+def main():
+    args = parse_arguments()
+    pi = Pi(args.username, args.ip_address, args.password, args.camera_model)
+    pi.connect_via_ssh()
+    image_settings = ImageSettings(filename="sftp_benchmark", format=args.format)
+    try:
+        pi.camera.capture_still(f"{pi.camera.general_image_directory}/sftp_benchmark", image_settings) # Camera warm up (starts the daemon)
+        for label, reopen_sftp in (("SFTP session per image", True), ("persistent SFTP session", False)):
+            capture_durations, transfer_durations = run_capture_loop(pi, image_settings, args.num_of_images, reopen_sftp)
+            print(f"{label} ({args.num_of_images} images):")
+            print_durations("capture", capture_durations)
+            print_durations("transfer", transfer_durations)
+            print_durations("total", capture_durations + transfer_durations)
+    finally:
+        pi.close_ssh_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Compression ratio and CPU cost of each transfer codec for each frame format,
+and the link bandwidth below which compressing on the Pi pays off.
+
+Run it on a Pi (the CPU cost there is what matters) - copy it next to
+transfer_codec.py (deployed from src/ with the video script), then run it on the
+directory of a run:
+
+    python transfer_codec_benchmark.py -dir /home/<user>/experiment_id_1/real_beam_run_id_1
+
+Without -dir, synthetic frames are used - a noisy beam spot on a dark
+background, as jpeg, 8 and 16-bit png and 16-bit raw Bayer data.
+
+Break-even: sending a file of S MB compressed to Sc MB in t CPU seconds saves
+time on a link of B MB/s when S/B > Sc/B + t, i.e. B < (S - Sc)/t. When
+compression overlaps the transfer (streamed runs), any saving pays off while
+the Pi compresses faster than the link sends, B < S/t.
+"""
+import argparse
+import io
+import os
+import time
+from collections import defaultdict
+import numpy as np
+
+from transfer_codec import CompressedWriter, open_decompressed_stream
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark transfer codecs on run frames")
+    parser.add_argument("-dir", "--directory_name", type=str, help="Directory of frames to compress (synthetic frames if not given)", default=None)
+    parser.add_argument("-zl", "--zstd_levels", type=int, nargs="+", default=[1, 3, 9])
+    parser.add_argument("-ll", "--lz4_levels", type=int, nargs="+", default=[0, 3])
+    parser.add_argument("-num", "--num_of_images", type=int, help="Synthetic frames per format", default=5)
+    return parser.parse_args()
+
+
+def make_synthetic_frames(num_of_images: int, width=2028, height=1520):
+    """
+    Returns {format: [file bytes, ...]}.
+    """
+    from PIL import Image
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    beam_spot = 180 * np.exp(-((x - width / 2)**2 + (y - height / 2)**2) / (2 * 150**2))
+    frames = defaultdict(list)
+    for _ in range(num_of_images):
+        intensity = np.clip(beam_spot + rng.normal(10, 3, (height, width)), 0, 255)
+        image_8_bit = Image.fromarray(np.stack([intensity] * 3, axis=-1).astype(np.uint8))
+        image_16_bit = Image.fromarray((intensity * 16).astype(np.uint16)) # 12-bit sensor data in 16 bits
+        for file_format, image, extension in (("jpeg", image_8_bit, "jpeg"), ("png", image_8_bit, "png"),
+                                              ("png 16-bit", image_16_bit, "png")):
+            buffer = io.BytesIO()
+            image.save(buffer, format=extension)
+            frames[file_format].append(buffer.getvalue())
+        frames["raw 16-bit"].append((intensity * 16).astype(np.uint16).tobytes())
+    return frames
+
+
+def load_frames(directory_name: str):
+    frames = defaultdict(list)
+    for filename in sorted(os.listdir(directory_name)):
+        file_format = os.path.splitext(filename)[1].lstrip(".")
+        if file_format in ("log", "tar", "zst", "lz4") or not os.path.isfile(os.path.join(directory_name, filename)):
+            continue
+        with open(os.path.join(directory_name, filename), "rb") as file:
+            frames[file_format].append(file.read())
+    return frames
+
+
+def measure_codec(files: list[bytes], codec: str, level: int):
+    """
+    Returns (compressed size, compression CPU time, decompression CPU time).
+    Each file is flushed as it would be when streamed.
+    """
+    compressed_buffer = io.BytesIO()
+    with CompressedWriter(compressed_buffer, codec, level) as compressed_file:
+        for file_bytes in files:
+            compressed_file.write(file_bytes)
+            compressed_file.flush()
+    compressed_bytes = compressed_buffer.getvalue()
+
+    start_time = time.process_time()
+    decompressed_size = len(open_decompressed_stream(io.BytesIO(compressed_bytes), codec).read())
+    decompression_time = time.process_time() - start_time
+    if decompressed_size != sum(len(file_bytes) for file_bytes in files):
+        raise RuntimeError(f"{codec} level {level} did not round trip")
+    return len(compressed_bytes), compressed_file.compression_time, decompression_time
+
+
+def main():
+    args = parse_arguments()
+    frames = load_frames(args.directory_name) if args.directory_name else make_synthetic_frames(args.num_of_images)
+    codecs = [("zstd", level) for level in args.zstd_levels] + [("lz4", level) for level in args.lz4_levels]
+
+    print(f"{'format':<12}{'codec':<9}{'ratio':>7}{'Pi MB/s':>9}{'decode MB/s':>13}{'serial break-even':>19}{'overlapped break-even':>23}")
+    for file_format, files in frames.items():
+        size = sum(len(file_bytes) for file_bytes in files) / 10**6
+        for codec, level in codecs:
+            try:
+                compressed_size, compression_time, decompression_time = measure_codec(files, codec, level)
+            except ImportError as e:
+                print(f"{file_format:<12}{codec}-{level:<4} skipped: {e}")
+                continue
+            compressed_size /= 10**6
+            compression_time = max(compression_time, 1e-9)
+            serial_break_even = max(0.0, (size - compressed_size) / compression_time)
+            overlapped_break_even = size / compression_time if compressed_size < size else 0.0
+            print(f"{file_format:<12}{f'{codec}-{level}':<9}{size / compressed_size:>7.2f}{size / compression_time:>9.1f}" +
+                  f"{size / max(decompression_time, 1e-9):>13.1f}{serial_break_even:>15.1f} MB/s{overlapped_break_even:>19.1f} MB/s")
+    print("\nCompressing pays off on links slower than the break-even bandwidth (100 Mbit ethernet is 12.5 MB/s, gigabit 125 MB/s).")
+
+
+if __name__ == "__main__":
+    main()
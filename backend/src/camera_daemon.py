@@ -0,0 +1,239 @@
+"""
+Long-lived camera service for the Pis. Started once over SSH, it keeps a
+configured and running Picamera2 instance, so stills and runs no longer pay for
+a new process, camera initialisation and AE/AWB convergence each time.
+
+Protocol - one JSON object per line:
+    backend -> stdin   {"id": 3, "command": "still", ...command fields}
+    stdout -> backend  {"id": 3, "status": "ok", "result": {...}}
+                       {"id": 3, "status": "error", "error": "..."}
+A {"status": "ready"} line is written once the camera is configured.
+
+Commands:
+    set_controls  {"controls": {...}}                    applied in place, no restart
+    still         {"path", "gain", "lens_position", "format"}
+    burst         {"directory", "num_of_images", "gain", "lens_position", "format"}
+    main_run      {"argv": [...]}  video_script.py arguments (see video_script.parse_arguments)
+    test_run      {"argv": [...]}
+    ping          {}
+    shutdown      {}
+
+Anything the video_script functions print goes to stderr, as stdout carries
+the protocol.
+
+Run with --fake to use fake_picamera2 instead of a real camera.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+def parse_daemon_arguments():
+    parser = argparse.ArgumentParser(description="Persistent CRISP camera service driven over stdin/stdout")
+    parser.add_argument("--fake", action="store_true", help="Use the fake Picamera2 backend (no camera needed)")
+    parser.add_argument("-pw", "--pipeline_workers", type=int, help="Writer threads used for main runs", default=2)
+    parser.add_argument("-ram", "--ram_budget", type=float, help="RAM (in MB) for frames waiting to be saved - sets the buffer count", default=1024)
+    parser.add_argument("-mif", "--max_frames_in_flight", type=int, help="Maximum frames waiting to be saved, whatever the RAM budget", default=6) # video_script.MAX_FRAMES_IN_FLIGHT
+    parser.add_argument("-log", "--log_path", type=str, help="Daemon log file", default=os.path.expanduser("~/camera_daemon.log"))
+    return parser.parse_args()
+
+daemon_args = parse_daemon_arguments()
+if daemon_args.fake:
+    import fake_picamera2
+    fake_picamera2.install()
+
+import video_script as vs # Must come after the fake modules are installed
+from picamera2 import Picamera2, Metadata
+from libcamera import controls
+
+
+def settle_controls(picam2, gain, tolerance=0.2, max_wait_time=10):
+    """
+    Waits for frames to report the requested analogue gain. Returns the number
+    of frames this took.
+    """
+    deadline = time.time() + max_wait_time
+    frames_waited = 0
+    while time.time() < deadline:
+        metadata = Metadata(picam2.capture_metadata())
+        if abs(metadata.AnalogueGain - gain) <= tolerance:
+            return frames_waited
+        frames_waited += 1
+    raise TimeoutError(f"Analogue gain did not settle to {gain} within {max_wait_time} s")
+
+
+def apply_still_controls(picam2, request):
+    """
+    Stills use automatic exposure (as libcamera-still does) with the requested
+    gain, so any fixed exposure left by a run is cleared.
+    """
+    minimum_frame_duration, maximum_frame_duration, _ = picam2.camera_controls["FrameDurationLimits"]
+    controls_dict = {"AnalogueGain": request.get("gain", 1.0),
+                     "AeEnable": True,
+                     "FrameDurationLimits": (minimum_frame_duration, maximum_frame_duration)}
+    if request.get("lens_position") is not None:
+        controls_dict["AfMode"] = controls.AfModeEnum.Manual
+        controls_dict["LensPosition"] = request["lens_position"]
+    picam2.set_controls(controls_dict)
+    return settle_controls(picam2, controls_dict["AnalogueGain"])
+
+
+def save_request(r, path, file_format):
+    try:
+        r.make_image("main").save(path, format=file_format)
+    finally:
+        r.release()
+
+
+def handle_set_controls(picam2, request):
+    picam2.set_controls(request["controls"])
+    return {"controls": list(request["controls"])}
+
+
+def handle_still(picam2, request):
+    file_format = request.get("format", "jpeg")
+    frames_waited = apply_still_controls(picam2, request)
+    path = f"{request['path']}.{file_format}"
+    save_request(picam2.capture_request(), path, file_format)
+    return {"path": path, "settle_frames": frames_waited}
+
+
+def handle_burst(picam2, request):
+    file_format = request.get("format", "jpeg")
+    num_of_images = request["num_of_images"]
+    num_digits = len(str(num_of_images))
+    os.makedirs(request["directory"], exist_ok=True)
+    frames_waited = apply_still_controls(picam2, request)
+    paths = []
+    for i in range(1, num_of_images + 1):
+        path = f"{request['directory']}/burst_image_{i:0{num_digits}d}.{file_format}"
+        save_request(picam2.capture_request(), path, file_format)
+        paths.append(path)
+    return {"paths": paths, "settle_frames": frames_waited}
+
+
+def parse_run_arguments(picam2, request, expected_command):
+    try:
+        args = vs.parse_arguments(request["argv"])
+    except SystemExit: # argparse exits on invalid arguments
+        raise ValueError(f"Invalid {expected_command} arguments: {request['argv']}")
+    if args.command != expected_command:
+        raise ValueError(f"Expected {expected_command} arguments, got {args.command}")
+    if args.stream_target == "-":
+        raise ValueError("The daemon's stdout carries the protocol - stream to a FIFO instead")
+    vs.check_crop_window(picam2, args)
+    return args
+
+
+def handle_main_run(picam2, request):
+    """
+    Same steps as video_script.main_run, but the camera is already configured
+    and running - only the controls are changed. With -log, the run's log goes
+    to its metadata.log as well as the daemon log.
+    """
+    args = parse_run_arguments(picam2, request, "main_run")
+    start_time = time.time()
+    vs.check_directory_exists(args.directory_name)
+    log_handler = vs.setup_logging(args.directory_name) if args.logging else None
+    args.frame_streamer = vs.open_frame_streamer(args)
+    try:
+        frame_duration = vs.convert_framerate_to_frame_duration(args.frame_rate)
+        picam2.set_controls(vs.build_controls_dict(args, frame_duration, gain=args.gain))
+        if args.reduce:
+            vs.take_main_run_images_reduced(picam2, args, frame_duration, start_time)
+        elif args.pipeline_workers:
+            frames_in_flight = max(1, picam2.camera_config["buffer_count"] - 1)
+            vs.take_main_run_images_pipelined(picam2, args, frame_duration, start_time, frames_in_flight)
+        else:
+            vs.take_main_run_images(picam2, args, frame_duration, start_time)
+        vs.finish_transfer(args, start_time)
+    finally:
+        if args.frame_streamer is not None:
+            args.frame_streamer.close()
+        if log_handler is not None:
+            vs.stop_logging(log_handler)
+    return {"directory": args.directory_name, "duration": vs.get_relative_time(start_time),
+            "stream_broken": args.frame_streamer is not None and args.frame_streamer.broken}
+
+
+def handle_test_run(picam2, request):
+    args = parse_run_arguments(picam2, request, "test_run")
+    start_time = time.time()
+    vs.check_directory_exists(args.directory_name)
+    log_handler = vs.setup_logging(args.directory_name) if args.logging else None
+    args.frame_streamer = vs.open_frame_streamer(args)
+    try:
+        frame_duration = vs.convert_framerate_to_frame_duration(args.frame_rate)
+        picam2.set_controls(vs.build_controls_dict(args, frame_duration))
+        vs.take_test_run_images(picam2, args, frame_duration, start_time)
+        vs.finish_transfer(args, start_time)
+    finally:
+        if args.frame_streamer is not None:
+            args.frame_streamer.close()
+        if log_handler is not None:
+            vs.stop_logging(log_handler)
+    return {"directory": args.directory_name, "duration": vs.get_relative_time(start_time),
+            "stream_broken": args.frame_streamer is not None and args.frame_streamer.broken}
+
+
+def handle_ping(picam2, request):
+    return {"time": time.time()}
+
+
+COMMAND_HANDLERS = {
+    "set_controls": handle_set_controls,
+    "still": handle_still,
+    "burst": handle_burst,
+    "main_run": handle_main_run,
+    "test_run": handle_test_run,
+    "ping": handle_ping,
+    "shutdown": handle_ping,
+}
+
+
+def write_message(protocol_output, message: dict):
+    protocol_output.write(json.dumps(message) + "\n")
+    protocol_output.flush()
+
+
+def serve(picam2, protocol_input, protocol_output):
+    write_message(protocol_output, {"status": "ready", "pid": os.getpid()})
+    for line in protocol_input:
+        if not line.strip():
+            continue
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            command = request["command"]
+            if command not in COMMAND_HANDLERS:
+                raise ValueError(f"Unknown command {command}")
+            result = COMMAND_HANDLERS[command](picam2, request)
+            write_message(protocol_output, {"id": request_id, "status": "ok", "result": result})
+        except Exception as e:
+            logging.exception(f"Error handling request {request_id}: {e}")
+            write_message(protocol_output, {"id": request_id, "status": "error", "error": str(e)})
+            continue
+        if command == "shutdown":
+            break
+
+
+def main():
+    protocol_output = sys.stdout
+    sys.stdout = sys.stderr
+    logging.basicConfig(filename=daemon_args.log_path, level=logging.INFO,
+                        format='%(asctime)s - %(message)s', filemode='a')
+
+    picam2 = Picamera2()
+    try:
+        vs.configure_camera_for_pipelining(picam2, daemon_args)
+        picam2.start()
+        serve(picam2, sys.stdin, protocol_output)
+    finally:
+        picam2.stop()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,16 @@
 from src.classes.Pi import Pi
 from src.classes.Camera import ImageSettings, PhotoContext, ImageTestSettings
 import cv2
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
 import os
 import base64
 import numpy as np
-from typing import List, Dict
+from typing import AsyncIterator, List, Dict
 from src.database.CRUD import CRISP_database_interaction as cdi
+from src.pi_broker import pi_broker_function
+from src.pi_orchestration import PiOperation, PiResult, run_on_pis, run_on_pis_blocking
+from src.clock_alignment import measure_clock_offset
+from src.preview_broadcaster import get_preview_broadcaster
 from src.calibration_functions import determine_frame_size
 from src.classes.JSON_request_bodies import request_bodies as rb
 
@@ -19,6 +23,7 @@ def get_image_bytestring_frame_size(image_byte_string: str):
     image = load_image_byte_string_to_opencv(image_byte_string)
     return determine_frame_size(image=image)
 
+@pi_broker_function
 def take_single_image(username: str, imageSettings: ImageSettings|ImageTestSettings, context: PhotoContext):
     
     try:
@@ -27,8 +32,9 @@ def take_single_image(username: str, imageSettings: ImageSettings|ImageTestSetti
         if (pi := Pi.get_pi_with_username(username)) is None:
             raise Exception(f"No pi instantiated with the username {username}")
         
-        camera_settings_link_id, full_file_path = pi.camera.capture_image(imageSettings, context)
-        added_photo_id = pi.camera.transfer_image(imageSettings, camera_settings_link_id, full_file_path)
+        with pi.command_queue.turn():
+            camera_settings_link_id, full_file_path = pi.camera.capture_image(imageSettings, context)
+            added_photo_id = pi.camera.transfer_image(imageSettings, camera_settings_link_id, full_file_path)
         photo_bytes = cdi.get_photo_from_id(photo_id=added_photo_id)
         return photo_bytes, added_photo_id
     
@@ -38,11 +44,13 @@ def take_single_image(username: str, imageSettings: ImageSettings|ImageTestSetti
 
 def imaging_helper(pi, imageSettings, context):
     
-        camera_settings_link_id, full_file_path = pi.camera.capture_image(imageSettings, context)
-        added_photo_id = pi.camera.transfer_image(imageSettings, camera_settings_link_id, full_file_path)
+        with pi.command_queue.turn():
+            camera_settings_link_id, full_file_path = pi.camera.capture_image(imageSettings, context)
+            added_photo_id = pi.camera.transfer_image(imageSettings, camera_settings_link_id, full_file_path)
         photo_bytes = cdi.get_photo_from_id(photo_id=added_photo_id)
         return [photo_bytes, added_photo_id]
 
+@pi_broker_function
 def take_multiple_images(usernames_list: List[str], imageSettings_list: List[ImageSettings], context: PhotoContext):
 
     try:
@@ -53,13 +61,13 @@ def take_multiple_images(usernames_list: List[str], imageSettings_list: List[Ima
             disconnected_usernames = [usernames_list[i] for i in pi_indices]
             raise ValueError(f"The following Raspberry Pis have disconnected: {disconnected_usernames}")
         
+        operations = {count: PiOperation(pi.username, imaging_helper, (pi, imageSettings, context))
+                      for count, (pi, imageSettings) in enumerate(zip(pis_to_image_with, imageSettings_list))}
         results_array = []
-        with ThreadPoolExecutor() as executor:
-            futures = [executor.submit(imaging_helper, pi, imageSettings, context) for pi, imageSettings in zip(pis_to_image_with , imageSettings_list)] 
-            for future in as_completed(futures):
-                result = future.result()
-                # ERROR HANDLING HERE!
-                results_array.append(result)
+        for pi_result in run_on_pis_blocking(operations).values():
+            if not pi_result.succeeded:
+                raise Exception(f"{pi_result.label}: {pi_result.error}")
+            results_array.append(pi_result.result)
                 
         # If done correctly, this will be an array of tuples each containing a photo bytestring and photo id
         return np.array(results_array) # ndarray so can do slicing on it
@@ -68,39 +76,78 @@ def take_multiple_images(usernames_list: List[str], imageSettings_list: List[Ima
         print(f"Error taking multiple images at once: {e}")
     
     
-def stream_video_feed(username: str):
+@pi_broker_function
+def stream_video_feed(username: str, width: int | None = None):
+    """
+    Every viewer of a camera shares one decoded stream - see preview_broadcaster.
+    """
     try:
         if (pi := Pi.get_pi_with_username(username)) is None:
             raise Exception(f"No Pi instantiated with the username {username}")
         
-        success = pi.camera.stream_to_local_device()
-        if success:
-            print("D")
-            cap = pi.camera.start_stream_capture()
-            
-            print("E")
-            while True:
-                ret, frame = cap.read()
-                if not ret:
-                    break
-
-                ret, jpeg = cv2.imencode('.jpg', frame)
-                if not ret:
-                    print("Error encoding frame")
-                    continue
-
-                yield (b'--frame\r\n' +
-                       b'Content-Type: image/jpeg\r\n\r\n' + jpeg.tobytes() + b'\r\n\r\n')
+        for jpeg in get_preview_broadcaster(username, pi.camera).subscribe(width):
+            yield (b'--frame\r\n' +
+                   b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n\r\n')
     
     except Exception as e:
         print(f"Error streaming video: {e}")
-    
-    finally:
-        if 'cap' in locals():  # locals() returns a dictionary of declared variables in scope
-            cap.release()
             
+def get_username_by_camera_settings_link_id(camera_settings_link_id: int):
+    camera_id = cdi.get_camera_and_settings_ids(camera_settings_link_id)["camera_id"]
+    return cdi.get_username_from_camera_id(camera_id)
+
+def get_photo_id_arrays(pi_results: Dict[int, PiResult], run_name: str) -> Dict[int, List[int]]:
+    results = {}
+    for camera_settings_link_id, pi_result in pi_results.items():
+        if not pi_result.succeeded:
+            print(f"Error in {run_name} video capture for image with camera setting link id: {camera_settings_link_id}: {pi_result.error}")
+            results[camera_settings_link_id] = [] # Store an empty list in case of failure
+        else:
+            results[camera_settings_link_id] = pi_result.result
+    return results
+
+############# RUN DEADLINES #########################
+
+# Runs on more Pis than this wait for one to finish (None for no limit), e.g. if the link can't carry every Pi's frames at once
+MAX_CONCURRENT_PI_RUNS = None
+# A Pi's run is cancelled if it takes this many times its capture duration, plus the margin (s) for start up and transfer
+RUN_DEADLINE_FACTOR = 3
+RUN_DEADLINE_MARGIN = 120
+
+def get_run_deadline(camera_settings_link_id_array: List[int]):
+    capture_duration = 0
+    for camera_settings_link_id in camera_settings_link_id_array:
+        settings = cdi.get_settings_by_id(cdi.get_settings_id_by_camera_settings_id(camera_settings_link_id))
+        number_of_images = cdi.get_number_of_images_to_capture_by_camera_settings_link_id(camera_settings_link_id) or 0
+        capture_duration += number_of_images / settings.frame_rate
+    return RUN_DEADLINE_FACTOR * capture_duration + RUN_DEADLINE_MARGIN
+
+@pi_broker_function
+def cancel_run_on_pi(username: str):
+    if (pi := Pi.get_pi_with_username(username)) is None:
+        raise Exception(f"No Pi instantiated with the username {username}")
+    pi.camera.cancel_run()
+
+def run_operation(label: str, function, args: tuple, camera_settings_link_id_array: List[int]) -> PiOperation:
+    return PiOperation(label, function, args, deadline=get_run_deadline(camera_settings_link_id_array),
+                       cancel=lambda: cancel_run_on_pi(label))
+
+def get_camera_run_statuses(pi_results: Dict[int, PiResult]) -> List[rb.CameraRunStatus]:
+    """
+    The photos of a Pi that failed or timed out part way are kept - streamed runs
+    add each frame as it arrives - so they are counted from the database.
+    """
+    return [rb.CameraRunStatus(camera_settings_link_id=camera_settings_link_id,
+                               username=pi_result.label,
+                               status=pi_result.status,
+                               error=None if pi_result.succeeded else str(pi_result.error),
+                               duration=pi_result.latency,
+                               number_of_photos=len(cdi.get_successfully_captured_photo_ids_by_camera_settings_link_id(camera_settings_link_id)))
+            for camera_settings_link_id, pi_result in pi_results.items()]
+
 ############# MAIN BEAM RUN #########################
 
+@pi_broker_function
 def take_single_video_for_main_run(experiment_id, camera_settings_link_id):
     try:
         camera_id = cdi.get_camera_and_settings_ids(camera_settings_link_id)["camera_id"]
@@ -109,40 +156,77 @@ def take_single_video_for_main_run(experiment_id, camera_settings_link_id):
         if (pi := Pi.get_pi_with_username(username)) is None:
             raise Exception(f"No Pi instantiated with the username {username}")
         
-        if not pi.camera.check_video_script_exists():
-            raise Exception("Video script could not be accessed on pi")
-        
         beam_run_id = cdi.get_beam_run_id_by_camera_settings_link_id(camera_settings_link_id)
-        pi.camera.run_main_run_script(experiment_id, beam_run_id, camera_settings_link_id)
-        
-        photo_id_array = pi.camera.transfer_video_frames(experiment_id, beam_run_id, context="real")
-        return photo_id_array
+        with pi.command_queue.turn():
+            if not pi.camera.check_video_script_exists():
+                raise Exception("Video script could not be accessed on pi")
+            
+            if pi.camera.stream_video_frames:
+                return pi.camera.run_main_run_script_streamed(experiment_id, beam_run_id, camera_settings_link_id)
+            
+            pi.camera.run_main_run_script(experiment_id, beam_run_id, camera_settings_link_id)
+            photo_id_array = pi.camera.transfer_video_frames(experiment_id, beam_run_id, context="real")
+            return photo_id_array
         
     except Exception as e:
         print(f"Error taking video on {username}: {e}")
         raise
 
+@pi_broker_function
+def measure_clock_offset_for_main_run(camera_settings_link_id):
+    username = get_username_by_camera_settings_link_id(camera_settings_link_id)
+    if (pi := Pi.get_pi_with_username(username)) is None:
+        raise Exception(f"No Pi instantiated with the username {username}")
+    clock_offset = measure_clock_offset(pi.ssh_client)
+    cdi.update_clock_offset(camera_settings_link_id, clock_offset.sensor_clock_offset,
+                            clock_offset.wall_clock_offset, clock_offset.uncertainty)
+    print(f"Clock offset {clock_offset.wall_clock_offset / 10**6:.3f} ms (+/- {clock_offset.uncertainty / 10**6:.3f} ms)")
+    return clock_offset
+
+def clock_offset_operations(camera_settings_link_id_array) -> Dict[int, PiOperation]:
+    return {camera_settings_link_id: PiOperation(get_username_by_camera_settings_link_id(camera_settings_link_id),
+                                                 measure_clock_offset_for_main_run, (camera_settings_link_id,))
+            for camera_settings_link_id in camera_settings_link_id_array}
+
+async def measure_clock_offsets_for_main_run(camera_settings_link_id_array):
+    """
+    Measured on every Pi at once just before the run. A Pi whose offset can't be
+    measured still takes its frames - they just can't be synchronised with the others'.
+    """
+    operations = await asyncio.to_thread(clock_offset_operations, camera_settings_link_id_array)
+    async for pi_result in run_on_pis(operations):
+        if not pi_result.succeeded:
+            print(f"Clock offset of camera settings link id {pi_result.key} not measured: {pi_result.error}")
+
+def main_run_operations(experiment_id, camera_settings_link_id_array) -> Dict[int, PiOperation]:
+    return {camera_settings_link_id: run_operation(get_username_by_camera_settings_link_id(camera_settings_link_id),
+                                                   take_single_video_for_main_run, (experiment_id, camera_settings_link_id),
+                                                   [camera_settings_link_id])
+            for camera_settings_link_id in camera_settings_link_id_array}
+
+async def take_multiple_videos_for_main_run_as_completed(experiment_id, camera_settings_link_id_array,
+                                                         max_concurrent=MAX_CONCURRENT_PI_RUNS) -> AsyncIterator[PiResult]:
+    """
+    Yields each Pi's result (keyed by its camera settings link id) as soon as that Pi
+    finishes, fails or is cancelled for missing its deadline.
+    """
+    await measure_clock_offsets_for_main_run(camera_settings_link_id_array)
+    operations = await asyncio.to_thread(main_run_operations, experiment_id, camera_settings_link_id_array)
+    async for pi_result in run_on_pis(operations, max_concurrent=max_concurrent):
+        yield pi_result
+
 def take_multiple_videos_for_main_run(experiment_id, camera_settings_link_id_array) -> Dict[str, List[str]]:
     """
-    Executes video recording for multiple users in parallel using ThreadPoolExecutor.
-    Returns a dictionary where each username maps to their photo ID array.
+    Executes video recording for multiple users in parallel.
+    Returns a dictionary where each camera settings link id maps to its photo ID array.
     """
-    results = {}
-    with ThreadPoolExecutor() as executor:
-        # The executor is the key, the username is the value in the futures dict
-        futures = {executor.submit(take_single_video_for_main_run, experiment_id, camera_settings_link_id): camera_settings_link_id 
-                   for camera_settings_link_id in camera_settings_link_id_array}
-        for future in futures:
-            camera_settings_link_id = futures[future] # way to map futures.result() to a dict with username as the key
-            try:
-                results[camera_settings_link_id] = future.result()  # Store result in dictionary
-            except Exception as e:
-                print(f"Error in main run video capture for image with camera setting link id: {camera_settings_link_id}: {e}")
-                results[camera_settings_link_id] = []  # Store an empty list in case of failure
-    return results
+    asyncio.run(measure_clock_offsets_for_main_run(camera_settings_link_id_array))
+    pi_results = run_on_pis_blocking(main_run_operations(experiment_id, camera_settings_link_id_array), MAX_CONCURRENT_PI_RUNS)
+    return get_photo_id_arrays(pi_results, "main run")
 
 ############# TEST BEAM RUN #########################
 
+@pi_broker_function
 def take_single_video_for_test_run(experiment_id, camera_settings_link_id_array):
     try:
         camera_id = cdi.get_camera_and_settings_ids(camera_settings_link_id_array[0])["camera_id"]
@@ -150,35 +234,42 @@ def take_single_video_for_test_run(experiment_id, camera_settings_link_id_array)
         if (pi := Pi.get_pi_with_username(username)) is None:
             raise Exception(f"No Pi instantiated with the username {username}")
         
-        if not pi.camera.check_video_script_exists():
-            raise Exception("Video script could not be accessed on pi")
-        
         beam_run_id = cdi.get_beam_run_id_by_camera_settings_link_id(camera_settings_link_id_array[0])
-        pi.camera.run_test_run_script(experiment_id, beam_run_id, camera_settings_link_id_array)
-        photo_id_array = pi.camera.transfer_video_frames(experiment_id, beam_run_id, context="test")
-        return photo_id_array
+        with pi.command_queue.turn():
+            if not pi.camera.check_video_script_exists():
+                raise Exception("Video script could not be accessed on pi")
+            
+            if pi.camera.stream_video_frames:
+                return pi.camera.run_test_run_script_streamed(experiment_id, beam_run_id, camera_settings_link_id_array)
+            
+            pi.camera.run_test_run_script(experiment_id, beam_run_id, camera_settings_link_id_array)
+            photo_id_array = pi.camera.transfer_video_frames(experiment_id, beam_run_id, context="test")
+            return photo_id_array
         
     except Exception as e:
         print(f"Error taking video on {username}: {e}")
         raise
 
 
+def test_run_operations(experiment_id, list_of_csl_id_lists) -> Dict[int, PiOperation]:
+    """
+    Keyed by the first camera settings link id of each Pi's list.
+    """
+    return {camera_settings_link_id_array[0]: run_operation(get_username_by_camera_settings_link_id(camera_settings_link_id_array[0]),
+                                                            take_single_video_for_test_run, (experiment_id, camera_settings_link_id_array),
+                                                            camera_settings_link_id_array)
+            for camera_settings_link_id_array in list_of_csl_id_lists}
+
+async def take_multiple_videos_for_test_run_as_completed(experiment_id, list_of_csl_id_lists,
+                                                         max_concurrent=MAX_CONCURRENT_PI_RUNS) -> AsyncIterator[PiResult]:
+    operations = await asyncio.to_thread(test_run_operations, experiment_id, list_of_csl_id_lists)
+    async for pi_result in run_on_pis(operations, max_concurrent=max_concurrent):
+        yield pi_result
+
 def take_multiple_videos_for_test_run(experiment_id, list_of_csl_id_lists) -> Dict[str, List[str]]:
     """
-    Executes video recording for multiple users in parallel using ThreadPoolExecutor.
-    Returns a dictionary where each username maps to their photo ID array.
+    Executes video recording for multiple users in parallel.
+    Returns a dictionary where the first camera settings link id of each list maps to its photo ID array.
     """
-    results = {}
-    with ThreadPoolExecutor() as executor:
-        # The executor is the key, the link id array is the value in the futures dict
-        futures = {executor.submit(take_single_video_for_test_run, experiment_id, camera_settings_link_id_array): camera_settings_link_id_array 
-                   for camera_settings_link_id_array in list_of_csl_id_lists}
-
-        for future in futures:
-            camera_settings_link_id_array = futures[future] # way to map futures.result() to a dict with username as the key
-            try:
-                results[camera_settings_link_id_array[0]] = future.result()  # To acess the result of the test, the dict key is the csl_id of the first 
-            except Exception as e:
-                print(f"Error in test run video capture for image with camera setting link id: {camera_settings_link_id_array}: {e}")
-                results[camera_settings_link_id_array[0]] = []  # Store an empty list in case of failure
-    return results
\ No newline at end of file
+    pi_results = run_on_pis_blocking(test_run_operations(experiment_id, list_of_csl_id_lists), MAX_CONCURRENT_PI_RUNS)
+    return get_photo_id_arrays(pi_results, "test run")
\ No newline at end of file
@@ -6,9 +6,21 @@ import os
 import tarfile
 import numpy as np
 import re
+import json
+import shlex
+import hashlib
+import threading
+import tempfile
+import time
 
 from src.classes.JSON_request_bodies import request_bodies as rb
+from src.classes.CameraDaemon import CameraDaemon
+from src.classes.PersistentSFTP import PersistentSFTP
+from src.classes.PiRegistry import PiCommandQueue
+from src.frame_stack_store import FrameStackIngest
 from src.database.CRUD import CRISP_database_interaction as cdi
+from src.sensor_crop import determine_crop_window, get_scintillator_window, inset_window
+from src.transfer_codec import get_codec_from_archive_name, open_decompressed_stream
 from enum import Enum
 
 class PhotoContext(Enum): #TODO either set by the api calling it or is a path variable (idk)
@@ -24,6 +36,12 @@ def write_bytes_to_file(image_bytes: bytes, output_path: str):
     except Exception as e:
         raise RuntimeError(f"An error occurred while writing the file: {e}") from e
 
+class FrameStreamBroken(Exception):
+    """
+    The frame stream of a run broke but the run carried on, so the Pi packaged its
+    frames into a tarball - transfer_video_frames gets those not already streamed.
+    """
+
 class ImageSettings(BaseModel):
     """
     Possible extra settings:
@@ -93,13 +111,27 @@ class CalibrationImageSettings(ImageSettings):
         )
     
 
+local_script_hashes = {} # Script path: (modification time, sha256)
+
+def get_local_script_hash(script_path: str):
+    """
+    Cached until the script is modified, so runs don't rehash the scripts.
+    """
+    modification_time = os.path.getmtime(script_path)
+    if (cached_hash := local_script_hashes.get(script_path)) is None or cached_hash[0] != modification_time:
+        with open(script_path, "rb") as script_file:
+            local_script_hashes[script_path] = (modification_time, hashlib.sha256(script_file.read()).hexdigest())
+    return local_script_hashes[script_path][1]
+
 class Camera():
   
-  def __init__(self, username, cameraModel, ssh_client):
+  def __init__(self, username, cameraModel, ssh_client, persistent_sftp: PersistentSFTP, command_queue: PiCommandQueue):
     
     self.username = username
     self.cameraModel = cameraModel
     self.ssh_client = ssh_client # Hopefully, this is a reference to the Pi SSH Client?
+    self.persistent_sftp = persistent_sftp # The Pi's SFTP session, shared by every transfer
+    self.command_queue = command_queue # The Pi's - taken by anything that stops the camera daemon
     self.sftp_client = None # Needs to be opened with the Camera method
 
     self.remote_root_directory = f"/home/{self.username}" 
@@ -116,19 +148,54 @@ class Camera():
     self.stream_framerate = 30
     self.stream_bitrate = "1k" # was 1M before
     
+    self.local_script_directory = "/code/src" # Scripts copied to the Pi are kept in sync with these
     self.video_script_filename = "video_script.py"
+    # Writer threads, RAM (MB) and most frames waiting for a writer (each holds a camera buffer) for pipelined
+    # main run capture on the Pi
+    self.main_run_pipeline_workers = 2
+    self.main_run_ram_budget = 1024
+    self.main_run_max_frames_in_flight = 6
+    # Read frames from the script's stdout as they are saved, rather than a tarball after the run
+    self.stream_video_frames = True
+    # Compression of the frames sent back ("none", "zstd" or "lz4") - the codec's package is needed on the Pi and here.
+    # Pays off for PNG/16-bit frames on a slow link, see benchmarks/transfer_codec_benchmark.py
+    self.transfer_codec = "none"
+    self.transfer_codec_level = None
+    self.transfer_codec_filename = "transfer_codec.py"
+    # Tarball transfers (when not streaming) - reads of this size are prefetched, this many at once
+    self.sftp_read_chunk_size = 255 * 2**10 # OpenSSH's sftp-server returns short reads above this
+    self.sftp_max_concurrent_requests = 64
+    self.sftp_spool_size = 512 * 2**20 # Tarballs larger than this are spooled to disk rather than RAM
+    self.last_transfer_rate = None # MB/s
+    self.transfer_attempts = 3 # A dropped read resumes from the bytes already received
+    # Only encode the scintillator (plus this many pixels either side) in run frames
+    self.crop_to_scintillator = True
+    self.crop_margin = 100
+    # Test runs - the Pi reports saturation inside the scintillator, so the optimal gain needs no frames decoding
+    self.saturation_threshold = 250
+    self.test_run_statistics_only = False # The test run overlays in the GUI need the images
+    # Stills and runs go through a camera_daemon.py process kept running on the Pi,
+    # instead of a libcamera-still/video_script.py process (and camera start up) per call
+    self.use_camera_daemon = True
+    self.camera_daemon_filename = "camera_daemon.py"
+    self.camera_daemon = None
+    self.camera_daemon_fifo_path = f"{self.remote_root_directory}/camera_daemon_frames.fifo"
+    self.run_channels = set() # Channels of the run in progress, closed by cancel_run
+    # A streamed script that hasn't exited this long (s) after its stream fails is still capturing - the stream broke
+    self.stream_exit_wait_time = 1.0
+    self.stream_exit_poll_interval = 1.0
     
   def __del__(self):
         print(f"Destroying Camera object for {self.username} {self.cameraModel}")
     
   def open_sftp(self):
-    self.sftp_client = self.ssh_client.open_sftp()
-    self.sftp_status = True
+    self.sftp_client = self.persistent_sftp.get_client()
 
-  def close_sftp(self):
-     if self.sftp_status:
-        self.sftp_client.close()
-        self.sftp_status = False
+  def release_sftp(self):
+    """
+    The session stays open for the next transfer - Pi.close_ssh_connection closes it.
+    """
+    self.sftp_client = None
         
   def generate_file_path(self, context: PhotoContext):
       match context:
@@ -167,6 +234,30 @@ class Camera():
     except Exception as e:
         raise Exception(f"Error when checking remote image directory exists: {e}")
     
+  def capture_still(self, full_file_path: str, imageSettings: ImageSettings|ImageTestSettings, lens_position=None):
+    """
+    Saves a still to {full_file_path}.{format} on the Pi. The daemon's camera is
+    already running, so it only waits for the new gain to reach the frames,
+    rather than the libcamera-still time delay.
+    """
+    if self.use_camera_daemon:
+        self.get_camera_daemon().send_command("still", path=full_file_path, gain=imageSettings.gain,
+                                              lens_position=lens_position, format=imageSettings.format)
+        return
+
+    lens_position = f"--lens-position {lens_position}" if lens_position is not None else ""
+    command = f"libcamera-still -o {full_file_path}.{imageSettings.format} -t {imageSettings.timeDelay} --gain {imageSettings.gain} -n {lens_position}"
+    timeout=30 #TODO temporary
+    stdin, stdout, stderr = self.ssh_client.exec_command(command, timeout=timeout)
+    
+    output = stdout.read().decode().strip()
+    error = stderr.read().decode().strip() # TODO maybe the warnings here can be logged
+    stdin.close()
+    
+    exit_status = stdout.channel.recv_exit_status()
+    if exit_status != 0:  # Only raise an error if the command failed
+        raise Exception(f"Command '{command}' failed with exit status {exit_status}:\n{error}")
+
   def capture_image(self, imageSettings: ImageSettings|ImageTestSettings, context: PhotoContext):
         try:
             print("\n\n\n\n\n I've started adding all the settings")
@@ -199,19 +290,7 @@ class Camera():
         try:
             print("\n\n\n\n\n I will try to create the file")
         
-            lens_position = f"--lens-position {lens_position}" if lens_position is not None else ""
-            
-            command = f"libcamera-still -o {full_file_path}.{imageSettings.format} -t {imageSettings.timeDelay} --gain {imageSettings.gain} -n {lens_position}"
-            timeout=30 #TODO temporary
-            stdin, stdout, stderr = self.ssh_client.exec_command(command, timeout=timeout)
-            
-            output = stdout.read().decode().strip()
-            error = stderr.read().decode().strip() # TODO maybe the warnings here can be logged
-            stdin.close()
-            
-            exit_status = stdout.channel.recv_exit_status()
-            if exit_status != 0:  # Only raise an error if the command failed
-                raise Exception(f"Command '{command}' failed with exit status {exit_status}:\n{error}")
+            self.capture_still(full_file_path, imageSettings, lens_position)
             
             print("\n\n\n\n\n I created the file")
             print(camera_settings_link_id)
@@ -238,17 +317,7 @@ class Camera():
         try:
             print("\n\n\n\n\n I will try to create the file")
             
-            command = f"libcamera-still -o {full_file_path}.{imageSettings.format} -t {imageSettings.timeDelay} --gain {imageSettings.gain} -n"#TODO changed for testing without camera
-            timeout=30 #TODO temporary
-            stdin, stdout, stderr = self.ssh_client.exec_command(command, timeout=timeout)
-            
-            output = stdout.read().decode().strip()
-            error = stderr.read().decode().strip() # TODO maybe the warnings here can be logged
-            stdin.close()
-            
-            exit_status = stdout.channel.recv_exit_status()
-            if exit_status != 0:  # Only raise an error if the command failed
-                raise Exception(f"Command '{command}' failed with exit status {exit_status}:\n{error}")
+            self.capture_still(full_file_path, imageSettings)
             
             print("\n\n\n\n\n I created the file")
             print(camera_settings_link_id)
@@ -314,10 +383,7 @@ class Camera():
         raise Exception(f"Unexpected error while reading the image: {e}")
 
     finally:
-        try:
-            self.close_sftp()
-        except Exception as e:
-            raise Exception(f"Error while closing SFTP connection: {e}")
+        self.release_sftp()
 
 
 
@@ -377,10 +443,7 @@ class Camera():
         raise Exception(f"Unexpected error while reading the image: {e}")
 
     finally:
-        try:
-            self.close_sftp()
-        except Exception as e:
-            raise Exception(f"Error while closing SFTP connection: {e}")
+        self.release_sftp()
         
 
   def transfer_image_without_writing_to_database(self, imageSettings: ImageSettings, camera_settings_link_id: int, full_file_path: str):
@@ -439,110 +502,177 @@ class Camera():
         raise Exception(f"Unexpected error while reading the image: {e}")
 
     finally:
-        try:
-            self.close_sftp()
-        except Exception as e:
-            raise Exception(f"Error while closing SFTP connection: {e}")
+        self.release_sftp()
 
 
-  def check_video_script_exists(self):
+  def get_remote_script_hashes(self, script_filenames: list[str]):
     """
-    Need to store video script file in the root, then store the 
-    images in the test run or real run directory depending on the
-    photo context. root/context/run_num/(image files here)
+    The sha256 of each script on the Pi, in one round trip. Missing scripts are left out.
     """
-    script_file_path = f"{self.remote_root_directory}/{self.video_script_filename}"
-    # Check if the script exists on the pi.
-    stdin, stdout, stderr = self.ssh_client.exec_command(f"[ -f '{script_file_path}' ] && echo true || echo false")
-    
-    output = stdout.read().decode().strip()
-    error = stderr.read().decode().strip()
-    stdin.close()
-    
-    exit_status = stdout.channel.recv_exit_status()
-    if exit_status != 0:  # Only raise an error if the command failed
-        raise Exception(f"\n\n\nError when checking video script exists: \n\nOUTPUT: {output}\n\n" +
-                        f"ERROR: {error}\n\n\n")
-    
-    if output == "true":
+    script_file_paths = " ".join(shlex.quote(f"{self.remote_root_directory}/{script_filename}") for script_filename in script_filenames)
+    _, stdout, _ = self.ssh_client.exec_command(f"sha256sum {script_file_paths} 2>/dev/null", timeout=10)
+    output = stdout.read().decode()
+    stdout.channel.recv_exit_status() # Non-zero if any script is missing
+    remote_hashes = {}
+    for line in output.splitlines():
+      sha256, script_file_path = line.split(maxsplit=1)
+      remote_hashes[os.path.basename(script_file_path)] = sha256
+    return remote_hashes
+
+  def deploy_scripts(self, script_filenames: list[str]):
+    """
+    Stores the scripts in the root of the Pi, then the images go in the test run
+    or real run directory depending on the photo context. root/context/run_num/(image files here)
+
+    Only scripts whose hash differs from the backend's copy are uploaded, so a run
+    with the scripts up to date costs one round trip and no transfer. Returns False
+    (and the run shouldn't start) if the Pi still has a different version after uploading.
+    The daemon is stopped after uploading, so this takes the Pi's command queue
+    (already held by a run deploying its scripts).
+    """
+    with self.command_queue.turn():
+      local_hashes = {script_filename: get_local_script_hash(os.path.join(self.local_script_directory, script_filename))
+                      for script_filename in script_filenames}
+      remote_hashes = self.get_remote_script_hashes(script_filenames)
+      stale_script_filenames = [script_filename for script_filename in script_filenames
+                                if remote_hashes.get(script_filename) != local_hashes[script_filename]]
+      if not stale_script_filenames:
         return True
-    
-    try:
+
+      print(f"Uploading {', '.join(stale_script_filenames)} to {self.username}")
+      try:
         self.open_sftp()
-        local_script_path = os.path.join("/code/src", self.video_script_filename)  
-        self.sftp_client.put(local_script_path, script_file_path)
-        stdin, stdout, stderr = self.ssh_client.exec_command(f"[ -f '{script_file_path}' ] && echo true || echo false")
-        output = stdout.read().decode().strip()
-        return output == "true" # will be False if script not found
+        for script_filename in stale_script_filenames:
+          self.sftp_client.put(os.path.join(self.local_script_directory, script_filename),
+                               f"{self.remote_root_directory}/{script_filename}")
+      except Exception as e:
+        raise Exception(f"Error transferring {', '.join(stale_script_filenames)} to Pi: {e}")
+      finally:
+        self.release_sftp()
+      self.stop_camera_daemon() # It has the old versions imported - restarted on next use
+
+      remote_hashes = self.get_remote_script_hashes(stale_script_filenames)
+      if mismatched_script_filenames := [script_filename for script_filename in stale_script_filenames
+                                         if remote_hashes.get(script_filename) != local_hashes[script_filename]]:
+        print(f"{', '.join(mismatched_script_filenames)} on {self.username} still differ from the backend's after uploading")
+        return False
+      return True
+
+  def check_video_script_exists(self):
+    script_filenames = [self.video_script_filename, self.transfer_codec_filename] # transfer_codec is imported by video_script
+    if self.use_camera_daemon: # The daemon imports video_script, so both are needed
+      script_filenames.append(self.camera_daemon_filename)
+    return self.deploy_scripts(script_filenames)
+
+  def get_camera_daemon(self):
+    """
+    Starts the daemon on first use (or if it has exited), otherwise returns the running one.
+    """
+    if self.camera_daemon is not None and self.camera_daemon.is_running():
+        return self.camera_daemon
+    if not self.check_video_script_exists():
+        raise Exception("Camera daemon script could not be accessed on pi")
+    self.camera_daemon = CameraDaemon(self.ssh_client, self.remote_root_directory, self.camera_daemon_filename,
+                                      self.main_run_pipeline_workers, self.main_run_ram_budget,
+                                      self.main_run_max_frames_in_flight)
+    self.camera_daemon.start()
+    return self.camera_daemon
+
+  def stop_camera_daemon(self):
+    """
+    Frees the camera for other processes (e.g. libcamera-vid for the stream).
+    """
+    if self.camera_daemon is not None:
+        self.camera_daemon.stop()
+        self.camera_daemon = None
 
-    except Exception as e:
-        raise Exception(f"Error transferring video script to Pi: {e}")
-    finally:
-        self.close_sftp()
-        
   @staticmethod
   def source_camera_settings(camera_settings_link_id: int):
     settings_id = cdi.get_camera_and_settings_ids(camera_settings_link_id)["settings_id"]
     settings = cdi.get_settings_by_id(settings_id)
     return settings.frame_rate, settings.lens_position, settings.gain
     
-  def run_main_run_script(self, experiment_id, beam_run_id, camera_settings_link_id: int):
+  def build_crop_argument(self, camera_settings_link_id_array):
     """
-    If script not found on pi, transfer script from here to the pi.
-    Then run SSH command with flags from rb.VideoSettings
+    The window is recorded on each camera settings link, so analysis can map
+    the cropped frames back to full frame pixels. No crop if the scintillator
+    edges have not been set for this camera.
     """
+    if not self.crop_to_scintillator:
+        return ""
+    crop_window, full_frame_size = determine_crop_window(camera_settings_link_id_array[0], self.crop_margin)
+    if crop_window is None:
+        print(f"No scintillator edges for {self.username}, frames will not be cropped")
+        return ""
+    for camera_settings_link_id in camera_settings_link_id_array:
+        cdi.update_crop_window(camera_settings_link_id, crop_window, full_frame_size)
+    return "-crop {} {} {} {}".format(*crop_window)
+
+  def build_transfer_codec_argument(self):
+    level = f"-tcl {self.transfer_codec_level}" if self.transfer_codec_level is not None else ""
+    return f"-tc {self.transfer_codec} {level}"
+
+  def build_main_run_command(self, experiment_id, beam_run_id, camera_settings_link_id: int, stream_target=None):
     frame_rate, lens_position, gain = Camera.source_camera_settings(camera_settings_link_id)
     num_of_images = cdi.get_number_of_images_to_capture_by_camera_settings_link_id(camera_settings_link_id)
     if num_of_images is None:
         raise ValueError("Camera settings link entry can not have the empty field 'number of images' when performing a main beam run")
     raw = "-raw" if cdi.get_take_raw_images(camera_settings_link_id) else ""
+    # When reducing on the Pi, only the chosen channel is averaged and no frames are saved
+    reduced_colour_channel = cdi.get_reduced_colour_channel(camera_settings_link_id)
+    colour = reduced_colour_channel[0] if reduced_colour_channel else "all"
+    reduce = "-red" if reduced_colour_channel else ""
+    stream = f"-st {stream_target}" if stream_target else ""
+    crop = self.build_crop_argument([camera_settings_link_id])
+    codec = self.build_transfer_codec_argument()
     
     directory_name = self.experiment_directory + str(experiment_id) + self.real_run_image_directory + str(beam_run_id)
 
     command = (f"python video_script.py -dir {directory_name} " +
-            f"-lp {lens_position} {raw} " + 
-            f"-c all -fr {frame_rate} " +
+            f"-lp {lens_position} {raw} {stream} {crop} {codec} " + 
+            f"-c {colour} -fr {frame_rate} " +
             f"-f jpeg -log -b 8 " +
             f"main_run -g {gain} -num {num_of_images} " +
-            f"-csl {camera_settings_link_id}")
+            f"-csl {camera_settings_link_id} {reduce} " +
+            f"-pw {self.main_run_pipeline_workers} -ram {self.main_run_ram_budget} " +
+            f"-mif {self.main_run_max_frames_in_flight}")
     
     print(f"\n\n\n{command}\n\n\n")
-    
-    stdin, stdout, stderr = self.ssh_client.exec_command(command)
-    error = stderr.read().decode().strip()
-    output_lines = stdout.readlines()
-    last_line = output_lines[-1].strip() if output_lines else "" # Script prints "Image capture complete" when done
-    
-    if "Image capture complete" in last_line:
-        print(f"Image capture finished on {self.username}.")
-    else:
-        raise Exception(f"Command failed with error:\n{error}")
-    stdin.close()
-    return None
+    return command
 
-  def run_test_run_script(self, experiment_id, beam_run_id, camera_settings_link_id_array):
-    """
-    If script not found on pi, transfer script from here to the pi.
-    Then run SSH command with flags from rb.VideoSettings
-    """
+  def build_test_run_command(self, experiment_id, beam_run_id, camera_settings_link_id_array, stream_target=None):
     gain_list = []
     for id in camera_settings_link_id_array:
         frame_rate, lens_position, gain = Camera.source_camera_settings(id)
         gain_list.append(gain)
+    stream = f"-st {stream_target}" if stream_target else ""
+    crop = self.build_crop_argument(camera_settings_link_id_array)
+    codec = self.build_transfer_codec_argument()
+    saturation_statistics = ""
+    if (scintillator_window := get_scintillator_window(camera_settings_link_id_array[0])) is not None:
+        # The same region as the saturation check of the images (restrict_to_region_of_interest)
+        saturation_statistics = ("-roi {} {} {} {} ".format(*inset_window(scintillator_window)) + f"-sat {self.saturation_threshold} " +
+                                 ("-so" if self.test_run_statistics_only else ""))
     
     directory_name = self.experiment_directory + str(experiment_id) + self.test_run_image_directory + str(beam_run_id)
     
     command = (f"python video_script.py -dir {directory_name} " +
-            f"-lp {lens_position} " + 
+            f"-lp {lens_position} {stream} {crop} {codec} " + 
             f"-c all -fr {frame_rate} " +
             f"-f jpeg -log -b 8 " +
-            f"test_run --gain_list '{gain_list}' --cs_id_array '{camera_settings_link_id_array}'")
+            f"test_run --gain_list '{gain_list}' --cs_id_array '{camera_settings_link_id_array}' {saturation_statistics}")
     
     print(f"\n\n\n{command}\n\n\n")
-    
+    return command
+
+  def execute_video_script(self, command):
     stdin, stdout, stderr = self.ssh_client.exec_command(command)
-    error = stderr.read().decode().strip()
-    output_lines = stdout.readlines()
+    self.run_channels.add(stdout.channel)
+    try:
+        error = stderr.read().decode().strip()
+        output_lines = stdout.readlines()
+    finally:
+        self.run_channels.discard(stdout.channel)
     last_line = output_lines[-1].strip() if output_lines else "" # Script prints "Image capture complete" when done
     
     if "Image capture complete" in last_line:
@@ -551,11 +681,311 @@ class Camera():
         raise Exception(f"Command failed with error:\n{error}")
     stdin.close()
     return None
+
+  def execute_video_script_streamed(self, command):
+    """
+    The script writes each frame to stdout as a tar member once it is saved, so
+    frames are added to the database while the Pi is still capturing. Stderr
+    (where the script's prints go) is drained on another thread - otherwise it 
+    could fill the channel window and stall the stream.
+    """
+    stdin, stdout, stderr = self.ssh_client.exec_command(command)
+    self.run_channels.add(stdout.channel)
+    stderr_lines = []
+    stderr_reader = threading.Thread(target=lambda: stderr_lines.extend(stderr.readlines()), daemon=True)
+    stderr_reader.start()
+    
+    photo_ingest = cdi.PhotoIngest()
+    photo_id_array = photo_ingest.photo_ids
+    stream_error = None
+    try:
+        try:
+            with (tarfile.open(fileobj=open_decompressed_stream(stdout, self.transfer_codec), mode="r|") as tar,
+                  FrameStackIngest() as frame_stack_ingest, photo_ingest):
+                for member in tar:
+                    Camera.add_tar_member_to_database(tar, member, photo_ingest, frame_stack_ingest=frame_stack_ingest)
+        except Exception as e:
+            stream_error = e
+        # A failed run has exited, but if only the stream broke the script is still capturing
+        if stream_error is not None and not stdout.channel.status_event.wait(self.stream_exit_wait_time):
+            stdout.channel.close() # So the script's writes fail and it packages a tarball instead
+            self.wait_for_video_script_to_exit()
+            raise FrameStreamBroken(f"Frame stream broke after {len(photo_id_array)} frames ({stream_error})") from stream_error
+        exit_status = stdout.channel.recv_exit_status()
+    finally:
+        self.run_channels.discard(stdout.channel)
+    stderr_reader.join()
+    stdin.close()
+    if exit_status != 0:
+        raise Exception(f"Command failed with exit status {exit_status} after streaming {len(photo_id_array)} frames:\n{''.join(stderr_lines)}")
+    if stream_error is not None:
+        raise stream_error
+    print(f"Image capture and streaming finished on {self.username}.")
+    return photo_id_array
+
+  def wait_for_video_script_to_exit(self):
+    """
+    For a script whose channel was closed - it carries on without it. cancel_run
+    kills it, so this doesn't outlive the run's deadline.
+    """
+    while True:
+        _, stdout, _ = self.ssh_client.exec_command(f"pgrep -f '[{self.video_script_filename[0]}]{self.video_script_filename[1:]}'", timeout=10)
+        if stdout.channel.recv_exit_status() != 0: # 1 when no script is running
+            return
+        time.sleep(self.stream_exit_poll_interval)
+
+  @staticmethod
+  def command_to_daemon_argv(command):
+    """
+    The daemon takes the same arguments as video_script.py, without the "python video_script.py".
+    """
+    return shlex.split(command)[2:]
+
+  def execute_daemon_run(self, run_type: Literal["main_run", "test_run"], command):
+    result = self.get_camera_daemon().send_command(run_type, argv=Camera.command_to_daemon_argv(command))
+    print(f"Image capture finished on {self.username} in {result['duration']} s.")
+    return None
+
+  def execute_daemon_run_streamed(self, run_type: Literal["main_run", "test_run"], command):
+    """
+    The daemon's stdout carries its replies, so frames are streamed through a
+    FIFO on the Pi instead, read here with cat. If the run fails before the
+    daemon opens the FIFO, cat would wait forever, so its channel is closed.
+    """
+    camera_daemon = self.get_camera_daemon()
+    stdin, stdout, stderr = self.ssh_client.exec_command(f"rm -f {self.camera_daemon_fifo_path} && mkfifo {self.camera_daemon_fifo_path}")
+    if (exit_status := stdout.channel.recv_exit_status()) != 0:
+        raise Exception(f"Could not create frame FIFO (exit status {exit_status}): {stderr.read().decode().strip()}")
+    
+    stdin, stdout, stderr = self.ssh_client.exec_command(f"cat {self.camera_daemon_fifo_path}")
+    self.run_channels.add(stdout.channel)
+    daemon_outcome = {}
+    def run_in_daemon():
+        try:
+            daemon_outcome["result"] = camera_daemon.send_command(run_type, argv=Camera.command_to_daemon_argv(command))
+        except Exception as e:
+            daemon_outcome["error"] = e
+            stdout.channel.close()
+    daemon_thread = threading.Thread(target=run_in_daemon, daemon=True)
+    daemon_thread.start()
+    
+    photo_ingest = cdi.PhotoIngest()
+    photo_id_array = photo_ingest.photo_ids
+    stream_error = None
+    try:
+        with (tarfile.open(fileobj=open_decompressed_stream(stdout, self.transfer_codec), mode="r|") as tar,
+              FrameStackIngest() as frame_stack_ingest, photo_ingest):
+            for member in tar:
+                Camera.add_tar_member_to_database(tar, member, photo_ingest, frame_stack_ingest=frame_stack_ingest)
+    except Exception as e:
+        stream_error = e
+        stdout.channel.close() # cat exits, so the daemon's writes fail and it packages a tarball instead
+    finally:
+        self.run_channels.discard(stdout.channel)
+    daemon_thread.join()
+    stdin.close()
+    if "error" in daemon_outcome:
+        raise Exception(f"{daemon_outcome['error']} (after streaming {len(photo_id_array)} frames)")
+    if stream_error is not None:
+        if not daemon_outcome["result"].get("stream_broken"):
+            raise stream_error
+        raise FrameStreamBroken(f"Frame stream broke after {len(photo_id_array)} frames ({stream_error})") from stream_error
+    print(f"Image capture and streaming finished on {self.username} in {daemon_outcome['result']['duration']} s.")
+    return photo_id_array
+
+  def cancel_run(self):
+    """
+    Kills the run in progress on the Pi (the daemon, if it is running it) and
+    closes its channels, so the thread waiting on the run raises rather than
+    waiting forever. The daemon is restarted on next use.
+    """
+    if self.camera_daemon is not None:
+      self.camera_daemon.kill()
+      self.camera_daemon = None
+    _, stdout, _ = self.ssh_client.exec_command(f"pkill -f '[{self.video_script_filename[0]}]{self.video_script_filename[1:]}'", timeout=10)
+    stdout.channel.recv_exit_status() # 1 if there was no script running
+    for channel in list(self.run_channels):
+      channel.close()
+    print(f"Run cancelled on {self.username}")
+
+  def run_main_run_script(self, experiment_id, beam_run_id, camera_settings_link_id: int):
+    """
+    If script not found on pi, transfer script from here to the pi.
+    Then run SSH command with flags from rb.VideoSettings
+    """
+    command = self.build_main_run_command(experiment_id, beam_run_id, camera_settings_link_id)
+    if self.use_camera_daemon:
+        return self.execute_daemon_run("main_run", command)
+    return self.execute_video_script(command)
+
+  def run_test_run_script(self, experiment_id, beam_run_id, camera_settings_link_id_array):
+    """
+    If script not found on pi, transfer script from here to the pi.
+    Then run SSH command with flags from rb.VideoSettings
+    """
+    command = self.build_test_run_command(experiment_id, beam_run_id, camera_settings_link_id_array)
+    if self.use_camera_daemon:
+        return self.execute_daemon_run("test_run", command)
+    return self.execute_video_script(command)
+
+  def run_main_run_script_streamed(self, experiment_id, beam_run_id, camera_settings_link_id: int):
+    try:
+        if self.use_camera_daemon:
+            command = self.build_main_run_command(experiment_id, beam_run_id, camera_settings_link_id, stream_target=self.camera_daemon_fifo_path)
+            return self.execute_daemon_run_streamed("main_run", command)
+        command = self.build_main_run_command(experiment_id, beam_run_id, camera_settings_link_id, stream_target="-")
+        return self.execute_video_script_streamed(command)
+    except FrameStreamBroken as e:
+        return self.transfer_video_frames_after_broken_stream(experiment_id, beam_run_id, "real", e)
+
+  def run_test_run_script_streamed(self, experiment_id, beam_run_id, camera_settings_link_id_array):
+    try:
+        if self.use_camera_daemon:
+            command = self.build_test_run_command(experiment_id, beam_run_id, camera_settings_link_id_array, stream_target=self.camera_daemon_fifo_path)
+            return self.execute_daemon_run_streamed("test_run", command)
+        command = self.build_test_run_command(experiment_id, beam_run_id, camera_settings_link_id_array, stream_target="-")
+        return self.execute_video_script_streamed(command)
+    except FrameStreamBroken as e:
+        return self.transfer_video_frames_after_broken_stream(experiment_id, beam_run_id, "test", e)
+
+  def transfer_video_frames_after_broken_stream(self, experiment_id, beam_run_id, context, stream_broken: FrameStreamBroken):
+    """
+    Frames already streamed are in the database with their sha256, so only the
+    rest are added from the tarball (see find_transfer_resume_point).
+    """
+    print(f"{self.username}: {stream_broken}, transferring the rest from the run's tarball")
+    photo_id_array = self.transfer_video_frames(experiment_id, beam_run_id, context)
+    if photo_id_array is None:
+        raise Exception(f"{stream_broken}, and the run's tarball could not be transferred") from stream_broken
+    return photo_id_array
   
   @staticmethod
   def extract_csl_id(filename):
     match = re.search(r"cslID_(\d+)", filename)
     return int(match.group(1)) if match else None
+
+  @staticmethod
+  def extract_reduced_frame_count(filename):
+    match = re.search(r"reduced_frames_(\d+)", filename)
+    return int(match.group(1)) if match else None
+
+  # Set by video_script on each frame's tar header
+  FRAME_METADATA_PAX_KEY = "CRISP.frame_metadata"
+  FRAME_SHA256_PAX_KEY = "CRISP.sha256" # Streamed frames only
+
+  @staticmethod
+  def add_tar_member_to_database(tar, member, photo_ingest, manifest_sha256s=None, held_photo_ids=None, frame_stack_ingest=None):
+    """
+    A frame is added to photo_ingest (a cdi.PhotoIngest), which inserts frames in
+    batches and holds their ids in order. Other members update the database directly.
+
+    manifest_sha256s: member name -> sha256 from the Pi's transfer manifest - a frame
+    that does not match it (or the sha256 in its header, when streamed) raises.
+    held_photo_ids: sha256 -> id of frames already in the database (from an
+    earlier attempt), which are not added again.
+    frame_stack_ingest: if given, each frame is also decoded into its frame stack.
+    """
+    if not member.isfile():
+        return None
+    extracted_file = tar.extractfile(member)
+    image_bytes = extracted_file.read()
+    sha256 = hashlib.sha256(image_bytes).hexdigest()
+    if manifest_sha256s is not None and manifest_sha256s.get(member.name, sha256) != sha256:
+        raise Exception(f"{member.name} does not match its checksum in the transfer manifest")
+    if member.pax_headers.get(Camera.FRAME_SHA256_PAX_KEY, sha256) != sha256:
+        raise Exception(f"{member.name} does not match the checksum in its header")
+    
+    # Not just using the inputted array incase some of the requested test images failed to be captured
+    camera_settings_link_id = Camera.extract_csl_id(member.name)
+    
+    # Test runs send the saturation statistics of every gain in one JSON
+    if member.name.endswith(".json"):
+        saturation_statistics = json.loads(image_bytes)
+        for image_statistics in saturation_statistics["images"]:
+            cdi.update_saturation_statistics(image_statistics["cs_id"],
+                                             {"saturation_threshold": saturation_statistics["saturation_threshold"],
+                                              "roi": saturation_statistics["roi"], **image_statistics})
+        return None
+    
+    # Main runs reduced on the Pi send a single mean/variance stack instead of frames
+    if member.name.endswith(".npy"):
+        frame_count = Camera.extract_reduced_frame_count(member.name)
+        cdi.update_reduced_frame_statistics(camera_settings_link_id, image_bytes, frame_count)
+        return None
+    
+    # The frame stack needs the photo id, so the frame is decoded once its row is inserted
+    add_to_frame_stack = None
+    if frame_stack_ingest is not None:
+        add_to_frame_stack = lambda photo_id: frame_stack_ingest.add_frame(camera_settings_link_id, photo_id, image_bytes)
+    if held_photo_ids and sha256 in held_photo_ids:
+        photo_ingest.add_held(held_photo_ids[sha256], on_added=add_to_frame_stack)
+    else:
+        frame_metadata = member.pax_headers.get(Camera.FRAME_METADATA_PAX_KEY)
+        photo_metadata = json.loads(frame_metadata) if frame_metadata is not None else {}
+        photo_metadata["sha256"] = sha256 # Lets a resumed transfer recognise frames it already holds
+        photo_ingest.add(camera_settings_link_id, image_bytes, json.dumps(photo_metadata, separators=(",", ":")).encode(),
+                         on_added=add_to_frame_stack)
+  
+  def download_remote_file(self, remote_path: str, local_file, offset=0):
+    """
+    Reads the remote file from offset into local_file with up to sftp_max_concurrent_requests
+    reads in flight, so the transfer is limited by bandwidth rather than a round
+    trip per read. Returns the transfer rate in MB/s.
+    """
+    start_time = time.perf_counter()
+    with self.sftp_client.open(remote_path, "rb", bufsize=self.sftp_read_chunk_size) as remote_file:
+        file_size = remote_file.stat().st_size
+        remote_file.seek(offset)
+        remote_file.MAX_REQUEST_SIZE = self.sftp_read_chunk_size # paramiko prefetches 32 KB reads otherwise
+        remote_file.prefetch(file_size, self.sftp_max_concurrent_requests)
+        while data := remote_file.read(self.sftp_read_chunk_size):
+            local_file.write(data)
+    duration = time.perf_counter() - start_time
+    transferred_size = (file_size - offset) / 10**6
+    transfer_rate = transferred_size / duration if duration > 0 else float("inf")
+    print(f"{self.username}: transferred {transferred_size:.1f} MB in {duration:.2f} s ({transfer_rate:.1f} MB/s)")
+    return transfer_rate
+
+  def download_remote_file_resuming(self, remote_path: str, local_file, offset=0):
+    """
+    A failed read is retried from the bytes already in local_file, on a reopened
+    SFTP session if the old one dropped.
+    """
+    for attempt in range(1, self.transfer_attempts + 1):
+        try:
+            return self.download_remote_file(remote_path, local_file, offset + local_file.tell())
+        except (OSError, EOFError, paramiko.SSHException) as e:
+            if attempt == self.transfer_attempts:
+                raise
+            print(f"{self.username}: transfer of {remote_path} failed after {local_file.tell()} bytes ({e}), resuming")
+            self.open_sftp()
+
+  def read_transfer_manifest(self, remote_tar_path: str):
+    """
+    None for tarballs packaged before video_script wrote manifests.
+    """
+    try:
+        with self.sftp_client.open(f"{remote_tar_path}.manifest.json", "rb") as manifest_file:
+            return json.loads(manifest_file.read())
+    except FileNotFoundError:
+        return None
+
+  @staticmethod
+  def find_transfer_resume_point(manifest, held_photo_ids):
+    """
+    Returns the tar offset of the first file not already in the database (None
+    if every file is), and the ids of the frames before it. A compressed tarball
+    can't be entered part way through, so is read from the start - frames already
+    held are still not added again.
+    """
+    photo_id_array = []
+    if manifest is None or manifest["transfer_codec"] != "none":
+        return 0, photo_id_array
+    for entry in manifest["members"]:
+        if entry["sha256"] not in held_photo_ids:
+            return entry["offset"], photo_id_array
+        photo_id_array.append(held_photo_ids[entry["sha256"]])
+    return None, photo_id_array
   
   def transfer_video_frames(self, experiment_id, beam_run_id, context=Literal["real", "test"]):
     try:
@@ -572,7 +1002,7 @@ class Camera():
         files_in_directory = self.sftp_client.listdir(f"{directory_name}")
         print(f"Files in directory: {files_in_directory}")
         
-        tarball_files = [f for f in files_in_directory if f.endswith(('.tar', '.tar.gz', '.tgz'))]
+        tarball_files = [f for f in files_in_directory if f.endswith(('.tar', '.tar.gz', '.tgz', '.tar.zst', '.tar.lz4'))]
         if not tarball_files:
             raise Exception("No tarball found in the directory.")
 
@@ -582,22 +1012,33 @@ class Camera():
         remote_tar_path = os.path.join(directory_name, tarball_name)
         print(f"\n\n\nFound tarball: {tarball_name}, proceeding with extraction...\n\n\n")
         
-        photo_id_array = []
-        with self.sftp_client.open(remote_tar_path, "rb") as remote_file:
-            # Open the tarball as a stream (without loading the whole file into memory)
-            with tarfile.open(fileobj=remote_file, mode="r|*") as tar:
+        # Frames held from an earlier, failed transfer of this tarball are skipped
+        manifest = self.read_transfer_manifest(remote_tar_path)
+        manifest_sha256s, held_photo_ids = None, {}
+        if manifest is not None:
+            manifest_sha256s = {entry["name"]: entry["sha256"] for entry in manifest["members"]}
+            camera_settings_link_ids = {Camera.extract_csl_id(entry["name"]) for entry in manifest["members"]} - {None}
+            held_photo_ids = cdi.get_photo_ids_by_sha256(list(camera_settings_link_ids))
+        start_offset, photo_id_array = Camera.find_transfer_resume_point(manifest, held_photo_ids)
+        if start_offset is None:
+            print(f"All frames of {tarball_name} are already in the database")
+            return photo_id_array
+        if start_offset > 0:
+            print(f"Resuming {tarball_name} from byte {start_offset}, after {len(photo_id_array)} frames already held")
+        
+        # Downloaded before any frames are added, so database writes don't hold up the transfer
+        with tempfile.SpooledTemporaryFile(max_size=self.sftp_spool_size) as local_file:
+            self.last_transfer_rate = self.download_remote_file_resuming(remote_tar_path, local_file, start_offset)
+            local_file.seek(0)
+            decompressed_file = open_decompressed_stream(local_file, get_codec_from_archive_name(tarball_name))
+            # The photo ingest is left first, so its last frames reach the frame stack before it closes
+            with (tarfile.open(fileobj=decompressed_file, mode="r|*") as tar, FrameStackIngest() as frame_stack_ingest,
+                  cdi.PhotoIngest() as photo_ingest):
                 for member in tar:
-                    if member.isfile(): 
-                        extracted_file = tar.extractfile(member)
-                        image_bytes = extracted_file.read()
-                        
-                        # Not just using the inputted array incase some of the requested test images failed to be captured
-                        camera_settings_link_id = Camera.extract_csl_id(member.name)
-                            
-                        added_photo = cdi.add_photo(camera_settings_link_id=camera_settings_link_id, photo=image_bytes)
-                        photo_id_array.append(added_photo["id"])
+                    Camera.add_tar_member_to_database(tar, member, photo_ingest, manifest_sha256s, held_photo_ids,
+                                                      frame_stack_ingest)
         
-        return photo_id_array
+        return photo_id_array + photo_ingest.photo_ids
         
     except Exception as e:
         print(f"Error transferring video frames to local device: {e}")
@@ -640,6 +1081,7 @@ class Camera():
     Then, the host device automatically forwards this to 1234 inside the container.
     """
     try:
+        self.stop_camera_daemon() # libcamera-vid needs the camera
         self.stream_clean_up()
         
         print(self.stream_source)
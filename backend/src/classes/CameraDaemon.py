@@ -0,0 +1,102 @@
+import json
+import threading
+
+class CameraDaemon():
+  """
+  Backend end of camera_daemon.py. The daemon is started over the Pi's SSH
+  connection and keeps the camera open, so commands are sent as JSON lines on
+  its stdin and each reply is read back from its stdout.
+
+  One command is in flight at a time (the lock), as the daemon handles them in order.
+  """
+
+  def __init__(self, ssh_client, remote_root_directory, script_filename="camera_daemon.py",
+               pipeline_workers=2, ram_budget=1024, max_frames_in_flight=6):
+    self.ssh_client = ssh_client
+    self.remote_root_directory = remote_root_directory
+    self.script_filename = script_filename
+    self.pipeline_workers = pipeline_workers
+    self.ram_budget = ram_budget
+    self.max_frames_in_flight = max_frames_in_flight
+
+    self.stdin = None
+    self.stdout = None
+    self.pid = None # On the Pi
+    self.lock = threading.Lock()
+    self.next_request_id = 1
+
+  def is_running(self):
+    return self.stdout is not None and not self.stdout.channel.exit_status_ready()
+
+  def start(self, timeout=30):
+    """
+    Returns once the daemon reports the camera is configured and running.
+    Stderr (the video_script prints) goes to a log file on the Pi - if it came
+    back over the channel it would need draining to avoid stalling the daemon.
+    """
+    command = (f"cd {self.remote_root_directory} && " +
+               f"python {self.script_filename} -pw {self.pipeline_workers} -ram {self.ram_budget} " +
+               f"-mif {self.max_frames_in_flight} " +
+               f"2>> {self.remote_root_directory}/camera_daemon_stderr.log")
+    self.stdin, self.stdout, _ = self.ssh_client.exec_command(command)
+    self.stdout.channel.settimeout(timeout)
+    try:
+      ready_message = self.read_message()
+    except Exception as e:
+      self.stop()
+      raise Exception(f"Camera daemon did not start: {e}")
+    if ready_message.get("status") != "ready":
+      self.stop()
+      raise Exception(f"Unexpected first message from camera daemon: {ready_message}")
+    self.stdout.channel.settimeout(None) # Runs can take as long as they take - Camera.cancel_run stops a stuck one
+    self.pid = ready_message["pid"]
+    print(f"Camera daemon started with pid {self.pid}")
+
+  def read_message(self):
+    line = self.stdout.readline()
+    if not line:
+      raise Exception("Camera daemon closed its output (see camera_daemon_stderr.log on the Pi)")
+    return json.loads(line)
+
+  def send_command(self, command: str, **fields):
+    """
+    Returns the result of the command, or raises with the daemon's error message.
+    """
+    with self.lock:
+      if not self.is_running():
+        raise Exception("Camera daemon is not running")
+      request_id = self.next_request_id
+      self.next_request_id += 1
+      self.stdin.write(json.dumps({"id": request_id, "command": command, **fields}) + "\n")
+      self.stdin.flush()
+
+      response = self.read_message()
+      if response.get("id") != request_id:
+        raise Exception(f"Camera daemon replied to request {response.get('id')}, expected {request_id}")
+      if response["status"] != "ok":
+        raise Exception(f"Camera daemon {command} failed: {response['error']}")
+      return response["result"]
+
+  def stop(self):
+    try:
+      if self.is_running():
+        self.send_command("shutdown")
+        self.stdout.channel.recv_exit_status()
+    except Exception as e:
+      print(f"Error shutting down camera daemon: {e}")
+    finally:
+      if self.stdin is not None:
+        self.stdin.close()
+      self.stdin, self.stdout = None, None
+
+  def kill(self):
+    """
+    Unlike stop, doesn't wait for the command in flight, for a daemon stuck in a
+    run. Closing the channel makes send_command raise in the thread waiting on it.
+    """
+    if self.pid is not None:
+      _, stdout, _ = self.ssh_client.exec_command(f"kill -9 {self.pid}", timeout=10)
+      stdout.channel.recv_exit_status()
+    if self.stdout is not None:
+      self.stdout.channel.close()
+    self.stdin, self.stdout = None, None
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Optional, Literal
 from pydantic import BaseModel
 
 from src.database.models import Camera, CameraSettingsLink, Photo, Settings
@@ -51,6 +51,7 @@ class CreateBeamRunSettingsReal(BaseModel):
 class UpdateNumberOfImagesAndRaw(BaseModel):
     number_of_images: int
     take_raw_images: bool
+    reduced_colour_channel: Optional[Literal["red", "green", "blue"]] = None # Average on the Pi instead of transferring frames
 
 class UpdateNumberOfImagesAndRawResponse(BaseModel):
     id: int
@@ -59,6 +60,7 @@ class GetNumberOfImagesAndRaw(BaseModel):
     id: int
     number_of_images: Optional[int]
     take_raw_images: Optional[bool]
+    reduced_colour_channel: Optional[str] = None
 
 class GetBeamRunSettingsTest(BaseModel):
     id: int # camera_id
@@ -124,4 +126,32 @@ class GetBeamPathParametersResponse(BaseModel):
 class GetRangeResponse(BaseModel):
     id: int
     range: Optional[float] = None
-    range_uncertainty: Optional[float] = None
\ No newline at end of file
+    range_uncertainty: Optional[float] = None
+
+
+class GetFrameTimingResponse(BaseModel):
+    id: int # camera settings link id
+    camera_id: int
+    number_of_frames: int
+    requested_frame_rate: float
+    achieved_frame_rate: Optional[float] = None
+    mean_frame_interval: Optional[float] = None # ms
+    frame_interval_jitter: Optional[float] = None # ms
+    max_frame_interval: Optional[float] = None # ms
+    dropped_frames: Optional[int] = None
+    stage_durations: dict[str, dict[str, float]] = {} # s, mean/p95/max per capture stage
+    bottleneck: Optional[str] = None
+
+
+class GetClockOffsetResponse(BaseModel):
+    id: int # camera settings link id
+    camera_id: int
+    sensor_clock_offset: int # ns, SensorTimestamp - backend time
+    wall_clock_offset: int # ns
+    clock_offset_uncertainty: int # ns
+
+
+class GetSynchronisedFrameSetResponse(BaseModel):
+    id: int
+    backend_time: int # ns, of the frame from the camera with fewest frames
+    photo_ids: dict[int, int] # camera id to photo id
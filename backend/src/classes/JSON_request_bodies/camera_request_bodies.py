@@ -8,6 +8,14 @@ class CameraStatusResponse(BaseModel):
     IPAddress: str
     cameraModel: str
     connectionStatus: bool
+    # From the latest background health check, None until the Pi has been checked
+    healthy: bool | None = None
+    healthProblems: list[str] = []
+    healthCheckedAt: float | None = None
+    diskSpace: str | None = None
+    cpuTemperature: float | None = None
+    throttled: list[str] = []
+    sshRoundTrip: float | None = None
 
 class CameraPutRequestBody(BaseModel):
     IPAddress: str
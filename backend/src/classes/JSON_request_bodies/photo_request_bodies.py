@@ -17,6 +17,11 @@ class DistortionCalibrationPhotoPost(BaseModel):
     calibration_status: bool
     message: str
 
+class DistortionCalibrationPhotoGet(BaseModel):
+    id: int # photo id
+    camera_settings_link_id: int
+    photo: str # base64
+
 class DistortionCalibrationSaveRequest(BaseModel):
     photo: bytes
 
@@ -42,5 +47,14 @@ class RealRunPhotoGet(BaseModel):
     camera_id: int
     photo: bytes
 
+class CameraRunStatus(BaseModel):
+    camera_settings_link_id: int
+    username: str
+    status: str # "succeeded", "failed" or "timed out"
+    error: Optional[str] = None
+    duration: float # s
+    number_of_photos: int # Taken before the failure, if it failed part way
+
 class RealRunPhotoPostResponse(BaseModel):
     id: int
+    camera_statuses: list[CameraRunStatus] = []
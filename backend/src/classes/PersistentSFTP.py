@@ -0,0 +1,68 @@
+import threading
+import time
+import paramiko
+
+class PersistentSFTP():
+  """
+  One SFTP session per Pi, kept open between transfers so each image no longer
+  pays for a new SFTP channel. The session is opened on first use and reopened
+  if its channel has closed (e.g. the SSH connection was remade).
+
+  A session idle for longer than health_check_interval is checked with a stat
+  before it is handed out, as a dropped network only shows when it is next used.
+
+  The channel window (bytes the Pi may send before we acknowledge) is much larger
+  than paramiko's 2 MB default, so prefetched reads of run tarballs are not held
+  back waiting for window adjustments.
+  """
+
+  def __init__(self, ssh_client, health_check_interval=30, window_size=32 * 2**20):
+    self.ssh_client = ssh_client
+    self.health_check_interval = health_check_interval
+    self.window_size = window_size
+
+    self.sftp_client = None
+    self.last_used_time = 0
+    self.lock = threading.Lock()
+
+  def is_open(self):
+    if self.sftp_client is None:
+      return False
+    channel = self.sftp_client.get_channel()
+    return not channel.closed and channel.get_transport().is_active()
+
+  def is_healthy(self):
+    if not self.is_open():
+      return False
+    if time.time() - self.last_used_time < self.health_check_interval:
+      return True
+    try:
+      self.sftp_client.stat(".")
+      return True
+    except (paramiko.SSHException, OSError) as e:
+      print(f"SFTP session failed its health check, reopening: {e}")
+      return False
+
+  def get_client(self):
+    """
+    Returns an open SFTP client, opening a new session only if needed.
+    """
+    with self.lock:
+      if not self.is_healthy():
+        self.close_client()
+        self.sftp_client = paramiko.SFTPClient.from_transport(self.ssh_client.get_transport(),
+                                                              window_size=self.window_size)
+      self.last_used_time = time.time()
+      return self.sftp_client
+
+  def close_client(self):
+    if self.sftp_client is not None:
+      try:
+        self.sftp_client.close()
+      except Exception as e:
+        print(f"Error closing SFTP session: {e}")
+      self.sftp_client = None
+
+  def close(self):
+    with self.lock:
+      self.close_client()
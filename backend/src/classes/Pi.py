@@ -3,34 +3,39 @@ import paramiko
 import socket
 import json
 from src.classes.Camera import Camera
+from src.classes.PersistentSFTP import PersistentSFTP
+from src.classes.PiRegistry import PiCommandQueue, PiRegistry
 from src.database.CRUD import CRISP_database_interaction as cdi
 import time
 
 class Pi:
   
-  all = [] # List of currently instantiated Pis - not all the Pi with credentials stored by the user
-  def __init__(self, inputted_username: str, inputted_ip_address: str, inputted_password: str, inputted_camera_model: str):
+  registry = PiRegistry() # Currently instantiated Pis - not all the Pi with credentials stored by the user
+  def __init__(self, inputted_username: str, inputted_ip_address: str, inputted_password: str, inputted_camera_model: str,
+               camera_id: int | None = None):
     
     self.username = inputted_username
+    self.camera_id = camera_id # Of the Pi's entry in the camera table
     self.ip_address = inputted_ip_address
     self.password = inputted_password
     self.cameraModel = inputted_camera_model
     self.ssh_client = paramiko.SSHClient()
     self.ssh_status = False
-    self.camera = Camera(self.username, self.cameraModel, self.ssh_client) 
+    self.sftp = PersistentSFTP(self.ssh_client)
+    self.command_queue = PiCommandQueue() # Taken by each camera command, so they run one at a time
+    self.camera = Camera(self.username, self.cameraModel, self.ssh_client, self.sftp, self.command_queue)
 
-    Pi.all.append(self)
+    if (replaced_pi := Pi.registry.register(self)) is not None:
+      replaced_pi.close_ssh_connection()
   
   def __del__(self):
         if self.ssh_status:
           self.close_ssh_connection()
         print(f"Pi object for {self.username} destroyed.")
   
-  # The two special methods below are defined for Pi instances such that
-  # the Pi.all set behaves as intended. Namely, if two Pis with the same
-  # username are to be instantiated, only one will be added to Pi.all.
-  # Unfortunately, object would still be constructed, taking memory, just 
-  # not accessible via Pi.all.
+  # The two special methods below are defined so that Pis with the same
+  # username compare equal. The registry holds one Pi per username - a new
+  # Pi with an existing username replaces the old one there.
   def __hash__(self):
         return hash(self.username) # unique identifier for each Pi is the username
 
@@ -54,7 +59,8 @@ class Pi:
       except Exception as e:
           self.ssh_status = False
           print(f"Error connecting over SSH to {self.username}: {e}")
-        
+      else:
+        self.ssh_status = True
       finally:
         print("{0} connection status: {1}".format(self.username, self.ssh_status))
         
@@ -81,20 +87,22 @@ class Pi:
   
   def close_ssh_connection(self):
     if self.ssh_status:
+      self.camera.stop_camera_daemon()
+      self.sftp.close()
       self.ssh_client.close()
       self.ssh_status = False
   
   @classmethod  
   def pis_connected_by_ssh(cls):
-    return [pi for pi in Pi.all if pi.ssh_status]
+    return [pi for pi in cls.registry.all() if pi.ssh_status]
   
   @classmethod  
   def get_pi_with_username(cls, user_name: str):
-    
-    for pi in Pi.all:
-      if pi.username == user_name:
-        return pi
-    return None
+    return cls.registry.get(user_name)
+
+  @classmethod
+  def get_pi_with_camera_id(cls, camera_id: int):
+    return cls.registry.get_by_camera_id(camera_id)
   
   @classmethod
   def parse_database(cls):
@@ -108,7 +116,8 @@ class Pi:
     return Pi(inputted_username=raspberry_pi.username,
                 inputted_ip_address=raspberry_pi.ip_address,
                 inputted_password=raspberry_pi.password,
-                inputted_camera_model=raspberry_pi.model)
+                inputted_camera_model=raspberry_pi.model,
+                camera_id=raspberry_pi.id)
   
   # @classmethod
   # def load_pis_on_startup(cls):
@@ -120,7 +129,7 @@ class Pi:
       if isinstance(identifier, str):
           pi = cls.get_pi_with_username(identifier)
       elif isinstance(identifier, Pi):
-          pi = identifier if identifier in cls.all else None
+          pi = identifier if identifier in cls.registry else None
       else:
         raise Exception(f"Invalid identifer type {identifier}")
       
@@ -129,7 +138,7 @@ class Pi:
       
        # If this is the last reference to the Pi object, __del__()
        # should be called by Python's garbage collection
-      cls.all.remove(pi)
+      cls.registry.unregister(pi)
       
     except Exception as e:
       print(f"Error in deleting Pi instance: {e}")
@@ -0,0 +1,121 @@
+import threading
+from contextlib import contextmanager
+
+class PiRegistry():
+  """
+  The currently instantiated Pis, indexed by username and camera id. Requests
+  run on FastAPI's thread pool, so every change and lookup holds the lock.
+
+  A username is registered at most once - registering a new Pi with the
+  username of an existing one replaces it, and the replaced Pi is returned so
+  its connection can be closed.
+  """
+
+  def __init__(self):
+    self.lock = threading.RLock()
+    self.pis_by_username = {}
+    self.pis_by_camera_id = {}
+
+  def register(self, pi):
+    with self.lock:
+      replaced_pi = self.pis_by_username.get(pi.username)
+      if replaced_pi is not None and replaced_pi.camera_id is not None:
+        self.pis_by_camera_id.pop(replaced_pi.camera_id, None)
+      self.pis_by_username[pi.username] = pi
+      if pi.camera_id is not None:
+        self.pis_by_camera_id[pi.camera_id] = pi
+      return replaced_pi
+
+  def unregister(self, pi):
+    """
+    Only removes this Pi - not a newer one since registered with its username.
+    Returns whether it was registered.
+    """
+    with self.lock:
+      if self.pis_by_username.get(pi.username) is not pi:
+        return False
+      del self.pis_by_username[pi.username]
+      if pi.camera_id is not None and self.pis_by_camera_id.get(pi.camera_id) is pi:
+        del self.pis_by_camera_id[pi.camera_id]
+      return True
+
+  def get(self, username: str):
+    with self.lock:
+      return self.pis_by_username.get(username)
+
+  def get_by_camera_id(self, camera_id: int):
+    with self.lock:
+      return self.pis_by_camera_id.get(camera_id)
+
+  def all(self):
+    """
+    A copy, so callers can iterate while Pis are (un)registered.
+    """
+    with self.lock:
+      return list(self.pis_by_username.values())
+
+  def __len__(self):
+    with self.lock:
+      return len(self.pis_by_username)
+
+  def __contains__(self, pi):
+    with self.lock:
+      return self.pis_by_username.get(pi.username) is pi
+
+
+class PiBusyError(Exception):
+  pass
+
+
+class PiCommandQueue():
+  """
+  Gives one thread at a time use of a Pi, in the order they asked for it, so
+  two requests can't interleave commands (e.g. a still landing in the middle
+  of a run) on the same SSH client. The thread holding it can take it again,
+  so a command can call other commands.
+
+  Health probes, clock offsets and cancel_run don't queue - they need to
+  reach the Pi while a run holds it. The preview only starts if the Pi is free.
+  """
+
+  def __init__(self):
+    self.condition = threading.Condition()
+    self.next_ticket = 0
+    self.now_serving = 0
+    self.owner = None
+    self.depth = 0
+
+  @contextmanager
+  def turn(self, wait=True):
+    """
+    wait=False raises PiBusyError, rather than waiting, if another thread holds
+    or is waiting for the Pi.
+    """
+    current_thread = threading.current_thread()
+    with self.condition:
+      if self.owner is current_thread:
+        self.depth += 1
+      else:
+        if not wait and self.next_ticket != self.now_serving:
+          raise PiBusyError(f"Pi is busy with {self.next_ticket - self.now_serving} other command(s)")
+        ticket = self.next_ticket
+        self.next_ticket += 1
+        self.condition.wait_for(lambda: self.now_serving == ticket)
+        self.owner = current_thread
+        self.depth = 1
+    try:
+      yield
+    finally:
+      with self.condition:
+        self.depth -= 1
+        if self.depth == 0:
+          self.owner = None
+          self.now_serving += 1
+          self.condition.notify_all()
+
+  def __len__(self):
+    """
+    Commands running or waiting.
+    """
+    with self.condition:
+      return self.next_ticket - self.now_serving
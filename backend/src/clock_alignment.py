@@ -0,0 +1,132 @@
+"""
+Offsets between each Pi's clocks and the backend's, so frames taken by
+different Pis can be matched to the same beam spill.
+
+Before a main run the backend pings each Pi over its SSH connection, NTP style:
+it notes when it sent each ping, the Pi replies with its clock readings, and
+the backend notes when the reply came back. The Pi read its clocks at roughly
+the midpoint of the round trip, so
+
+    offset = Pi clock - (send time + round trip / 2)
+
+to within half the round trip. The sample with the shortest round trip is the
+one least delayed by queueing, so it is kept (as NTP's clock filter does).
+
+SensorTimestamp is the Pi's CLOCK_BOOTTIME in ns, which is unrelated to its
+wall clock, so both offsets are measured. All times are in ns.
+"""
+import shlex
+import time
+from dataclasses import dataclass
+import numpy as np
+
+# Run on the Pi - replies to each line on stdin with its sensor and wall clocks
+PI_CLOCK_SCRIPT = """
+import sys, time
+print("ready", flush=True)
+for _ in sys.stdin:
+    print(time.clock_gettime_ns(time.CLOCK_BOOTTIME), time.time_ns(), flush=True)
+"""
+PI_CLOCK_COMMAND = f"python3 -u -c {shlex.quote(PI_CLOCK_SCRIPT)}"
+DEFAULT_NUM_OF_PINGS = 16
+
+
+@dataclass
+class ClockSample:
+    send_time: int # backend time.time_ns()
+    round_trip: int
+    pi_sensor_clock: int
+    pi_wall_clock: int
+
+    @property
+    def midpoint(self):
+        return self.send_time + self.round_trip // 2
+
+
+@dataclass
+class ClockOffset:
+    sensor_clock_offset: int # SensorTimestamp - backend time
+    wall_clock_offset: int # Pi time.time_ns() - backend time
+    uncertainty: int # Half the round trip of the sample used
+    round_trip: int
+    num_of_samples: int
+
+
+def exchange_clock_pings(stdin, stdout, num_of_pings=DEFAULT_NUM_OF_PINGS) -> list[ClockSample]:
+    """
+    stdin and stdout are the streams of PI_CLOCK_COMMAND running on the Pi.
+    The round trip is timed with perf_counter so a backend clock step mid-exchange
+    doesn't corrupt it.
+    """
+    if stdout.readline().strip() != "ready":
+        raise RuntimeError("Clock script did not start on the Pi")
+    samples = []
+    for _ in range(num_of_pings):
+        send_time = time.time_ns()
+        start_time = time.perf_counter_ns()
+        stdin.write("\n")
+        stdin.flush()
+        reply = stdout.readline()
+        round_trip = time.perf_counter_ns() - start_time
+        pi_sensor_clock, pi_wall_clock = (int(value) for value in reply.split())
+        samples.append(ClockSample(send_time, round_trip, pi_sensor_clock, pi_wall_clock))
+    return samples
+
+
+def estimate_clock_offset(samples: list[ClockSample]) -> ClockOffset:
+    if not samples:
+        raise ValueError("No clock samples to estimate the offset from")
+    best_sample = min(samples, key=lambda sample: sample.round_trip)
+    return ClockOffset(sensor_clock_offset=best_sample.pi_sensor_clock - best_sample.midpoint,
+                       wall_clock_offset=best_sample.pi_wall_clock - best_sample.midpoint,
+                       uncertainty=best_sample.round_trip // 2,
+                       round_trip=best_sample.round_trip,
+                       num_of_samples=len(samples))
+
+
+def measure_clock_offset(ssh_client, num_of_pings=DEFAULT_NUM_OF_PINGS) -> ClockOffset:
+    """
+    Opens a channel on the Pi's existing SSH connection rather than a new connection.
+    """
+    stdin, stdout, stderr = ssh_client.exec_command(PI_CLOCK_COMMAND, timeout=10)
+    try:
+        samples = exchange_clock_pings(stdin, stdout, num_of_pings)
+    except Exception as e:
+        raise RuntimeError(f"Clock offset measurement failed: {e} {stderr.read().decode().strip()}")
+    finally:
+        stdin.channel.shutdown_write() # EOF ends the script
+    stdout.channel.recv_exit_status()
+    return estimate_clock_offset(samples)
+
+
+def sensor_timestamps_to_backend_time(sensor_timestamps, sensor_clock_offset: int):
+    return np.asarray(sensor_timestamps, dtype=np.int64) - sensor_clock_offset
+
+
+def find_synchronised_frame_sets(frame_times: dict, tolerance: int) -> list[tuple[int, dict]]:
+    """
+    frame_times maps each camera to (frame ids, backend times of the frames),
+    both ordered by time. Returns (backend time, {camera: frame id}) for each
+    frame of the camera with fewest frames for which every other camera has a
+    frame within tolerance ns. Each match is a binary search into the other
+    cameras' times.
+    """
+    if not frame_times:
+        return []
+    reference_camera = min(frame_times, key=lambda camera: len(frame_times[camera][0]))
+    reference_ids, reference_times = frame_times[reference_camera]
+    frame_sets = []
+    for reference_id, reference_time in zip(reference_ids, reference_times):
+        frame_set = {reference_camera: reference_id}
+        for camera, (frame_ids, times) in frame_times.items():
+            if camera == reference_camera:
+                continue
+            index = int(np.searchsorted(times, reference_time))
+            nearest = min((i for i in (index - 1, index) if 0 <= i < len(times)),
+                          key=lambda i: abs(times[i] - reference_time), default=None)
+            if nearest is None or abs(times[nearest] - reference_time) > tolerance:
+                break
+            frame_set[camera] = frame_ids[nearest]
+        else:
+            frame_sets.append((int(reference_time), frame_set))
+    return frame_sets
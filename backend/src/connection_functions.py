@@ -1,4 +1,6 @@
 from src.classes.Pi import Pi
+from src.pi_broker import pi_broker_function
+from src.pi_health import pi_health_monitor
 from src.database.CRUD import CRISP_database_interaction as cdi
 from pydantic import BaseModel
 import os
@@ -31,11 +33,13 @@ def remove_configured_pi(username: str): # Change to interact with database
     cdi.delete_camera_with_username(username)    
     return None
 
+@pi_broker_function
 def get_single_pi_status(username: str):
     if connected_pi := Pi.get_pi_with_username(username): 
-            return connected_pi.check_ssh_connection()
+            return connected_pi.check_ssh_connection() and pi_health_monitor.is_reachable(username)
     return False
      
+@pi_broker_function
 def get_raspberry_pi_statuses():
 
     pis_in_database = Pi.parse_database()
@@ -45,7 +49,7 @@ def get_raspberry_pi_statuses():
         username = pi_dict.username
         # Looks to see if a Pi object exists with a given username in the config_file
         if connected_pi := Pi.get_pi_with_username(username): 
-            connection_status = connected_pi.check_ssh_connection()
+            connection_status = connected_pi.check_ssh_connection() and pi_health_monitor.is_reachable(username)
         else:
             connection_status = False
         pi_status_array.append(ClientSidePiStatus(username=username,
@@ -55,6 +59,7 @@ def get_raspberry_pi_statuses():
     return pi_status_array
     
     
+@pi_broker_function
 def connect_over_ssh(username: str):
     # First, ensure any existing connection is properly cleaned up
     
@@ -75,6 +80,7 @@ def connect_over_ssh(username: str):
         Pi.delete_pi(username)
         raise Exception(e)
 
+@pi_broker_function
 def disconnect_from_ssh(username: str):
     try:
         if (pi := Pi.get_pi_with_username(username)) is None:
@@ -85,4 +91,15 @@ def disconnect_from_ssh(username: str):
 
     except Exception as e:
         print(f"Error: {e}")
-        return True # might be weird to return True here - trying to say disconnect failed
\ No newline at end of file
+        return True # might be weird to return True here - trying to say disconnect failed
+
+@pi_broker_function
+def get_pi_disk_space(username: str):
+    """
+    From the latest health check if there is one, otherwise asked of the Pi.
+    """
+    if (connected_pi := Pi.get_pi_with_username(username)) is None:
+        return None
+    if (pi_health := pi_health_monitor.get(username)) is not None and pi_health.disk_space is not None:
+        return pi_health.disk_space
+    return connected_pi.get_pi_disk_space()
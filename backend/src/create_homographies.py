@@ -8,7 +8,6 @@ from typing import Literal
 from src.database.CRUD import CRISP_database_interaction as cdi
 import base64
 from pydantic import BaseModel
-import pickle
 
 class ImagePointTransforms(BaseModel):
     horizontal_flip: bool
@@ -41,8 +40,6 @@ def load_homography_data(data_file_path: str):
 
 def save_homography_calibration_to_database(camera_id, setup_id, plane_type, homography_matrix, homography_covariance):
     
-    homography_matrix = pickle.dumps(homography_matrix)
-    homography_covariance = pickle.dumps(homography_covariance)
     match plane_type:
         case "far":
             cdi.update_far_face_homography_matrix(camera_id, setup_id, homography_matrix)
@@ -10,5 +10,6 @@ from src.database.CRUD.setup_CRUD import *
 from src.database.CRUD.experiment_CRUD import *
 from src.database.CRUD.camera_analysis_CRUD import *
 from src.database.CRUD.camera_analysis_plot_CRUD import *
+from src.database.CRUD.analysis_context_CRUD import *
 # from src.database.CRUD.test_beam_run_CRUD import *
 # from src.database.CRUD.test_beam_run_photo_CRUD import *
\ No newline at end of file
@@ -0,0 +1,189 @@
+from dataclasses import dataclass, fields
+from enum import Enum
+from typing import Optional
+import numpy as np
+from sqlmodel import Session, and_, func, null, or_, select
+
+from src.database.database import engine
+from src.database.models import BeamRun, CameraAnalysis, CameraSettingsLink, CameraSetupLink, Experiment, Photo, Setup
+
+# Everything the analysis reads of a camera, loaded with one joined query rather
+# than a session per value (as the getters in the other CRUD modules would).
+
+
+@dataclass(frozen=True)
+class CameraSetupContext:
+    """
+    A camera's calibration in a setup (its CameraSetupLink) and the setup's
+    block. Fields are named as their columns, and enums are given by value.
+    """
+    camera_id: int
+    setup_id: int
+    optical_axis: Optional[str]
+    depth_direction: Optional[int]
+    image_beam_direction: Optional[str]
+    horizontal_scintillator_start: Optional[int]
+    horizontal_scintillator_end: Optional[int]
+    vertical_scintillator_start: Optional[int]
+    vertical_scintillator_end: Optional[int]
+    near_face_homography_matrix: Optional[np.ndarray]
+    near_face_homography_covariance_matrix: Optional[np.ndarray]
+    near_face_z_shift: Optional[float]
+    near_face_z_shift_unc: Optional[float]
+    near_face_non_z_shift: Optional[float]
+    near_face_non_z_shift_unc: Optional[float]
+    near_face_calibration_board_thickness: Optional[float]
+    near_face_calibration_board_thickness_unc: Optional[float]
+    far_face_homography_matrix: Optional[np.ndarray]
+    far_face_homography_covariance_matrix: Optional[np.ndarray]
+    far_face_z_shift: Optional[float]
+    far_face_z_shift_unc: Optional[float]
+    far_face_non_z_shift: Optional[float]
+    far_face_non_z_shift_unc: Optional[float]
+    far_face_calibration_board_thickness: Optional[float]
+    far_face_calibration_board_thickness_unc: Optional[float]
+    # From the setup
+    block_x_dimension: Optional[float]
+    block_x_dimension_unc: Optional[float]
+    block_y_dimension: Optional[float]
+    block_y_dimension_unc: Optional[float]
+    block_refractive_index: Optional[float]
+    block_refractive_index_unc: Optional[float]
+
+    @property
+    def horizontal_scintillator_limits(self) -> list[int]:
+        return [self.horizontal_scintillator_start, self.horizontal_scintillator_end]
+
+    @property
+    def vertical_scintillator_limits(self) -> list[int]:
+        return [self.vertical_scintillator_start, self.vertical_scintillator_end]
+
+
+@dataclass(frozen=True)
+class CameraAnalysisContext:
+    """
+    A camera analysis with the ids of its run, the run's beam energy and the
+    camera's calibration. The average image is read-only, and None if it isn't
+    loaded (with_average_image=False) or hasn't been made.
+    """
+    camera_analysis_id: int
+    camera_settings_link_id: int
+    camera_id: int
+    beam_run_id: int
+    experiment_id: int
+    setup_id: int
+    beam_energy: float # ESS
+    colour_channel: str
+    average_image: Optional[np.ndarray]
+    num_of_images: int # Successfully captured, as get_num_of_successfully_captured_images_by_camera_settings_link_id
+    bragg_peak_pixel: Optional[list[float]]
+    unc_bragg_peak_pixel: Optional[list[float]]
+    camera_setup: CameraSetupContext
+
+
+SETUP_COLUMN_NAMES = ("block_x_dimension", "block_x_dimension_unc", "block_y_dimension", "block_y_dimension_unc",
+                      "block_refractive_index", "block_refractive_index_unc")
+CAMERA_SETUP_LINK_COLUMNS = [getattr(CameraSetupLink, field.name) for field in fields(CameraSetupContext)
+                             if field.name not in SETUP_COLUMN_NAMES]
+SETUP_COLUMNS = [getattr(Setup, name) for name in SETUP_COLUMN_NAMES]
+
+
+def build_camera_setup_context(row) -> CameraSetupContext:
+    """
+    row has (at least) CAMERA_SETUP_LINK_COLUMNS and SETUP_COLUMNS.
+    """
+    values = {field.name: row._mapping[field.name] for field in fields(CameraSetupContext)}
+    return CameraSetupContext(**{name: value.value if isinstance(value, Enum) else value for name, value in values.items()})
+
+
+def camera_analysis_context_statement(with_average_image=True):
+    num_of_images = (select(func.count(Photo.id))
+                     .where(Photo.camera_settings_link_id == CameraSettingsLink.id)
+                     .where(or_(Photo.photo_hash.isnot(None), Photo.photo.isnot(None)))
+                     .scalar_subquery())
+    return (select(CameraAnalysis.id.label("camera_analysis_id"), CameraAnalysis.camera_settings_id,
+                   CameraSettingsLink.beam_run_id, BeamRun.experiment_id, BeamRun.ESS_beam_energy,
+                   CameraAnalysis.colour_channel, num_of_images.label("num_of_images"),
+                   CameraAnalysis.average_image if with_average_image else null().label("average_image"),
+                   CameraAnalysis.bragg_peak_pixel, CameraAnalysis.unc_bragg_peak_pixel,
+                   *CAMERA_SETUP_LINK_COLUMNS, *SETUP_COLUMNS)
+            .join(CameraSettingsLink, CameraAnalysis.camera_settings_id == CameraSettingsLink.id)
+            .join(BeamRun, CameraSettingsLink.beam_run_id == BeamRun.id)
+            .join(Experiment, BeamRun.experiment_id == Experiment.id)
+            .join(Setup, Experiment.setup_id == Setup.id)
+            .join(CameraSetupLink, and_(CameraSetupLink.camera_id == CameraSettingsLink.camera_id,
+                                        CameraSetupLink.setup_id == Setup.id)))
+
+
+def build_camera_analysis_context(row) -> CameraAnalysisContext:
+    camera_setup = build_camera_setup_context(row)
+    colour_channel = row.colour_channel
+    return CameraAnalysisContext(camera_analysis_id=row.camera_analysis_id,
+                                 camera_settings_link_id=row.camera_settings_id,
+                                 camera_id=camera_setup.camera_id,
+                                 beam_run_id=row.beam_run_id,
+                                 experiment_id=row.experiment_id,
+                                 setup_id=camera_setup.setup_id,
+                                 beam_energy=row.ESS_beam_energy,
+                                 colour_channel=colour_channel.value if isinstance(colour_channel, Enum) else colour_channel,
+                                 average_image=row.average_image,
+                                 num_of_images=row.num_of_images,
+                                 bragg_peak_pixel=row.bragg_peak_pixel,
+                                 unc_bragg_peak_pixel=row.unc_bragg_peak_pixel,
+                                 camera_setup=camera_setup)
+
+
+# Read
+
+def get_camera_setup_contexts(camera_ids: list[int], setup_id: int) -> list[CameraSetupContext]:
+    """
+    In the order of camera_ids.
+    """
+    with Session(engine) as session:
+        statement = (select(*CAMERA_SETUP_LINK_COLUMNS, *SETUP_COLUMNS)
+                     .join(Setup, CameraSetupLink.setup_id == Setup.id)
+                     .where(CameraSetupLink.setup_id == setup_id)
+                     .where(CameraSetupLink.camera_id.in_(camera_ids)))
+        results = session.exec(statement).all()
+    contexts = {}
+    for row in results:
+        contexts[row.camera_id] = build_camera_setup_context(row)
+    missing_camera_ids = [camera_id for camera_id in camera_ids if camera_id not in contexts]
+    if missing_camera_ids:
+        raise ValueError(f"Cameras with ids {missing_camera_ids} are not in setup with id {setup_id}.")
+    return [contexts[camera_id] for camera_id in camera_ids]
+
+def get_camera_setup_context(camera_id: int, setup_id: int) -> CameraSetupContext:
+    return get_camera_setup_contexts([camera_id], setup_id)[0]
+
+
+def get_camera_analysis_contexts(camera_analysis_ids: list[int], with_average_image=True) -> list[CameraAnalysisContext]:
+    """
+    In the order of camera_analysis_ids.
+    """
+    with Session(engine) as session:
+        statement = camera_analysis_context_statement(with_average_image).where(CameraAnalysis.id.in_(camera_analysis_ids))
+        results = session.exec(statement).all()
+    contexts = {}
+    for row in results:
+        contexts[row.camera_analysis_id] = build_camera_analysis_context(row)
+    missing_camera_analysis_ids = [camera_analysis_id for camera_analysis_id in camera_analysis_ids
+                                   if camera_analysis_id not in contexts]
+    if missing_camera_analysis_ids:
+        raise ValueError(f"Camera analyses with ids {missing_camera_analysis_ids} not found, " +
+                         "or their camera has no calibration in the run's setup.")
+    return [contexts[camera_analysis_id] for camera_analysis_id in camera_analysis_ids]
+
+def get_camera_analysis_context(camera_analysis_id: int, with_average_image=True) -> CameraAnalysisContext:
+    return get_camera_analysis_contexts([camera_analysis_id], with_average_image)[0]
+
+def get_camera_analysis_contexts_by_beam_run_id(beam_run_id: int, with_average_image=True) -> list[CameraAnalysisContext]:
+    """
+    Every camera analysis of the beam run, in the order they were added.
+    """
+    with Session(engine) as session:
+        statement = (camera_analysis_context_statement(with_average_image)
+                     .where(CameraSettingsLink.beam_run_id == beam_run_id)
+                     .order_by(CameraAnalysis.id))
+        results = session.exec(statement).all()
+    return [build_camera_analysis_context(row) for row in results]
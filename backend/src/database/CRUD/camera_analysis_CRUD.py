@@ -1,11 +1,10 @@
-from sqlmodel import Session, select, PickleType
+from sqlmodel import Session, select
 from sqlalchemy.orm.exc import NoResultFound
 
 from src.database.database import engine
 from src.database.models import CameraAnalysis, CameraSettingsLink
 import numpy as np
 from typing import Literal
-import pickle
 
 # Create
 def add_camera_analysis(camera_settings_id: int,
@@ -42,7 +41,7 @@ def get_average_image(camera_analysis_id: int) -> np.ndarray:
         statement = select(CameraAnalysis).where(CameraAnalysis.id == camera_analysis_id)
         result = session.exec(statement).one()
         if result:
-            return pickle.loads(result.average_image)
+            return result.average_image
         else:
             raise ValueError(f"Camera analysis with id {camera_analysis_id} not found.")
 
@@ -107,7 +106,7 @@ def get_camera_analysis_ids_by_camera_settings_list(camera_settings_list: list[C
 
 
 # Update
-def update_average_image(camera_analysis_id: int, average_image: PickleType):
+def update_average_image(camera_analysis_id: int, average_image: np.ndarray):
     try:
         with Session(engine) as session:
             statement = select(CameraAnalysis).where(CameraAnalysis.id == camera_analysis_id)
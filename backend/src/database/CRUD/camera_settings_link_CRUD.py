@@ -1,5 +1,5 @@
 from src.database.database import engine
-from sqlmodel import Session, select
+from sqlmodel import Session, or_, select
 from sqlalchemy.orm.exc import NoResultFound
 from src.database.models import CameraAnalysis, CameraSettingsLink, BeamRun, CameraSetupLink, OpticalAxisEnum, Photo, Experiment
 
@@ -122,6 +122,55 @@ def get_take_raw_images(camera_settings_link_id: int):
         take_raw_images = camera_settings.take_raw_images
         return take_raw_images
     
+def get_reduced_colour_channel(camera_settings_link_id: int):
+    with Session(engine) as session:
+        camera_settings = session.get(CameraSettingsLink, camera_settings_link_id)
+        reduced_colour_channel = camera_settings.reduced_colour_channel
+        return reduced_colour_channel.value if reduced_colour_channel is not None else None
+
+def get_reduced_frame_statistics(camera_settings_link_id: int):
+    with Session(engine) as session:
+        camera_settings = session.get(CameraSettingsLink, camera_settings_link_id)
+        return camera_settings.reduced_frame_statistics, camera_settings.reduced_frame_count
+    
+def get_crop_window(camera_settings_link_id: int):
+    """
+    Returns (None, None) if the frames were not cropped.
+    """
+    with Session(engine) as session:
+        camera_settings = session.get(CameraSettingsLink, camera_settings_link_id)
+        return camera_settings.crop_window, camera_settings.full_frame_size
+    
+def get_full_frame_size(camera_settings_link_id: int):
+    with Session(engine) as session:
+        camera_settings = session.get(CameraSettingsLink, camera_settings_link_id)
+        return camera_settings.full_frame_size
+    
+def get_saturation_statistics(camera_settings_link_ids: list[int]) -> dict:
+    """
+    Returns {camera_settings_link_id: statistics} for the links that have them.
+    """
+    with Session(engine) as session:
+        statement = (select(CameraSettingsLink.id, CameraSettingsLink.saturation_statistics)
+                     .where(CameraSettingsLink.id.in_(camera_settings_link_ids))
+                     .where(CameraSettingsLink.saturation_statistics.isnot(None)))
+        return {camera_settings_link_id: statistics for camera_settings_link_id, statistics in session.exec(statement).all()}
+    
+def get_clock_offsets_by_beam_run_id(beam_run_id: int) -> dict[int, dict]:
+    """
+    Maps each camera id in the run to its clock offsets (ns), for cameras whose offsets were measured.
+    """
+    with Session(engine) as session:
+        statement = (select(CameraSettingsLink)
+                     .where(CameraSettingsLink.beam_run_id == beam_run_id)
+                     .where(CameraSettingsLink.sensor_clock_offset.isnot(None)))
+        results = session.exec(statement).all()
+        return {result.camera_id: {"camera_settings_link_id": result.id,
+                                   "sensor_clock_offset": result.sensor_clock_offset,
+                                   "wall_clock_offset": result.wall_clock_offset,
+                                   "clock_offset_uncertainty": result.clock_offset_uncertainty}
+                for result in results}
+
 def get_number_of_images_to_capture_by_camera_settings_link_id(camera_settings_link_id: int):
     with Session(engine) as session:
         camera_settings = session.get(CameraSettingsLink, camera_settings_link_id)
@@ -131,7 +180,9 @@ def get_number_of_images_to_capture_by_camera_settings_link_id(camera_settings_l
 def get_successfully_captured_photo_ids_by_camera_settings_link_id(camera_settings_link_id: int):
     with Session(engine) as session:
         # Bytes must be present to be included
-        statement = select(Photo.id).where(Photo.camera_settings_link_id == camera_settings_link_id).where(Photo.photo.isnot(None))
+        statement = (select(Photo.id)
+                     .where(Photo.camera_settings_link_id == camera_settings_link_id)
+                     .where(or_(Photo.photo_hash.isnot(None), Photo.photo.isnot(None))))
         photo_id_list = session.exec(statement).all()
         return photo_id_list
     
@@ -146,7 +197,9 @@ def get_num_of_successfully_captured_images_by_camera_settings_link_id(camera_se
     """
     with Session(engine) as session:
         # Bytes must be present to be included
-        statement = select(Photo).where(Photo.camera_settings_link_id == camera_settings_link_id).where(Photo.photo.isnot(None))
+        statement = (select(Photo.id)
+                     .where(Photo.camera_settings_link_id == camera_settings_link_id)
+                     .where(or_(Photo.photo_hash.isnot(None), Photo.photo.isnot(None))))
         result = session.exec(statement).all()
         return len(result)
 
@@ -307,6 +360,14 @@ def update_no_optimal_in_run(photo_ids: int):
         session.commit()
         return {"message": f"Photos with ids: {photo_ids} all set to not optimal camera settings"}
 
+def update_no_optimal_by_camera_settings_ids(camera_settings_link_ids: list[int]):
+    with Session(engine) as session:
+        statement = select(CameraSettingsLink).where(CameraSettingsLink.id.in_(camera_settings_link_ids))
+        for camera_settings in session.exec(statement).all():
+            camera_settings.is_optimal = False
+        session.commit()
+        return {"message": f"Camera settings with ids: {camera_settings_link_ids} all set to not optimal"}
+
 def update_number_of_images(camera_settings_link_id: int, number_of_images: int):
     try:
         with Session(engine) as session:
@@ -333,4 +394,86 @@ def update_take_raw_images(camera_settings_link_id: int, take_raw_images: bool):
     except Exception as e:
         raise RuntimeError(f"An error occurred: {str(e)}")
 
+def update_reduced_colour_channel(camera_settings_link_id: int, reduced_colour_channel: str | None):
+    try:
+        with Session(engine) as session:
+            statement = select(CameraSettingsLink).where(CameraSettingsLink.id == camera_settings_link_id)
+            result = session.exec(statement).one()
+            result.reduced_colour_channel = reduced_colour_channel
+            session.commit()
+            return {"message": f"Reduced colour channel updated for camera settings link with id = {camera_settings_link_id}."}
+    except NoResultFound:
+        raise ValueError(f"No camera settings link found with id = {camera_settings_link_id}.")
+    except Exception as e:
+        raise RuntimeError(f"An error occurred: {str(e)}")
+
+def update_reduced_frame_statistics(camera_settings_link_id: int, reduced_frame_statistics: bytes, reduced_frame_count: int):
+    try:
+        with Session(engine) as session:
+            statement = select(CameraSettingsLink).where(CameraSettingsLink.id == camera_settings_link_id)
+            result = session.exec(statement).one()
+            result.reduced_frame_statistics = reduced_frame_statistics
+            result.reduced_frame_count = reduced_frame_count
+            session.commit()
+            return {"message": f"Reduced frame statistics updated for camera settings link with id = {camera_settings_link_id}."}
+    except NoResultFound:
+        raise ValueError(f"No camera settings link found with id = {camera_settings_link_id}.")
+    except Exception as e:
+        raise RuntimeError(f"An error occurred: {str(e)}")
+
+def update_saturation_statistics(camera_settings_link_id: int, saturation_statistics: dict):
+    try:
+        with Session(engine) as session:
+            statement = select(CameraSettingsLink).where(CameraSettingsLink.id == camera_settings_link_id)
+            result = session.exec(statement).one()
+            result.saturation_statistics = saturation_statistics
+            session.commit()
+            return {"message": f"Saturation statistics updated for camera settings link with id = {camera_settings_link_id}."}
+    except NoResultFound:
+        raise ValueError(f"No camera settings link found with id = {camera_settings_link_id}.")
+    except Exception as e:
+        raise RuntimeError(f"An error occurred: {str(e)}")
+
+def update_full_frame_size(camera_settings_link_id: int, full_frame_size: list[int]):
+    try:
+        with Session(engine) as session:
+            statement = select(CameraSettingsLink).where(CameraSettingsLink.id == camera_settings_link_id)
+            result = session.exec(statement).one()
+            result.full_frame_size = full_frame_size
+            session.commit()
+            return {"message": f"Full frame size updated for camera settings link with id = {camera_settings_link_id}."}
+    except NoResultFound:
+        raise ValueError(f"No camera settings link found with id = {camera_settings_link_id}.")
+    except Exception as e:
+        raise RuntimeError(f"An error occurred: {str(e)}")
+
+def update_crop_window(camera_settings_link_id: int, crop_window: list[int], full_frame_size: list[int]):
+    try:
+        with Session(engine) as session:
+            statement = select(CameraSettingsLink).where(CameraSettingsLink.id == camera_settings_link_id)
+            result = session.exec(statement).one()
+            result.crop_window = crop_window
+            result.full_frame_size = full_frame_size
+            session.commit()
+            return {"message": f"Crop window updated for camera settings link with id = {camera_settings_link_id}."}
+    except NoResultFound:
+        raise ValueError(f"No camera settings link found with id = {camera_settings_link_id}.")
+    except Exception as e:
+        raise RuntimeError(f"An error occurred: {str(e)}")
+
+def update_clock_offset(camera_settings_link_id: int, sensor_clock_offset: int, wall_clock_offset: int, clock_offset_uncertainty: int):
+    try:
+        with Session(engine) as session:
+            statement = select(CameraSettingsLink).where(CameraSettingsLink.id == camera_settings_link_id)
+            result = session.exec(statement).one()
+            result.sensor_clock_offset = sensor_clock_offset
+            result.wall_clock_offset = wall_clock_offset
+            result.clock_offset_uncertainty = clock_offset_uncertainty
+            session.commit()
+            return {"message": f"Clock offset updated for camera settings link with id = {camera_settings_link_id}."}
+    except NoResultFound:
+        raise ValueError(f"No camera settings link found with id = {camera_settings_link_id}.")
+    except Exception as e:
+        raise RuntimeError(f"An error occurred: {str(e)}")
+
 # Delete
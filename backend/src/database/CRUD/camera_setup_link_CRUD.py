@@ -1,14 +1,14 @@
 from datetime import datetime
 import pytz
 from src.database.database import engine
-from sqlmodel import Session, select, PickleType
+from sqlmodel import Session, select
 from sqlalchemy.orm.exc import NoResultFound
 import numpy as np
 from typing import List, Literal
-import pickle
 
 from src.database.models import BeamRun, Camera, CameraSettingsLink, CameraSetupLink, Experiment, Photo, Setup, OpticalAxisEnum, DepthDirectionEnum
 from src.classes.JSON_request_bodies import request_bodies as rb
+from src.database.CRUD.photo_CRUD import delete_photos_by_camera_settings_link_id
 
 # Create
 
@@ -330,40 +330,40 @@ def get_near_face_calibration_spacing_unc(camera_id:int, setup_id:int) -> List[f
         else:
             raise ValueError(f"Near face calibration pattern spacing uncertainty not found for camera with id {camera_id} and setup with id {setup_id}.")
 
-def get_far_face_homography_matrix(camera_id:int, setup_id:int) -> bytes:
+def get_far_face_homography_matrix(camera_id:int, setup_id:int) -> np.ndarray:
     with Session(engine) as session:
         statement = select(CameraSetupLink).where(CameraSetupLink.camera_id == camera_id).where(CameraSetupLink.setup_id == setup_id)
         result = session.exec(statement).one()
         if result:
-            return pickle.loads(result.far_face_homography_matrix)
+            return result.far_face_homography_matrix
         else:
             raise ValueError(f"Homography matrix not found for camera with id {camera_id} and setup with id {setup_id}.")
 
-def get_far_face_homography_covariance_matrix(camera_id:int, setup_id:int) -> bytes:
+def get_far_face_homography_covariance_matrix(camera_id:int, setup_id:int) -> np.ndarray:
     with Session(engine) as session:
         statement = select(CameraSetupLink).where(CameraSetupLink.camera_id == camera_id).where(CameraSetupLink.setup_id == setup_id)
         result = session.exec(statement).one()
         if result:
-            return pickle.loads(result.far_face_homography_covariance_matrix)
+            return result.far_face_homography_covariance_matrix
         else:
             raise ValueError(f"Homography covariance matrix not found for camera with id {camera_id} and setup with id {setup_id}.")
 
-def get_near_face_homography_matrix(camera_id:int, setup_id:int) -> bytes:
+def get_near_face_homography_matrix(camera_id:int, setup_id:int) -> np.ndarray:
     with Session(engine) as session:
         statement = select(CameraSetupLink).where(CameraSetupLink.camera_id == camera_id).where(CameraSetupLink.setup_id == setup_id)
         result = session.exec(statement).one()
         if result:
-            return pickle.loads(result.near_face_homography_matrix)
+            return result.near_face_homography_matrix
         else:
             raise ValueError(f"Homography matrix not found for camera with id {camera_id} and setup with id {setup_id}.")
 
 
-def get_near_face_homography_covariance_matrix(camera_id:int, setup_id:int) -> bytes:
+def get_near_face_homography_covariance_matrix(camera_id:int, setup_id:int) -> np.ndarray:
     with Session(engine) as session:
         statement = select(CameraSetupLink).where(CameraSetupLink.camera_id == camera_id).where(CameraSetupLink.setup_id == setup_id)
         result = session.exec(statement).one()
         if result:
-            return pickle.loads(result.near_face_homography_covariance_matrix)
+            return result.near_face_homography_covariance_matrix
         else:
             raise ValueError(f"Homography covariance matrix not found for camera with id {camera_id} and setup with id {setup_id}.")
 
@@ -386,6 +386,12 @@ def get_vertical_scintillator_limits(camera_id:int, setup_id:int) -> tuple[int,
         else:
             raise ValueError(f"Initial vertical ROI not found for camera with id {camera_id} and setup with id {setup_id}.")
 
+def get_scintillator_edges_photo_camera_settings_id(camera_id:int, setup_id:int) -> int|None:
+    with Session(engine) as session:
+        statement = select(CameraSetupLink).where(CameraSetupLink.camera_id == camera_id).where(CameraSetupLink.setup_id == setup_id)
+        result = session.exec(statement).one()
+        return result.scintillator_edges_photo_camera_settings_id
+
 # def get_scintillator_edges_photo_id(camera_id:int, setup_id:int) -> bytes:
 #     with Session(engine) as session:
 #         statement = select(CameraSetupLink).where(CameraSetupLink.camera_id == camera_id).where(CameraSetupLink.setup_id == setup_id)
@@ -400,7 +406,7 @@ def get_camera_matrix(camera_id:int, setup_id:int) -> np.ndarray:
         statement = select(CameraSetupLink).where(CameraSetupLink.camera_id == camera_id).where(CameraSetupLink.setup_id == setup_id)
         result = session.exec(statement).one()
         if result:
-            return pickle.loads(result.camera_matrix)
+            return result.camera_matrix
         else:
             raise ValueError(f"Camera matrix not found for camera with id {camera_id} and setup with id {setup_id}.")
   
@@ -410,7 +416,7 @@ def get_distortion_coefficients(camera_id:int, setup_id:int) -> np.ndarray:
         statement = select(CameraSetupLink).where(CameraSetupLink.camera_id == camera_id).where(CameraSetupLink.setup_id == setup_id)
         result = session.exec(statement).one()
         if result:
-            return pickle.loads(result.distortion_coefficients)
+            return result.distortion_coefficients
         else:
             raise ValueError(f"Distortion coefficients not found for camera with id {camera_id} and setup with id {setup_id}.")
         
@@ -769,7 +775,7 @@ def update_near_face_calibration_pattern_type(camera_id:int, setup_id:int, near_
         raise RuntimeError(f"An error occurred: {str(e)}")
 
 
-def update_far_face_homography_matrix(camera_id:int, setup_id:int, far_face_homography_matrix: PickleType):
+def update_far_face_homography_matrix(camera_id:int, setup_id:int, far_face_homography_matrix: np.ndarray):
     try:
         with Session(engine) as session:
             statement = select(CameraSetupLink).where(CameraSetupLink.camera_id == camera_id).where(CameraSetupLink.setup_id == setup_id)
@@ -783,7 +789,7 @@ def update_far_face_homography_matrix(camera_id:int, setup_id:int, far_face_homo
         raise RuntimeError(f"An error occurred: {str(e)}")
 
 
-def update_far_face_homography_covariance_matrix(camera_id:int, setup_id:int, far_face_homography_covariance_matrix: PickleType):
+def update_far_face_homography_covariance_matrix(camera_id:int, setup_id:int, far_face_homography_covariance_matrix: np.ndarray):
     try:
         with Session(engine) as session:
             statement = select(CameraSetupLink).where(CameraSetupLink.camera_id == camera_id).where(CameraSetupLink.setup_id == setup_id)
@@ -796,7 +802,7 @@ def update_far_face_homography_covariance_matrix(camera_id:int, setup_id:int, fa
     except Exception as e:
         raise RuntimeError(f"An error occurred: {str(e)}")
 
-def update_near_face_homography_matrix(camera_id:int, setup_id:int, near_face_homography_matrix: PickleType):
+def update_near_face_homography_matrix(camera_id:int, setup_id:int, near_face_homography_matrix: np.ndarray):
     try:
         with Session(engine) as session:
             statement = select(CameraSetupLink).where(CameraSetupLink.camera_id == camera_id).where(CameraSetupLink.setup_id == setup_id)
@@ -810,7 +816,7 @@ def update_near_face_homography_matrix(camera_id:int, setup_id:int, near_face_ho
         raise RuntimeError(f"An error occurred: {str(e)}")
     
 
-def update_near_face_homography_covariance_matrix(camera_id:int, setup_id:int, near_face_homography_covariance_matrix: PickleType):
+def update_near_face_homography_covariance_matrix(camera_id:int, setup_id:int, near_face_homography_covariance_matrix: np.ndarray):
     try:
         with Session(engine) as session:
             statement = select(CameraSetupLink).where(CameraSetupLink.camera_id == camera_id).where(CameraSetupLink.setup_id == setup_id)
@@ -1020,7 +1026,7 @@ def patch_setup_camera(setup_camera_id: int, patch: rb.SetupCameraPatchRequest):
     except Exception as e:
         raise RuntimeError(f"An error occurred: {str(e)}")
 
-def update_camera_matrix(camera_id:int, setup_id:int, camera_matrix: PickleType):
+def update_camera_matrix(camera_id:int, setup_id:int, camera_matrix: np.ndarray):
     try:
         with Session(engine) as session:
             statement = select(CameraSetupLink).where(CameraSetupLink.camera_id == camera_id).where(CameraSetupLink.setup_id == setup_id)
@@ -1033,7 +1039,7 @@ def update_camera_matrix(camera_id:int, setup_id:int, camera_matrix: PickleType)
     except Exception as e:
         raise RuntimeError(f"An error occurred: {str(e)}")
 
-def update_distortion_coefficients(camera_id:int, setup_id:int, distortion_coefficients: PickleType):
+def update_distortion_coefficients(camera_id:int, setup_id:int, distortion_coefficients: np.ndarray):
     try:
         with Session(engine) as session:
             statement = select(CameraSetupLink).where(CameraSetupLink.camera_id == camera_id).where(CameraSetupLink.setup_id == setup_id)
@@ -1192,10 +1198,7 @@ def reset_distortion_calibration(setup_camera_id: int):
         setup_camera = session.get(CameraSetupLink, setup_camera_id)
         # Remove distortion photos
         distortion_camera_settings_id = setup_camera.distortion_calibration_camera_settings_link
-        distortion_photos_statement = select(Photo).where(Photo.camera_settings_link_id == distortion_camera_settings_id)
-        distortion_photos = session.exec(distortion_photos_statement).all()
-        for distortion_photo in distortion_photos:
-            session.delete(distortion_photo)
+        delete_photos_by_camera_settings_link_id(distortion_camera_settings_id)
         session.delete(setup_camera)
         setup_camera.distortion_calibration_camera_settings_link = None
         session.commit()
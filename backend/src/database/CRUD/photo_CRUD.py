@@ -1,12 +1,21 @@
+import json
 from src.database.database import engine
-from sqlmodel import Session, select
+from sqlmodel import Session, insert, select
 from src.database.models import Photo
+from src.photo_store import get_garbage_collection_cutoff, guess_media_type, photo_store
 
 # Create
 
-def add_photo(camera_settings_link_id: int, photo: bytes): # , photo_metadata: bytes):
+def store_photo(photo: bytes, fsync: bool|None=None) -> dict:
+    """
+    Writes the photo to the photo store and returns the Photo columns that refer to it.
+    """
+    photo_hash, photo_size = photo_store.put(photo, fsync=fsync)
+    return {"photo_hash": photo_hash, "photo_size": photo_size, "media_type": guess_media_type(photo)}
+
+def add_photo(camera_settings_link_id: int, photo: bytes, photo_metadata: bytes|None=None):
     try:
-        photo = Photo(camera_settings_link_id=camera_settings_link_id, photo=photo)#, photo_metadata=photo_metadata)
+        photo = Photo(camera_settings_link_id=camera_settings_link_id, photo_metadata=photo_metadata, **store_photo(photo))
     except TypeError as e:
         raise TypeError(f"TypeError: {e}") from e
     except ValueError as e:
@@ -17,10 +26,87 @@ def add_photo(camera_settings_link_id: int, photo: bytes): # , photo_metadata: b
         return {"message": f"Photo added to camera settings link.",
                 "id": photo.id}
 
+def add_photos(photos: list[dict]) -> list[int]:
+    """
+    Adds many photos in one transaction - photos are dicts of the Photo columns
+    (store_photo's, camera_settings_link_id and photo_metadata). They go in as
+    multi-row INSERT ... RETURNING statements rather than a statement per row,
+    and the ids are returned in the order of photos.
+    """
+    if not photos:
+        return []
+    with Session(engine) as session:
+        statement = insert(Photo).returning(Photo.id, sort_by_parameter_order=True)
+        photo_ids = session.exec(statement, params=photos).scalars().all()
+        session.commit()
+    return photo_ids
+
+# Photos held back by PhotoIngest before inserting them. Frames waiting to be decoded into
+# their frame stack are held too, so 16 12 MP JPEGs are ~60 MB.
+PHOTO_INGEST_BATCH_SIZE = 16
+
+class PhotoIngest:
+    """
+    Used by Camera to add the frames of a run - each photo is written to the photo
+    store as it is added, and its row is inserted with batch_size others by
+    add_photos, rather than a transaction per frame. The batch's files are synced
+    together just before their rows are inserted, rather than one by one.
+
+    photo_ids holds the ids of every photo added (including those added with
+    add_held), in the order they were added, once they are inserted. on_added
+    callbacks are called with each photo's id once it is inserted, in the same order.
+    Leaving the with block inserts what is left, even if it is left by an
+    exception, so a failed transfer keeps the frames it got and can resume.
+    """
+
+    def __init__(self, batch_size=PHOTO_INGEST_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.photo_ids = []
+        self.pending = [] # (Photo columns, or the id of a photo already held, on_added)
+        self.num_of_pending_photos = 0
+
+    def add(self, camera_settings_link_id: int, photo: bytes, photo_metadata: bytes|None=None, on_added=None):
+        photo_columns = {"camera_settings_link_id": camera_settings_link_id,
+                         "photo_metadata": photo_metadata, **store_photo(photo, fsync=False)}
+        self.pending.append((photo_columns, on_added))
+        self.num_of_pending_photos += 1
+        if self.num_of_pending_photos >= self.batch_size:
+            self.flush()
+
+    def add_held(self, photo_id: int, on_added=None):
+        """
+        For a photo already in the database - its id is put in order with the photos added.
+        """
+        if not self.pending:
+            self.photo_ids.append(photo_id)
+            if on_added is not None:
+                on_added(photo_id)
+        else:
+            self.pending.append((photo_id, on_added))
+
+    def flush(self):
+        if not self.pending:
+            return
+        photos = [photo for photo, _ in self.pending if isinstance(photo, dict)]
+        photo_store.sync(photo["photo_hash"] for photo in photos) # Before any row refers to them
+        added_photo_ids = iter(add_photos(photos))
+        pending, self.pending, self.num_of_pending_photos = self.pending, [], 0
+        for photo, on_added in pending:
+            photo_id = next(added_photo_ids) if isinstance(photo, dict) else photo
+            self.photo_ids.append(photo_id)
+            if on_added is not None:
+                on_added(photo_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
 # For testing only
 def add_photo_for_testing(camera_settings_link_id: int, photo: bytes): # TODO added without metadata for testing
     try:
-        photo = Photo(camera_settings_link_id=camera_settings_link_id, photo=photo)
+        photo = Photo(camera_settings_link_id=camera_settings_link_id, **store_photo(photo))
     except TypeError as e:
         raise TypeError(f"TypeError: {e}") from e
     except ValueError as e:
@@ -47,15 +133,109 @@ def get_photo_from_camera_settings_link_id(camera_settings_link_id: int): # This
             # raise ValueError(f"Photo with camera_settings_link_id: {camera_settings_link_id} cannot be a found.")
 
 
+def get_photo_metadata_by_camera_settings_link_id(camera_settings_link_id: int) -> list[bytes]:
+    """
+    Only the metadata column is loaded, not the photos.
+    """
+    with Session(engine) as session:
+        statement = (select(Photo.photo_metadata)
+                     .where(Photo.camera_settings_link_id == camera_settings_link_id)
+                     .where(Photo.photo_metadata.isnot(None))
+                     .order_by(Photo.id))
+        return session.exec(statement).all()
+
+
+def get_photo_ids_and_metadata_by_camera_settings_link_id(camera_settings_link_id: int) -> list[tuple[int, bytes]]:
+    """
+    Only the id and metadata columns are loaded, not the photos.
+    """
+    with Session(engine) as session:
+        statement = (select(Photo.id, Photo.photo_metadata)
+                     .where(Photo.camera_settings_link_id == camera_settings_link_id)
+                     .where(Photo.photo_metadata.isnot(None))
+                     .order_by(Photo.id))
+        return session.exec(statement).all()
+
+
+def get_photo_ids_by_sha256(camera_settings_link_ids: list[int]) -> dict[str, int]:
+    """
+    Maps the sha256 of each photo's bytes (stored in its metadata when it is
+    transferred from a run) to the photo id.
+    """
+    with Session(engine) as session:
+        statement = (select(Photo.id, Photo.photo_metadata)
+                     .where(Photo.camera_settings_link_id.in_(camera_settings_link_ids))
+                     .where(Photo.photo_metadata.isnot(None)))
+        results = session.exec(statement).all()
+    photo_ids = {}
+    for photo_id, photo_metadata in results:
+        if (sha256 := json.loads(photo_metadata).get("sha256")) is not None:
+            photo_ids[sha256] = photo_id
+    return photo_ids
+
+
+def get_camera_settings_link_ids_with_photos(camera_settings_link_ids: list[int]) -> list[int]:
+    """
+    Those of camera_settings_link_ids that have at least one photo.
+    """
+    with Session(engine) as session:
+        statement = (select(Photo.camera_settings_link_id)
+                     .where(Photo.camera_settings_link_id.in_(camera_settings_link_ids))
+                     .distinct())
+        return session.exec(statement).all()
+
+
+def get_photo_bytes(photo: Photo) -> bytes:
+    """
+    The bytes of a Photo row, from the photo store (or the row itself for photos
+    from before the store).
+    """
+    if photo.photo_hash is not None:
+        return photo_store.read(photo.photo_hash)
+    return photo.photo
+
+
 def get_photo_from_id(photo_id: int) -> bytes:
     with Session(engine) as session:
-        statement = select(Photo).where(Photo.id == photo_id)
-        result = session.exec(statement).one()
-        if result:
-            return result.photo
-        else:
+        statement = select(Photo.photo_hash, Photo.photo).where(Photo.id == photo_id)
+        result = session.exec(statement).one_or_none()
+        if result is None:
             raise ValueError(f"Photo with photo id: {photo_id} cannot be found.")
-    return
+    photo_hash, photo = result
+    if photo_hash is not None:
+        return photo_store.read(photo_hash)
+    return photo
+
+
+def get_photo_buffer_from_id(photo_id: int):
+    """
+    As get_photo_from_id, but a stored photo is memory mapped rather than read,
+    for decoding without a copy.
+    """
+    with Session(engine) as session:
+        statement = select(Photo.photo_hash, Photo.photo).where(Photo.id == photo_id)
+        result = session.exec(statement).one_or_none()
+        if result is None:
+            raise ValueError(f"Photo with photo id: {photo_id} cannot be found.")
+    photo_hash, photo = result
+    if photo_hash is not None:
+        return photo_store.read_view(photo_hash)
+    return photo
+
+
+def get_photo_path_and_media_type(photo_id: int) -> tuple[str|None, str|None]:
+    """
+    The photo store path of the photo, or None if it is from before the store.
+    """
+    with Session(engine) as session:
+        statement = select(Photo.photo_hash, Photo.media_type).where(Photo.id == photo_id)
+        result = session.exec(statement).one_or_none()
+        if result is None:
+            raise ValueError(f"Photo with photo id: {photo_id} cannot be found.")
+    photo_hash, media_type = result
+    if photo_hash is None:
+        return None, None
+    return photo_store.path(photo_hash), media_type
 
 # Update
 
@@ -65,13 +245,18 @@ def update_photo(camera_settings_link_id: int, photo: bytes):  # , photo_metadat
         with Session(engine) as session:
             statement = select(Photo).where(Photo.camera_settings_link_id == camera_settings_link_id)
             existing_photo = session.exec(statement).first() #TODO This should ensure 1 in future
+            replaced_photo_hash = None
             if existing_photo:
-                existing_photo.photo = photo
+                replaced_photo_hash = existing_photo.photo_hash
+                existing_photo.photo = None
+                existing_photo.sqlmodel_update(store_photo(photo))
                 # existing_photo.photo_metadata = photo_metadata  # If you are using metadata
             else:
-                existing_photo = Photo(camera_settings_link_id=camera_settings_link_id, photo=photo)  # , photo_metadata=photo_metadata)
+                existing_photo = Photo(camera_settings_link_id=camera_settings_link_id, **store_photo(photo))  # , photo_metadata=photo_metadata)
             session.add(existing_photo)
             session.commit()
+            if replaced_photo_hash != existing_photo.photo_hash:
+                delete_photo_file_if_unreferenced(replaced_photo_hash)
 
             return {"message": "Photo added/updated to camera settings link.",
                     "id": existing_photo.id}
@@ -86,6 +271,76 @@ def update_photo(camera_settings_link_id: int, photo: bytes):  # , photo_metadat
 def delete_photo_by_id(photo_id: int):
     with Session(engine) as session:
         photo = session.get(Photo, photo_id)
+        photo_hash = photo.photo_hash
         session.delete(photo)
         session.commit()
-    return {"message": f"Photo with id {photo_id} successfully deleted."}
\ No newline at end of file
+    delete_photo_file_if_unreferenced(photo_hash)
+    return {"message": f"Photo with id {photo_id} successfully deleted."}
+
+
+def delete_photos_by_camera_settings_link_id(camera_settings_link_id: int):
+    with Session(engine) as session:
+        photos = session.exec(select(Photo).where(Photo.camera_settings_link_id == camera_settings_link_id)).all()
+        photo_hashes = {photo.photo_hash for photo in photos}
+        for photo in photos:
+            session.delete(photo)
+        session.commit()
+    for photo_hash in photo_hashes:
+        delete_photo_file_if_unreferenced(photo_hash)
+    return {"message": f"{len(photos)} photos of camera settings link with id {camera_settings_link_id} successfully deleted."}
+
+
+def delete_photo_file_if_unreferenced(photo_hash: str|None):
+    """
+    Identical photos share a file, so it is only deleted once no row refers to it.
+    A file put within the grace period is kept, as a PhotoIngest may be about to
+    insert a row referring to it - collect_photo_store_garbage deletes it later.
+    """
+    if photo_hash is None:
+        return
+    with Session(engine) as session:
+        statement = select(Photo.id).where(Photo.photo_hash == photo_hash).limit(1)
+        if session.exec(statement).first() is None:
+            photo_store.delete(photo_hash, older_than=get_garbage_collection_cutoff())
+
+
+def collect_photo_store_garbage(older_than: float) -> int:
+    """
+    Deletes stored photos last modified before older_than that no row refers to,
+    e.g. those of photos deleted with their camera settings link. Returns the
+    number deleted.
+    """
+    with Session(engine) as session:
+        referenced_hashes = set(session.exec(select(Photo.photo_hash).where(Photo.photo_hash.isnot(None))).all())
+    num_of_files_deleted = 0
+    for photo_hash in list(photo_store.iterate_hashes(older_than)):
+        if photo_hash not in referenced_hashes and photo_store.delete(photo_hash, older_than): # Unless put again since
+            num_of_files_deleted += 1
+    return num_of_files_deleted
+
+
+# Migration
+
+def move_photos_to_photo_store(batch_size: int = 50) -> int:
+    """
+    Moves photos held in Photo.photo into the photo store, batch_size photos per
+    transaction so an interrupted move keeps what it has done. Returns the number moved.
+    """
+    num_of_photos_moved = 0
+    while True:
+        with Session(engine) as session:
+            statement = (select(Photo)
+                         .where(Photo.photo_hash.is_(None))
+                         .where(Photo.photo.isnot(None))
+                         .order_by(Photo.id)
+                         .limit(batch_size))
+            photos = session.exec(statement).all()
+            if not photos:
+                return num_of_photos_moved
+            for photo in photos:
+                photo.sqlmodel_update(store_photo(photo.photo))
+                photo.photo = None
+                session.add(photo)
+            session.commit()
+            num_of_photos_moved += len(photos)
+            print(f"Moved {num_of_photos_moved} photos")
\ No newline at end of file
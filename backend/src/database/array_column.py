@@ -0,0 +1,113 @@
+"""
+Column type for numpy arrays - the average images, homographies and
+distortion correction matrices.
+
+Each array is stored as a short header (dtype and shape) followed by its raw
+bytes in C order:
+
+    b"NDA1" | dtype length (1 byte) | dtype.str | ndim (1 byte) | shape (ndim little endian uint64) | padding to 16 bytes | data
+
+and read back with np.frombuffer, a read-only view of the bytes the driver
+returns rather than a copy. Unlike the pickles stored before, nothing in a row
+can run code when it is loaded.
+
+Pickled arrays left from before are converted when the tables are created -
+see convert_pickled_arrays.
+"""
+import io
+import pickle
+import struct
+from typing import Annotated, Any
+import numpy as np
+from pydantic import PlainSerializer
+from sqlalchemy import LargeBinary, literal, func, select, type_coerce
+from sqlalchemy.types import TypeDecorator
+
+ARRAY_MAGIC = b"NDA1"
+DATA_ALIGNMENT = 16
+
+
+def encode_array(array) -> bytes:
+    array = np.asarray(array)
+    if not array.flags.c_contiguous:
+        array = np.ascontiguousarray(array)
+    if array.dtype.hasobject or array.dtype.fields is not None:
+        raise TypeError(f"Only arrays of numbers can be stored, not {array.dtype}")
+    dtype = array.dtype.str.encode()
+    header = ARRAY_MAGIC + struct.pack("B", len(dtype)) + dtype + struct.pack(f"<B{array.ndim}Q", array.ndim, *array.shape)
+    header += b"\0" * (-len(header) % DATA_ALIGNMENT)
+    return b"".join((header, array.reshape(-1).view(np.uint8))) # One copy of the data
+
+
+def decode_array(data) -> np.ndarray:
+    """
+    A read-only view of data.
+    """
+    data = memoryview(data)
+    if bytes(data[:4]) != ARRAY_MAGIC:
+        raise ValueError("Not an encoded array")
+    dtype_length = data[4]
+    dtype = np.dtype(bytes(data[5:5 + dtype_length]).decode())
+    offset = 5 + dtype_length
+    ndim = data[offset]
+    shape = struct.unpack_from(f"<{ndim}Q", data, offset + 1)
+    offset += 1 + 8 * ndim
+    offset += -offset % DATA_ALIGNMENT
+    return np.frombuffer(data, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+
+
+class NumpyArray(TypeDecorator):
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else encode_array(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else decode_array(value)
+
+
+# Field type of NumpyArray columns - sent as nested lists in JSON responses
+NumpyArrayField = Annotated[Any, PlainSerializer(lambda array: None if array is None else np.asarray(array).tolist(),
+                                                 when_used="json")]
+
+
+class ArrayUnpickler(pickle.Unpickler):
+    """
+    Only loads pickled numpy arrays, so converting old rows can't run arbitrary code.
+    """
+    ALLOWED_GLOBALS = {("numpy._core.multiarray", "_reconstruct"), ("numpy.core.multiarray", "_reconstruct"),
+                       ("numpy._core.multiarray", "scalar"), ("numpy.core.multiarray", "scalar"),
+                       ("numpy", "ndarray"), ("numpy", "dtype")}
+
+    def find_class(self, module, name):
+        if (module, name) not in self.ALLOWED_GLOBALS:
+            raise pickle.UnpicklingError(f"{module}.{name} is not allowed in a pickled array")
+        return super().find_class(module, name)
+
+
+def convert_pickled_arrays(connection, metadata) -> int:
+    """
+    Rewrites NumpyArray columns still holding pickles (from when they were
+    PickleType) in the array format. Only rows without the format's header are
+    loaded, so once converted this costs a query per column. Returns the number
+    of values converted.
+    """
+    num_of_values_converted = 0
+    for table in metadata.sorted_tables:
+        for column in table.columns:
+            if not isinstance(column.type, NumpyArray):
+                continue
+            raw_column = type_coerce(column, LargeBinary)
+            statement = (select(table.c.id, raw_column)
+                         .where(column.isnot(None))
+                         .where(func.substr(raw_column, 1, len(ARRAY_MAGIC)) != literal(ARRAY_MAGIC, LargeBinary)))
+            for row_id, pickled_value in connection.execute(statement).all():
+                try:
+                    array = np.asarray(ArrayUnpickler(io.BytesIO(pickled_value)).load())
+                except Exception as e:
+                    print(f"Could not convert {table.name}.{column.name} of row {row_id}: {e}")
+                    continue
+                connection.execute(table.update().where(table.c.id == row_id).values({column.name: array}))
+                num_of_values_converted += 1
+    return num_of_values_converted
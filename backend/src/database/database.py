@@ -1,6 +1,9 @@
 import os
+from sqlalchemy import inspect, text
+from sqlalchemy.types import SchemaType
 from sqlmodel import SQLModel, create_engine
 from src.database.models import *
+from src.database.array_column import convert_pickled_arrays
 
 postgres_url = os.getenv("POSTGRES_URL")
 
@@ -12,3 +15,27 @@ engine = create_engine(postgres_url, echo=True)#, connect_args=connect_args)
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    add_missing_columns()
+    with engine.begin() as connection:
+        if num_of_values_converted := convert_pickled_arrays(connection, SQLModel.metadata):
+            print(f"Converted {num_of_values_converted} pickled arrays to the array format")
+
+def add_missing_columns():
+    """
+    create_all only creates missing tables, so columns added to a model since
+    its table was created are added here (all are nullable), with their indexes
+    and enum types.
+    """
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for table in SQLModel.metadata.sorted_tables:
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            missing_columns = [column for column in table.columns if column.name not in existing_columns]
+            for column in missing_columns:
+                if isinstance(column.type, SchemaType): # e.g. an enum type no table has used yet
+                    column.type.create(connection, checkfirst=True)
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+            if missing_columns:
+                for index in table.indexes:
+                    index.create(connection, checkfirst=True)
@@ -28,7 +28,8 @@ class ColourChannelEnum(str, Enum):
 
 # from sqlmodel import Field, SQLModel, PickleType, JSON, Column, ARRAY, Integer, LargeBinary, Relationship
 from sqlmodel import Field, SQLModel, PickleType, JSON, LargeBinary, Relationship
-from sqlalchemy import Column, ARRAY, Float, Integer, String, Text
+from sqlalchemy import Column, ARRAY, BigInteger, Float, Integer, String, Text
+from src.database.array_column import NumpyArray, NumpyArrayField
 
 class Setup(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -70,8 +71,8 @@ class CameraSetupLink(SQLModel, table=True):
     far_face_calibration_spacing: Optional[List[float]] = Field(default=None, sa_column=Column(ARRAY(Float)))
     far_face_calibration_spacing_unc: Optional[List[float]] = Field(default=None, sa_column=Column(ARRAY(Float)))
     far_face_calibration_photo_camera_settings_id: Optional[int] = Field(default=None, foreign_key="camerasettingslink.id")
-    far_face_homography_matrix: Optional[bytes] = Field(default=None, sa_column=PickleType)
-    far_face_homography_covariance_matrix: Optional[bytes] = Field(default=None, sa_column=PickleType)
+    far_face_homography_matrix: Optional[NumpyArrayField] = Field(default=None, sa_column=Column(NumpyArray))
+    far_face_homography_covariance_matrix: Optional[NumpyArrayField] = Field(default=None, sa_column=Column(NumpyArray))
     # far_face_calibratoin_photo_settings_id: Optional[int] = Field(default=None, foreign_key="settings.id") # Add back filling bit to settings
     # far_face_calibration_photo: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary))
     # far_face_calibration_photo_id: Optional[int] = Field(default=None, foreign_key="photo.id")
@@ -100,8 +101,8 @@ class CameraSetupLink(SQLModel, table=True):
     near_face_calibration_photo_camera_settings_id: Optional[int] = Field(default=None, foreign_key="camerasettingslink.id")
     # near_face_calibration_photo: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary))
     # near_face_calibration_photo_id: Optional[int] = Field(default=None, foreign_key="photo.id")
-    near_face_homography_matrix: Optional[bytes] = Field(default=None, sa_column=PickleType) # How do you show 2d shape? (3x3 array)
-    near_face_homography_covariance_matrix: Optional[bytes] = Field(default=None, sa_column=PickleType) # How do you show 2d shape? (9x9 array)
+    near_face_homography_matrix: Optional[NumpyArrayField] = Field(default=None, sa_column=Column(NumpyArray)) # How do you show 2d shape? (3x3 array)
+    near_face_homography_covariance_matrix: Optional[NumpyArrayField] = Field(default=None, sa_column=Column(NumpyArray)) # How do you show 2d shape? (9x9 array)
     near_face_z_shift: Optional[float] = Field(default=None)
     near_face_z_shift_unc: Optional[float] = Field(default=None)
     near_face_non_z_shift: Optional[float] = Field(default=None)
@@ -124,8 +125,8 @@ class CameraSetupLink(SQLModel, table=True):
     distortion_calibration_pattern_size_non_z_dim: Optional[int] = Field(default=None)
     distortion_calibration_pattern_type: Optional[str] = Field(default=None)
     distortion_calibration_pattern_spacing: Optional[float] = Field(default=None) # in mm
-    camera_matrix: Optional[bytes] = Field(default=None, sa_column=PickleType)
-    distortion_coefficients: Optional[bytes] = Field(default=None, sa_column=PickleType)
+    camera_matrix: Optional[NumpyArrayField] = Field(default=None, sa_column=Column(NumpyArray))
+    distortion_coefficients: Optional[NumpyArrayField] = Field(default=None, sa_column=Column(NumpyArray))
     distortion_calibration_camera_settings_link: Optional[int] = Field(default=None, foreign_key="camerasettingslink.id")
 # Others
     lens_position: Optional[float] = Field(default=None)
@@ -283,6 +284,20 @@ class CameraSettingsLink(SQLModel, table=True):
     is_optimal: Optional[bool] = Field(default=None) # Set true/false when associated with a test beam run left Null otherwise
     number_of_images: Optional[int] = Field(default=None)
     take_raw_images: Optional[bool] = Field(default=None)
+    # Set when the main run should be averaged on the Pi rather than transferring every frame
+    reduced_colour_channel: Optional[ColourChannelEnum] = Field(default=None)
+    reduced_frame_statistics: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary)) # .npy of stacked mean and variance
+    reduced_frame_count: Optional[int] = Field(default=None)
+    # Set when frames were cropped on the Pi - [x, y, width, height] of the window and [height, width] of the full frame.
+    # The full frame size is also set on a scintillator edges photo's link, when the photo is taken.
+    crop_window: Optional[List[int]] = Field(default=None, sa_column=Column(ARRAY(Integer)))
+    full_frame_size: Optional[List[int]] = Field(default=None, sa_column=Column(ARRAY(Integer)))
+    # Test runs - per-channel saturation statistics inside the scintillator, computed on the Pi
+    saturation_statistics: Optional[dict] = Field(default=None, sa_column=Column(JSON))
+    # Main runs - the Pi's clock offsets from the backend's (ns), measured just before the run
+    sensor_clock_offset: Optional[int] = Field(default=None, sa_column=Column(BigInteger)) # SensorTimestamp - backend time
+    wall_clock_offset: Optional[int] = Field(default=None, sa_column=Column(BigInteger))
+    clock_offset_uncertainty: Optional[int] = Field(default=None, sa_column=Column(BigInteger))
 
     camera: "Camera" = Relationship(back_populates="settings_links")
     settings: "Settings" = Relationship(back_populates="camera_links")
@@ -297,7 +312,11 @@ class CameraSettingsLink(SQLModel, table=True):
 class Photo(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     camera_settings_link_id: int = Field(default=None, foreign_key="camerasettingslink.id")
-    photo: bytes = Field(default=None, sa_column=Column(LargeBinary))
+    photo: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary)) # Only photos from before the photo store - see src/photo_store.py
+    # The photo's bytes are in the photo store, named by their sha256
+    photo_hash: Optional[str] = Field(default=None, index=True)
+    photo_size: Optional[int] = Field(default=None, sa_column=Column(BigInteger))
+    media_type: Optional[str] = Field(default=None)
     photo_metadata: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary)) #TODO Temporarily optional for testing
 
     camera_settings_link: CameraSettingsLink = Relationship(back_populates="photos")
@@ -352,7 +371,7 @@ class CameraAnalysis(SQLModel, table=True):
     camera_settings_id: int = Field(default=None, foreign_key="camerasettingslink.id") # not optional
     
     colour_channel: ColourChannelEnum = Field(default=None) # not optional
-    average_image: Optional[bytes] = Field(default=None, sa_column=PickleType)
+    average_image: Optional[NumpyArrayField] = Field(default=None, sa_column=Column(NumpyArray))
     beam_angle: Optional[float] = Field(default=None)
     unc_beam_angle: Optional[float] = Field(default=None)
     bragg_peak_pixel: Optional[List[float]] = Field(default=None, sa_column=Column(ARRAY(Float)))
@@ -8,7 +8,6 @@ CALIBRATION IMAGES FOR HOMOGRAPHY!
 """
 import numpy as np
 import cv2 as cv
-import pickle
 import matplotlib.pyplot as plt
 from sqlmodel import Session, select
 from src.calibration_functions import *
@@ -141,9 +140,6 @@ def perform_distortion_calibration_from_database(setup_id, camera):
     ret, camera_matrix, dist, rvecs, tvecs = cv.calibrateCamera(obj_points_array, img_points_array, frame_size,
                                                                 None, None)
     
-    # SAVE TO DATABASE AS PICKLETYPE
-    camera_matrix = pickle.dumps(camera_matrix)
-    distortion_coefficients = pickle.dumps(distortion_coefficients)
     cdi.update_camera_matrix(camera_id, setup_id, camera_matrix)
     cdi.update_distortion_coefficients(camera_id, setup_id, distortion_coefficients)
 
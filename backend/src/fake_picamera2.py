@@ -0,0 +1,208 @@
+"""
+Stand-in for the picamera2 and libcamera modules so camera_daemon.py (and the
+video_script functions it uses) can run on a machine without a Pi camera.
+
+Calling install() registers fake "picamera2" and "libcamera" modules, so it must
+be called BEFORE video_script is imported:
+
+    python camera_daemon.py --fake
+
+Frames are uniform noise around a level set by the analogue gain, and capture
+waits out the requested frame duration so frame timing behaves like the real
+camera. A new AnalogueGain reaches the metadata a couple of frames after it is
+set, and DigitalGain starts away from 1.0 and settles over a few frames after
+the gain changes, as observed on the HQ camera.
+"""
+import sys
+import time
+import types
+from enum import IntEnum
+import numpy as np
+
+try:
+    from PIL import Image
+except ImportError: # make_image is unavailable, but make_array and .npy reductions still work
+    Image = None
+
+
+DEFAULT_FRAME_DURATION = 33333 # microseconds
+DIGITAL_GAIN_SETTLE_FRAMES = 3
+ANALOGUE_GAIN_DELAY_FRAMES = 2 # Frames before a new AnalogueGain reaches the metadata
+
+
+class AfModeEnum(IntEnum):
+    Manual = 0
+    Auto = 1
+    Continuous = 2
+
+
+class Metadata:
+    def __init__(self, metadata: dict):
+        self.__dict__.update(metadata)
+
+
+class FakeRequest:
+    def __init__(self, camera, frame: np.ndarray, metadata: dict):
+        self.camera = camera
+        self.frame = frame
+        self.metadata = metadata
+        self.released = False
+
+    def get_metadata(self):
+        return dict(self.metadata)
+
+    def make_array(self, name="main"):
+        return self.frame.copy()
+
+    def make_image(self, name="main"):
+        if Image is None:
+            raise RuntimeError("Pillow is required for make_image")
+        # Fake main stream is ordered [R, G, B] like the default "BGR888" format
+        return Image.fromarray(self.frame, mode="RGB")
+
+    def save_dng(self, filename, name="raw"):
+        with open(filename, "wb") as file:
+            file.write(self.frame.tobytes())
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.camera.buffers_in_use -= 1
+
+
+class MappedArray:
+    def __init__(self, request: FakeRequest, stream: str):
+        self.array = request.frame
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class Picamera2:
+
+    sensor_resolution = (640, 480)
+
+    def __init__(self, camera_num=0):
+        self.camera_properties = {"Model": "fake", "PixelArraySize": self.sensor_resolution}
+        self.camera_controls = {
+            "AnalogueGain": (1.0, 16.0, 1.0),
+            "FrameDurationLimits": (11111, 10**9, DEFAULT_FRAME_DURATION),
+            "ExposureTime": (1, 10**9, 20000),
+            "LensPosition": (0.0, 10.0, 1.0),
+        }
+        self.camera_config = None
+        self.controls = {}
+        self.started = False
+        self.buffers_in_use = 0
+        self.last_sensor_timestamp = None
+        self.digital_gain = 1.0
+        self.analogue_gain = 1.0
+        self.analogue_gain_delay = 0
+        self.rng = np.random.default_rng(0)
+
+    def create_still_configuration(self, main={}, raw=None, display=None, buffer_count=1, **kwargs):
+        return {"main": {"size": self.sensor_resolution, "format": "BGR888", **main},
+                "raw": None if raw is None else {"size": self.sensor_resolution, "format": "SRGGB12"},
+                "buffer_count": buffer_count}
+
+    def configure(self, config):
+        if self.started:
+            raise RuntimeError("Camera must be stopped before configuring")
+        width, height = config["main"]["size"]
+        config["main"]["stride"] = width * 3
+        config["main"]["framesize"] = width * height * 3
+        if config.get("raw") is not None:
+            config["raw"]["stride"] = width * 2
+            config["raw"]["framesize"] = width * height * 2
+        self.camera_config = config
+
+    def stream_configuration(self, name="main"):
+        return self.camera_config[name]
+
+    def set_controls(self, controls: dict):
+        if "AnalogueGain" in controls and controls["AnalogueGain"] != self.controls.get("AnalogueGain"):
+            self.digital_gain = 1.0 + 0.1 * DIGITAL_GAIN_SETTLE_FRAMES
+            self.analogue_gain_delay = ANALOGUE_GAIN_DELAY_FRAMES
+        self.controls.update(controls)
+
+    def start(self):
+        if self.camera_config is None:
+            self.configure(self.create_still_configuration())
+        self.started = True
+
+    def stop(self):
+        self.started = False
+
+    def close(self):
+        self.stop()
+
+    def frame_duration(self):
+        return self.controls.get("FrameDurationLimits", (DEFAULT_FRAME_DURATION,))[0]
+
+    def wait_for_next_frame(self):
+        """
+        Returns the sensor timestamp (ns) of the next frame, sleeping until it is due.
+        """
+        frame_duration_ns = self.frame_duration() * 10**3
+        now = time.monotonic_ns()
+        if self.last_sensor_timestamp is None or now - self.last_sensor_timestamp > frame_duration_ns:
+            self.last_sensor_timestamp = now
+        else:
+            self.last_sensor_timestamp += frame_duration_ns
+            time.sleep((self.last_sensor_timestamp - now) / 10**9)
+        return self.last_sensor_timestamp
+
+    def next_metadata(self):
+        if not self.started:
+            raise RuntimeError("Camera must be started before capturing")
+        sensor_timestamp = self.wait_for_next_frame()
+        self.digital_gain = max(1.0, self.digital_gain - 0.1)
+        if self.analogue_gain_delay:
+            self.analogue_gain_delay -= 1
+        else:
+            self.analogue_gain = float(self.controls.get("AnalogueGain", 1.0))
+        return {"SensorTimestamp": sensor_timestamp,
+                "ExposureTime": self.controls.get("ExposureTime", self.frame_duration() // 2),
+                "AnalogueGain": self.analogue_gain,
+                "DigitalGain": self.digital_gain,
+                "FrameDuration": self.frame_duration(),
+                "LensPosition": self.controls.get("LensPosition", 1.0)}
+
+    def capture_metadata(self):
+        return self.next_metadata()
+
+    def capture_request(self):
+        if self.buffers_in_use >= self.camera_config["buffer_count"]:
+            raise RuntimeError("All camera buffers are held by unreleased requests")
+        metadata = self.next_metadata()
+        width, height = self.camera_config["main"]["size"]
+        level = min(250, 10 * metadata["AnalogueGain"] * metadata["DigitalGain"])
+        frame = np.clip(self.rng.normal(level, 2, (height, width, 3)), 0, 255).astype(np.uint8)
+        self.buffers_in_use += 1
+        return FakeRequest(self, frame, metadata)
+
+    def capture_array(self, name="main"):
+        request = self.capture_request()
+        try:
+            return request.make_array(name)
+        finally:
+            request.release()
+
+
+def install():
+    """
+    Registers the fake modules under the real names for subsequent imports.
+    """
+    picamera2_module = types.ModuleType("picamera2")
+    picamera2_module.Picamera2 = Picamera2
+    picamera2_module.Metadata = Metadata
+    picamera2_module.MappedArray = MappedArray
+
+    libcamera_module = types.ModuleType("libcamera")
+    libcamera_module.controls = types.SimpleNamespace(AfModeEnum=AfModeEnum)
+
+    sys.modules["picamera2"] = picamera2_module
+    sys.modules["libcamera"] = libcamera_module
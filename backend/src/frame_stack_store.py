@@ -0,0 +1,299 @@
+"""
+Decoded frames of each camera settings link, written as they are transferred so
+the analysis reads pixels rather than decoding every JPEG again.
+
+Each camera settings link gets a directory of .npy chunks of up to chunk_size
+frames, which are memory mapped for reading:
+
+    FRAME_STACK_DIRECTORY/<camera settings link id>/chunk_00000.npy   (chunk_size, height, width, 3) uint8
+                                                   /frames.json       photo id of each frame, in order
+
+A chunk is created full size (sparse until written) and frames.json says how
+many of its frames are written. frames.json is replaced atomically after each
+chunk fills and when the transfer ends, so a transfer that fails part way
+leaves a stack that resumes from the last frame it recorded.
+
+Frames not in a stack (photos from before it, or frames that did not decode)
+are decoded from the photo as before - see load_frames. So stacks are a cache:
+a stack is deleted with its camera settings link's photos, and the least
+recently written stacks are evicted once they take more than
+FRAME_STACK_MAX_SIZE_GB - see collect_frame_stack_garbage:
+
+    python -m src.frame_stack_store collect-garbage
+"""
+import argparse
+import json
+import os
+import shutil
+import cv2
+import numpy as np
+
+from src.database.CRUD import CRISP_database_interaction as cdi
+
+FRAME_STACK_DIRECTORY = os.getenv("FRAME_STACK_DIRECTORY", "/frame_stacks")
+DEFAULT_CHUNK_SIZE = 8 # 12 MP BGR frames are 36 MB, so a chunk is ~290 MB
+FRAME_STACK_MAX_SIZE_GB = float(os.getenv("FRAME_STACK_MAX_SIZE_GB", "200"))
+
+
+def get_frame_stack_directory(camera_settings_link_id: int, directory=FRAME_STACK_DIRECTORY):
+    return os.path.join(directory, str(camera_settings_link_id))
+
+
+def get_chunk_path(stack_directory: str, chunk_number: int):
+    return os.path.join(stack_directory, f"chunk_{chunk_number:05d}.npy")
+
+
+def read_frame_stack_manifest(stack_directory: str):
+    try:
+        with open(os.path.join(stack_directory, "frames.json")) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+class FrameStack:
+    """
+    Read-only view of a camera settings link's decoded frames.
+    """
+
+    def __init__(self, stack_directory: str, manifest: dict):
+        self.stack_directory = stack_directory
+        self.chunk_size = manifest["chunk_size"]
+        self.photo_ids = manifest["photo_ids"]
+        self.frame_indices = {photo_id: index for index, photo_id in enumerate(self.photo_ids)}
+        self.chunks = {}
+
+    @classmethod
+    def open(cls, camera_settings_link_id: int, directory=FRAME_STACK_DIRECTORY):
+        """
+        None if the camera settings link has no frame stack.
+        """
+        stack_directory = get_frame_stack_directory(camera_settings_link_id, directory)
+        if (manifest := read_frame_stack_manifest(stack_directory)) is None:
+            return None
+        return cls(stack_directory, manifest)
+
+    def get_chunk(self, chunk_number: int) -> np.ndarray:
+        if chunk_number not in self.chunks:
+            self.chunks[chunk_number] = np.load(get_chunk_path(self.stack_directory, chunk_number), mmap_mode="r")
+        return self.chunks[chunk_number]
+
+    def get_frame(self, photo_id: int):
+        """
+        The frame as decoded by cv2.imdecode (a read-only view), or None if it isn't in the stack.
+        """
+        if (index := self.frame_indices.get(photo_id)) is None:
+            return None
+        return self.get_chunk(index // self.chunk_size)[index % self.chunk_size]
+
+    def __contains__(self, photo_id: int):
+        return photo_id in self.frame_indices
+
+    def __len__(self):
+        return len(self.photo_ids)
+
+
+class FrameStackWriter:
+    """
+    Appends decoded frames of one camera settings link to its stack, carrying on
+    from any frames already recorded. Every frame must have the same shape.
+    """
+
+    def __init__(self, camera_settings_link_id: int, directory=FRAME_STACK_DIRECTORY, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.stack_directory = get_frame_stack_directory(camera_settings_link_id, directory)
+        os.makedirs(self.stack_directory, exist_ok=True)
+        manifest = read_frame_stack_manifest(self.stack_directory)
+        self.chunk_size = manifest["chunk_size"] if manifest is not None else chunk_size
+        self.photo_ids = manifest["photo_ids"] if manifest is not None else []
+        self.frame_shape = tuple(manifest["frame_shape"]) if manifest is not None else None
+        self.held_photo_ids = set(self.photo_ids)
+        self.chunk = None
+        self.chunk_number = None
+
+    def append(self, photo_id: int, frame: np.ndarray):
+        if photo_id in self.held_photo_ids:
+            return
+        if self.frame_shape is None:
+            self.frame_shape = frame.shape
+        elif frame.shape != self.frame_shape:
+            raise ValueError(f"Frame of photo {photo_id} is {frame.shape}, not {self.frame_shape} as the rest of the stack")
+        index = len(self.photo_ids)
+        chunk_number = index // self.chunk_size
+        if chunk_number != self.chunk_number:
+            self.open_chunk(chunk_number)
+        self.chunk[index % self.chunk_size] = frame
+        self.photo_ids.append(photo_id)
+        self.held_photo_ids.add(photo_id)
+        if len(self.photo_ids) % self.chunk_size == 0:
+            self.write_manifest()
+
+    def open_chunk(self, chunk_number: int):
+        if self.chunk is not None:
+            self.chunk.flush()
+        path = get_chunk_path(self.stack_directory, chunk_number)
+        if os.path.exists(path): # Partly written before a transfer failed
+            self.chunk = np.load(path, mmap_mode="r+")
+        else:
+            self.chunk = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8,
+                                                   shape=(self.chunk_size,) + tuple(self.frame_shape))
+        self.chunk_number = chunk_number
+
+    def write_manifest(self):
+        if self.chunk is not None:
+            self.chunk.flush()
+        manifest = {"chunk_size": self.chunk_size, "frame_shape": list(self.frame_shape), "photo_ids": self.photo_ids}
+        temporary_path = os.path.join(self.stack_directory, ".frames.json.tmp")
+        with open(temporary_path, "w") as file:
+            json.dump(manifest, file)
+        os.replace(temporary_path, os.path.join(self.stack_directory, "frames.json"))
+
+    def close(self):
+        if self.frame_shape is not None:
+            self.write_manifest()
+        self.chunk = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FrameStackIngest:
+    """
+    Used by Camera.transfer_video_frames - decodes each frame once as it arrives
+    and appends it to its camera settings link's stack. A frame that can't be
+    decoded (e.g. a DNG) is left out, and is decoded from its photo when read.
+    """
+
+    def __init__(self, directory=FRAME_STACK_DIRECTORY, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.writers = {} # Camera settings link id: FrameStackWriter
+
+    def add_frame(self, camera_settings_link_id: int, photo_id: int, image_bytes: bytes):
+        writer = self.writers.get(camera_settings_link_id)
+        if writer is None:
+            writer = self.writers[camera_settings_link_id] = FrameStackWriter(camera_settings_link_id, self.directory, self.chunk_size)
+        if photo_id in writer.held_photo_ids:
+            return
+        frame = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            return
+        try:
+            writer.append(photo_id, frame)
+        except ValueError as e:
+            print(f"Frame not added to the frame stack: {e}")
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        evict_frame_stacks(self.directory, keep_camera_settings_link_ids=set(self.writers))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_frames(camera_settings_link_id: int, photo_ids: list[int], directory=FRAME_STACK_DIRECTORY):
+    """
+    Yields each photo decoded, read from the camera settings link's frame stack
+    where it has one. Frames from the stack are read-only.
+    """
+    frame_stack = FrameStack.open(camera_settings_link_id, directory)
+    for photo_id in photo_ids:
+        if frame_stack is not None and (frame := frame_stack.get_frame(photo_id)) is not None:
+            yield frame
+        else:
+            yield cv2.imdecode(np.frombuffer(cdi.get_photo_buffer_from_id(photo_id), np.uint8), cv2.IMREAD_COLOR)
+
+
+def load_frame(camera_settings_link_id: int, photo_id: int, directory=FRAME_STACK_DIRECTORY):
+    return next(load_frames(camera_settings_link_id, [photo_id], directory))
+
+
+def delete_frame_stack(camera_settings_link_id: int, directory=FRAME_STACK_DIRECTORY):
+    shutil.rmtree(get_frame_stack_directory(camera_settings_link_id, directory), ignore_errors=True)
+
+
+def get_frame_stack_size(stack_directory: str) -> int:
+    """
+    Bytes on disk - chunks are sparse until written, so this is less than their length.
+    """
+    with os.scandir(stack_directory) as entries:
+        return sum(entry.stat().st_blocks * 512 for entry in entries if entry.is_file())
+
+
+def list_frame_stacks(directory=FRAME_STACK_DIRECTORY) -> list[tuple[int, float, int]]:
+    """
+    (Camera settings link id, time frames.json was last written, bytes on disk)
+    of each stack, least recently written first.
+    """
+    frame_stacks = []
+    if not os.path.isdir(directory):
+        return frame_stacks
+    for name in os.listdir(directory):
+        stack_directory = os.path.join(directory, name)
+        if not name.isdigit() or not os.path.isdir(stack_directory):
+            continue
+        try:
+            last_written = os.path.getmtime(os.path.join(stack_directory, "frames.json"))
+        except FileNotFoundError: # Failed before its first chunk filled
+            last_written = os.path.getmtime(stack_directory)
+        frame_stacks.append((int(name), last_written, get_frame_stack_size(stack_directory)))
+    return sorted(frame_stacks, key=lambda frame_stack: frame_stack[1])
+
+
+def evict_frame_stacks(directory=FRAME_STACK_DIRECTORY, max_size_gb=FRAME_STACK_MAX_SIZE_GB,
+                       keep_camera_settings_link_ids=frozenset()) -> int:
+    """
+    Deletes the least recently written stacks (other than those kept) until the
+    rest take at most max_size_gb. Returns the number deleted.
+    """
+    frame_stacks = list_frame_stacks(directory)
+    total_size = sum(size for _, _, size in frame_stacks)
+    num_of_stacks_deleted = 0
+    for camera_settings_link_id, _, size in frame_stacks:
+        if total_size <= max_size_gb * 10**9:
+            break
+        if camera_settings_link_id in keep_camera_settings_link_ids:
+            continue
+        delete_frame_stack(camera_settings_link_id, directory)
+        total_size -= size
+        num_of_stacks_deleted += 1
+    return num_of_stacks_deleted
+
+
+def collect_frame_stack_garbage(directory=FRAME_STACK_DIRECTORY, max_size_gb=FRAME_STACK_MAX_SIZE_GB) -> int:
+    """
+    Deletes the stacks of camera settings links that no longer have photos (e.g.
+    deleted with their link), then evicts as evict_frame_stacks. Returns the number deleted.
+    """
+    camera_settings_link_ids = [camera_settings_link_id for camera_settings_link_id, _, _ in list_frame_stacks(directory)]
+    with_photos = set(cdi.get_camera_settings_link_ids_with_photos(camera_settings_link_ids))
+    num_of_stacks_deleted = 0
+    for camera_settings_link_id in camera_settings_link_ids:
+        if camera_settings_link_id not in with_photos:
+            delete_frame_stack(camera_settings_link_id, directory)
+            num_of_stacks_deleted += 1
+    return num_of_stacks_deleted + evict_frame_stacks(directory, max_size_gb)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Maintain the frame stacks")
+    parser.add_argument("command", choices=["collect-garbage"],
+                        help="collect-garbage: delete the stacks of links without photos, then evict down to max_size_gb")
+    parser.add_argument("-max", "--max_size_gb", type=float, help="Size the stacks are evicted down to", default=FRAME_STACK_MAX_SIZE_GB)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    num_of_stacks_deleted = collect_frame_stack_garbage(max_size_gb=args.max_size_gb)
+    print(f"Deleted {num_of_stacks_deleted} frame stacks from {FRAME_STACK_DIRECTORY}")
+
+
+if __name__ == "__main__":
+    main()
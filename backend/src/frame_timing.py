@@ -0,0 +1,65 @@
+"""
+Frame timing of a run, from the per-frame metadata video_script stores with
+each photo, so throughput regressions on the Pis show up without their logs.
+"""
+import json
+import numpy as np
+
+# Slowest stage reported as the bottleneck when the requested frame rate is missed
+CAPTURE_STAGES = ("capture_duration", "settle_duration", "writer_wait_duration", "dng_duration", "encode_duration")
+DROPPED_FRAME_INTERVAL_FACTOR = 1.5
+
+
+def load_frame_metadata(photo_metadata: list[bytes]) -> list[dict]:
+    """
+    Ordered by frame index - pipelined runs store frames in the order they were saved.
+    """
+    frame_metadata = [json.loads(metadata) for metadata in photo_metadata]
+    return sorted(frame_metadata, key=lambda metadata: metadata.get("index", 0))
+
+
+def summarise_stage_duration(frame_metadata: list[dict], stage: str):
+    durations = np.array([metadata[stage] for metadata in frame_metadata if stage in metadata])
+    if durations.size == 0:
+        return None
+    return {"mean": float(np.mean(durations)),
+            "p95": float(np.percentile(durations, 95)),
+            "max": float(np.max(durations))}
+
+
+def summarise_frame_timing(frame_metadata: list[dict], requested_frame_rate: float) -> dict:
+    """
+    SensorTimestamp is in nanoseconds, the returned intervals in milliseconds.
+    Jitter is the standard deviation of the intervals between consecutive frames,
+    and frames more than 1.5 requested intervals apart are counted as dropped.
+    """
+    requested_frame_interval = 1000 / requested_frame_rate
+    sensor_timestamps = np.array([metadata["SensorTimestamp"] for metadata in frame_metadata if "SensorTimestamp" in metadata])
+    summary = {"number_of_frames": len(frame_metadata),
+               "requested_frame_rate": requested_frame_rate,
+               "achieved_frame_rate": None,
+               "mean_frame_interval": None,
+               "frame_interval_jitter": None,
+               "max_frame_interval": None,
+               "dropped_frames": None,
+               "stage_durations": {},
+               "bottleneck": None}
+
+    if sensor_timestamps.size >= 2:
+        frame_intervals = np.diff(sensor_timestamps) / 10**6
+        summary["achieved_frame_rate"] = float(1000 / np.mean(frame_intervals))
+        summary["mean_frame_interval"] = float(np.mean(frame_intervals))
+        summary["frame_interval_jitter"] = float(np.std(frame_intervals))
+        summary["max_frame_interval"] = float(np.max(frame_intervals))
+        # An interval of n requested intervals means n - 1 frames were missed
+        missed_intervals = np.round(frame_intervals / requested_frame_interval) - 1
+        summary["dropped_frames"] = int(np.sum(missed_intervals[frame_intervals > DROPPED_FRAME_INTERVAL_FACTOR * requested_frame_interval]))
+
+    for stage in CAPTURE_STAGES:
+        if (stage_summary := summarise_stage_duration(frame_metadata, stage)) is not None:
+            summary["stage_durations"][stage] = stage_summary
+
+    frame_rate_missed = summary["achieved_frame_rate"] is not None and summary["achieved_frame_rate"] < 0.95 * requested_frame_rate
+    if frame_rate_missed and summary["stage_durations"]:
+        summary["bottleneck"] = max(summary["stage_durations"], key=lambda stage: summary["stage_durations"][stage]["mean"])
+    return summary
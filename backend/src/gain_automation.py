@@ -1,6 +1,8 @@
 import cv2
 import numpy as np
 from src.camera_functions import load_image_byte_string_to_opencv
+from src.frame_stack_store import load_frame
+from src.sensor_crop import SCINTILLATOR_EDGE_INSET, restore_full_frame_if_cropped
 from src.database.CRUD import CRISP_database_interaction as cdi
 from enum import Enum
 
@@ -30,8 +32,8 @@ def restrict_to_region_of_interest(image: np.ndarray,
         vertical_start = 0
     if vertical_end is None:
         vertical_end = image.shape[0]
-    scintillator_horizontal_roi = [horizontal_start + 5, horizontal_end - 5]
-    scintillator_vertical_roi = [vertical_start + 5, vertical_end - 5]
+    scintillator_horizontal_roi = [horizontal_start + SCINTILLATOR_EDGE_INSET, horizontal_end - SCINTILLATOR_EDGE_INSET]
+    scintillator_vertical_roi = [vertical_start + SCINTILLATOR_EDGE_INSET, vertical_end - SCINTILLATOR_EDGE_INSET]
     
     scintillator_region = image[scintillator_vertical_roi[0]:scintillator_vertical_roi[-1],
                                 scintillator_horizontal_roi[0]:scintillator_horizontal_roi[-1]]
@@ -56,9 +58,10 @@ def mark_saturation(image: np.ndarray, threshold: int=5) -> np.ndarray:
 def determine_optimal_settings(photo_ids: list[int], threshold: int=5) -> int:
     is_saturated = np.empty((len(photo_ids), 3), dtype=object)
     for count, photo_id in enumerate(photo_ids):
-        photo = cdi.get_photo_from_id(photo_id)
         gain = cdi.get_gain_from_photo_id(photo_id)
-        image = load_image_byte_string_to_opencv(photo)
+        camera_settings_link_id = cdi.get_camera_settings_by_photo_id(photo_id).id
+        image = load_frame(camera_settings_link_id, photo_id)
+        image = restore_full_frame_if_cropped(image, camera_settings_link_id)
         blue_channel_image =image[:, :, 0] #TODO For generality this should be a variable
         horizontal_start, horizontal_end, vertical_start, vertical_end = cdi.get_scintillator_edges_by_photo_id(photo_id)
         blue_channel_image = restrict_to_region_of_interest(blue_channel_image, horizontal_start, horizontal_end, vertical_start, vertical_end)
@@ -73,7 +76,31 @@ def determine_optimal_settings(photo_ids: list[int], threshold: int=5) -> int:
     optimal_settings_photo_id = is_saturated[lowest_gain_index, 2]
     return optimal_settings_photo_id
 
-def set_optimal_settings(photo_ids: int, threshold: int=5):
+def determine_optimal_settings_from_statistics(saturation_statistics: dict, threshold: int=5, colour_channel: str="blue"):
+    """
+    saturation_statistics: {camera_settings_link_id: statistics computed on the Pi}
+    A gain is saturated if any pixel in the scintillator reaches the threshold,
+    i.e. if the channel maximum does. Returns the camera settings link id of the
+    highest unsaturated gain, or None if every gain saturated.
+    """
+    saturation_brightness = 255 - threshold
+    unsaturated_gains = {camera_settings_link_id: statistics["gain"] 
+                         for camera_settings_link_id, statistics in saturation_statistics.items()
+                         if statistics["channels"][colour_channel]["max"] < saturation_brightness}
+    if not unsaturated_gains:
+        return None
+    return max(unsaturated_gains, key=unsaturated_gains.get)
+
+def set_optimal_settings(camera_settings_link_ids: list[int], photo_ids: list[int], threshold: int=5):
+    if saturation_statistics := cdi.get_saturation_statistics(camera_settings_link_ids):
+        optimal_camera_settings_id = determine_optimal_settings_from_statistics(saturation_statistics, threshold=threshold)
+        if optimal_camera_settings_id is None:
+            cdi.update_no_optimal_by_camera_settings_ids(camera_settings_link_ids)
+            return
+        cdi.update_is_optimal_by_camera_settings_id(optimal_camera_settings_id)
+        return
+    
+    # No statistics if the scintillator edges were not set, so the images are checked instead
     # camera_settings = cdi.get_camera_settings_by_photo_id(photo_ids[0])
     optimal_photo_id = determine_optimal_settings(photo_ids, threshold=threshold)
     if optimal_photo_id is None:
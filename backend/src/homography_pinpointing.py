@@ -43,51 +43,58 @@ class AxesMapping:
 class AbstractCamera(ABC):
     # Factory for producing cameras
     @staticmethod
-    def setup(camera_id, setup_id):
-            camera_optical_axis = cdi.get_camera_optical_axis(camera_id, setup_id)
+    def setup(camera_id, setup_id, camera_setup_context=None):
+            """
+            camera_setup_context: the camera's cdi.CameraSetupContext, if already loaded
+            (e.g. with cdi.get_camera_setup_contexts for several cameras at once).
+            """
+            if camera_setup_context is None:
+                camera_setup_context = cdi.get_camera_setup_context(camera_id, setup_id)
+            camera_optical_axis = camera_setup_context.optical_axis
             match camera_optical_axis:
                 case "y":
                     print("Creating top camera...")
-                    return TopCamera(camera_id, setup_id)
+                    return TopCamera(camera_setup_context)
                 case "x":
                     print("Creating side camera...")
-                    return SideCamera(camera_id, setup_id)
+                    return SideCamera(camera_setup_context)
                 case _:
                     raise ValueError("Unknown camera axis: {} \Valid types are {'x', 'y'}".format(camera_optical_axis))
             
-    def __init__(self, camera_id, setup_id):
+    def __init__(self, camera_setup_context):
         """
-        Lots of postgreSQL sessions to open, could it all be done in one session?
+        Everything is read from camera_setup_context, which is loaded in one query.
         """
         if type(self) is AbstractCamera:
             raise NotImplementedError("AbstractCamera class is abstract, use AbstractCamera.setup(camera_id, setup_id) to intialise a camera object.")
         
-        self.scintillator = Scintillator(refractive_index=cdi.get_block_refractive_index(setup_id),
-                                         refractive_index_unc=cdi.get_block_refractive_index_unc(setup_id))
+        context = camera_setup_context
+        self.scintillator = Scintillator(refractive_index=context.block_refractive_index,
+                                         refractive_index_unc=context.block_refractive_index_unc)
         
-        self.setup_id = setup_id
-        self.camera_id = camera_id
-        self.front_homography_matrix= cdi.get_near_face_homography_matrix(camera_id, setup_id)
-        self.front_homography_covariance = cdi.get_near_face_homography_covariance_matrix(camera_id, setup_id)
-        self.back_homography_matrix = cdi.get_far_face_homography_matrix(camera_id, setup_id)
-        self.back_homography_covariance = cdi.get_far_face_homography_covariance_matrix(camera_id, setup_id)
+        self.setup_id = context.setup_id
+        self.camera_id = context.camera_id
+        self.front_homography_matrix= context.near_face_homography_matrix
+        self.front_homography_covariance = context.near_face_homography_covariance_matrix
+        self.back_homography_matrix = context.far_face_homography_matrix
+        self.back_homography_covariance = context.far_face_homography_covariance_matrix
         
-        self.near_origin_shift = [cdi.get_near_face_z_shift(camera_id, setup_id),
-                                  cdi.get_near_face_non_z_shift(camera_id, setup_id)
+        self.near_origin_shift = [context.near_face_z_shift,
+                                  context.near_face_non_z_shift
                                 ]
-        self.near_origin_shift_uncertainty = [cdi.get_near_face_z_shift_unc(camera_id, setup_id),
-                                  cdi.get_near_face_non_z_shift_unc(camera_id, setup_id)
+        self.near_origin_shift_uncertainty = [context.near_face_z_shift_unc,
+                                  context.near_face_non_z_shift_unc
                                 ]
-        self.far_origin_shift = [cdi.get_far_face_z_shift(camera_id, setup_id),
-                                  cdi.get_far_face_non_z_shift(camera_id, setup_id)
+        self.far_origin_shift = [context.far_face_z_shift,
+                                  context.far_face_non_z_shift
                                 ]
-        self.far_origin_shift_uncertainty = [cdi.get_far_face_z_shift_unc(camera_id, setup_id),
-                                  cdi.get_far_face_non_z_shift_unc(camera_id, setup_id)
+        self.far_origin_shift_uncertainty = [context.far_face_z_shift_unc,
+                                  context.far_face_non_z_shift_unc
                                 ]
-        self.near_calibration_board_thickness = cdi.get_near_face_calibration_board_thickness(camera_id, setup_id)
-        self.near_calibration_board_thickness_unc = cdi.get_near_face_calibration_board_thickness_unc(camera_id, setup_id)
-        self.far_calibration_board_thickness = cdi.get_far_face_calibration_board_thickness(camera_id, setup_id)
-        self.far_calibration_board_thickness_unc = cdi.get_far_face_calibration_board_thickness_unc(camera_id, setup_id)
+        self.near_calibration_board_thickness = context.near_face_calibration_board_thickness
+        self.near_calibration_board_thickness_unc = context.near_face_calibration_board_thickness_unc
+        self.far_calibration_board_thickness = context.far_face_calibration_board_thickness
+        self.far_calibration_board_thickness_unc = context.far_face_calibration_board_thickness_unc
         
     def map_image_coord_to_3d_point(self, physical_point_in_calibration_plane: float, depth: float) -> np.ndarray:
         """
@@ -283,13 +290,13 @@ class AbstractCamera(ABC):
 
 class TopCamera(AbstractCamera):
     
-    def __init__(self, camera_id, setup_id):
-        super().__init__(camera_id, setup_id)
-        self.seen_scintillator_depth = cdi.get_block_y_dimension(setup_id)
-        self.seen_scintillator_depth_uncertainty = cdi.get_block_y_dimension_unc(setup_id)
+    def __init__(self, camera_setup_context):
+        super().__init__(camera_setup_context)
+        self.seen_scintillator_depth = camera_setup_context.block_y_dimension
+        self.seen_scintillator_depth_uncertainty = camera_setup_context.block_y_dimension_unc
         self.axes_mapping = AxesMapping(non_z_axis="x",
                                         optical_axis="y",
-                                        depth_direction=cdi.get_camera_depth_direction(camera_id, setup_id))
+                                        depth_direction=camera_setup_context.depth_direction)
     
     def build_direction_vector(self, tan_phi: float, tan_theta: float, unc_tan_phi: float, unc_tan_theta: float, scintillator_present: bool=False):
         directional_vector = np.array([tan_theta, -1, tan_phi])
@@ -335,13 +342,13 @@ class TopCamera(AbstractCamera):
 
 
 class SideCamera(AbstractCamera):
-    def __init__(self, camera_id, setup_id):
-        super().__init__(camera_id, setup_id)
-        self.seen_scintillator_depth = cdi.get_block_x_dimension(setup_id)
-        self.seen_scintillator_depth_uncertainty = cdi.get_block_x_dimension_unc(setup_id)
+    def __init__(self, camera_setup_context):
+        super().__init__(camera_setup_context)
+        self.seen_scintillator_depth = camera_setup_context.block_x_dimension
+        self.seen_scintillator_depth_uncertainty = camera_setup_context.block_x_dimension_unc
         self.axes_mapping = AxesMapping(non_z_axis="y",
                                         optical_axis="x",
-                                        depth_direction=cdi.get_camera_depth_direction(camera_id, setup_id))
+                                        depth_direction=camera_setup_context.depth_direction)
         
         # HACK - test to see how board angle effects measurements.
         # self.far_calibration_board_thickness -= 2 # mm
@@ -876,7 +883,8 @@ def perform_homography_pinpointing_between_camera_pair_for_GUI(setup_id, first_c
 def perform_second_homography_pinpointing_between_camera_pair_for_GUI(setup_id, camera_id_list, pixel_coord_list,
                                                                       unc_pixel_coord_list):
     try:
-        cameras = [AbstractCamera.setup(camera_id, setup_id) for camera_id in camera_id_list]
+        cameras = [AbstractCamera.setup(camera_id, setup_id, camera_setup_context)
+                   for camera_id, camera_setup_context in zip(camera_id_list, cdi.get_camera_setup_contexts(camera_id_list, setup_id))]
 
         intersection_point, unc_intersection_point = extract_weighted_average_3d_physical_position(cameras, pixel_coord_list, unc_pixel_coord_list, scintillator_present=False)
         
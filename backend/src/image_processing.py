@@ -1,10 +1,12 @@
 import cv2 as cv
 import numpy as np
-import pickle
+from io import BytesIO
 
 from src.distortion_correction import undistort_image
 from src.calibration_functions import determine_frame_size
 from src.camera_functions import load_image_byte_string_to_opencv
+from src.sensor_crop import restore_full_frame
+from src.frame_stack_store import load_frame, load_frames
 import matplotlib.pyplot as plt
 from src.database.CRUD import CRISP_database_interaction as cdi
 # from fft_script import apply_fft_filtering
@@ -35,23 +37,29 @@ def average_pixel_over_multiple_images(camera_analysis_id: int):
     be added here later if need be.
     """
     camera_settings_link_id = cdi.get_camera_settings_link_id_by_camera_analysis_id(camera_analysis_id)
+    colour_channel = cdi.get_colour_channel(camera_analysis_id)
+    if cdi.get_reduced_colour_channel(camera_settings_link_id) == colour_channel:
+        reduced_frame_statistics, _ = cdi.get_reduced_frame_statistics(camera_settings_link_id)
+        if reduced_frame_statistics is not None:
+            return use_reduced_average_image(camera_analysis_id, camera_settings_link_id, reduced_frame_statistics)
+    
     photo_id_array = cdi.get_successfully_captured_photo_ids_by_camera_settings_link_id(camera_settings_link_id)
     
+    crop_window, _ = cdi.get_crop_window(camera_settings_link_id)
+    if crop_window is not None:
+        return average_cropped_images(camera_analysis_id, camera_settings_link_id, photo_id_array, colour_channel)
     
     # HACK - uncommented out for run 24 70 MeV to handle the 7 black images taken when the beam was off
     # photo_id_array = photo_id_array[:-7]
 
 
-    colour_channel = cdi.get_colour_channel(camera_analysis_id)
-    
     camera_id = (cdi.get_camera_and_settings_ids(camera_settings_link_id)["camera_id"])
     beam_run_id = cdi.get_beam_run_id_by_camera_settings_link_id(camera_settings_link_id)
     experiment_id = cdi.get_experiment_id_from_beam_run_id(beam_run_id)
     setup_id = cdi.get_setup_id_from_experiment_id(experiment_id)
     
     num_of_images_used = len(photo_id_array)
-    test_photo_bytes = cdi.get_photo_from_id(photo_id_array[0])
-    test_image = load_image_byte_string_to_opencv(test_photo_bytes)
+    test_image = load_frame(camera_settings_link_id, photo_id_array[0])
     
     if correct_for_distortion := cdi.check_for_distortion_correction_condition(camera_id, setup_id):
         camera_matrix = cdi.get_camera_matrix(camera_id, setup_id)
@@ -65,9 +73,7 @@ def average_pixel_over_multiple_images(camera_analysis_id: int):
     shape = (frame_size[0], frame_size[1])
     cumulative_pixel_val_sum = np.zeros(shape, dtype=np.float64)
     
-    for photo_id in photo_id_array:
-        photo_bytes = cdi.get_photo_from_id(photo_id)
-        image = load_image_byte_string_to_opencv(photo_bytes)
+    for image in load_frames(camera_settings_link_id, photo_id_array):
         if correct_for_distortion:
             image = undistort_image(camera_matrix, distortion_coefficients, original_frame_size, image=image)
         
@@ -78,10 +84,73 @@ def average_pixel_over_multiple_images(camera_analysis_id: int):
     # poisson_standard_error_on_mean = np.sqrt(average_image / num_of_images_used)
     
     float_16_image = average_image.astype(np.float16)
-    serialized_float_16_image = pickle.dumps(float_16_image, protocol=pickle.HIGHEST_PROTOCOL)
-    image_memory_size = len(serialized_float_16_image)
-    print(f"Memory size of the rounded serialized average image: {image_memory_size/10**6} MB")
-    cdi.update_average_image(camera_analysis_id, serialized_float_16_image)
+    print(f"Memory size of the rounded average image: {float_16_image.nbytes/10**6} MB")
+    cdi.update_average_image(camera_analysis_id, float_16_image)
+    return average_image
+
+
+def average_cropped_images(camera_analysis_id: int, camera_settings_link_id: int, photo_id_array: list[int], colour_channel: str):
+    """
+    Frames cropped on the Pi are averaged as they are - only the mean is put back
+    in the full frame and undistorted.
+    """
+    cumulative_pixel_val_sum = None
+    for image in load_frames(camera_settings_link_id, photo_id_array):
+        image_channel = select_image_colour_channel(image, colour_channel)
+        if cumulative_pixel_val_sum is None:
+            cumulative_pixel_val_sum = np.zeros(image_channel.shape, dtype=np.float64)
+        cumulative_pixel_val_sum += image_channel
+    
+    average_image = correct_average_image(camera_settings_link_id, cumulative_pixel_val_sum / len(photo_id_array))
+    store_average_image(camera_analysis_id, average_image)
+    return average_image
+
+
+def correct_average_image(camera_settings_link_id: int, average_image: np.ndarray):
+    """
+    Averages of frames cropped on the Pi are placed back in the full frame, then
+    undistorted if distortion correction is set up. Undistortion interpolates 
+    linearly, so undistorting the mean is equivalent to averaging the undistorted
+    frames.
+    """
+    crop_window, full_frame_size = cdi.get_crop_window(camera_settings_link_id)
+    if crop_window is not None:
+        average_image = restore_full_frame(average_image, crop_window, full_frame_size)
+    
+    camera_id = (cdi.get_camera_and_settings_ids(camera_settings_link_id)["camera_id"])
+    beam_run_id = cdi.get_beam_run_id_by_camera_settings_link_id(camera_settings_link_id)
+    experiment_id = cdi.get_experiment_id_from_beam_run_id(beam_run_id)
+    setup_id = cdi.get_setup_id_from_experiment_id(experiment_id)
+    
+    if cdi.check_for_distortion_correction_condition(camera_id, setup_id):
+        camera_matrix = cdi.get_camera_matrix(camera_id, setup_id)
+        distortion_coefficients = cdi.get_distortion_coefficients(camera_id, setup_id)
+        original_frame_size = determine_frame_size(image=average_image)
+        average_image = undistort_image(camera_matrix, distortion_coefficients, original_frame_size, image=average_image)
+    return average_image
+
+
+def store_average_image(camera_analysis_id: int, average_image: np.ndarray):
+    cdi.update_average_image(camera_analysis_id, average_image.astype(np.float16))
+
+
+def load_reduced_frame_statistics(reduced_frame_statistics: bytes):
+    """
+    The Pi saves the per-pixel mean and variance of one colour channel stacked 
+    in a single float32 .npy.
+    """
+    mean_and_variance = np.load(BytesIO(reduced_frame_statistics), allow_pickle=False)
+    return mean_and_variance[0], mean_and_variance[1]
+
+
+def use_reduced_average_image(camera_analysis_id: int, camera_settings_link_id: int, reduced_frame_statistics: bytes):
+    """
+    Stores the mean computed on the Pi as the analysis' average image, so no frames
+    need decoding.
+    """
+    average_image, _ = load_reduced_frame_statistics(reduced_frame_statistics)
+    average_image = correct_average_image(camera_settings_link_id, average_image)
+    store_average_image(camera_analysis_id, average_image)
     return average_image
 
 
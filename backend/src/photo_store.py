@@ -0,0 +1,186 @@
+"""
+Photo bytes are kept on the backend's filesystem, named by their sha256, rather
+than in Postgres - the Photo row holds only the hash, size and media type. A
+100-frame run then doesn't push hundreds of MB through psycopg2 into TOAST,
+database backups stay small, and querying photos doesn't pull their bytes.
+
+Files are sharded by the first two bytes of the hash,
+
+    PHOTO_STORE_DIRECTORY/ab/cd/abcd...
+
+so no directory gets too large. Identical photos are stored once. A file is
+written to a temporary name and renamed, so a reader never sees a partial file.
+
+Photos transferred before the store existed are still in Photo.photo - move
+them and remove files no longer referenced with
+
+    python -m src.photo_store move
+    python -m src.photo_store collect-garbage
+"""
+import argparse
+import hashlib
+import mmap
+import os
+import tempfile
+import time
+
+PHOTO_STORE_DIRECTORY = os.getenv("PHOTO_STORE_DIRECTORY", "/photo_store")
+# Files written (or put again) more recently than this aren't deleted, even if no row
+# refers to them - their rows may not be committed yet, e.g. those held by a PhotoIngest
+GARBAGE_COLLECTION_GRACE_PERIOD = 3600 # s
+
+
+def get_garbage_collection_cutoff() -> float:
+    """
+    Only files last modified before this time.time() may be deleted.
+    """
+    return time.time() - GARBAGE_COLLECTION_GRACE_PERIOD
+
+
+def guess_media_type(photo: bytes) -> str:
+    if photo[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if photo[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if photo[:4] in (b"II*\x00", b"MM\x00*"): # Includes DNG
+        return "image/tiff"
+    if photo[:6] == b"\x93NUMPY":
+        return "application/x-npy"
+    return "application/octet-stream"
+
+
+def fsync_path(path: str):
+    descriptor = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+class PhotoStore:
+
+    def __init__(self, directory: str, fsync=True):
+        self.directory = directory
+        self.fsync = fsync # As durable as a committed row
+
+    def path(self, photo_hash: str) -> str:
+        return os.path.join(self.directory, photo_hash[:2], photo_hash[2:4], photo_hash)
+
+    def put(self, photo: bytes, fsync: bool | None = None) -> tuple[str, int]:
+        """
+        Returns the photo's hash and size. With fsync=False the file isn't synced
+        (if self.fsync) until sync is called with its hash, e.g. once per batch.
+        """
+        fsync = self.fsync if fsync is None else fsync
+        photo_hash = hashlib.sha256(photo).hexdigest()
+        path = self.path(photo_hash)
+        if os.path.exists(path):
+            try:
+                os.utime(path) # Restarts its garbage collection grace period, as its row may not be committed yet
+                return photo_hash, len(photo)
+            except FileNotFoundError:
+                pass # Deleted since, so written again
+        shard_directory = os.path.dirname(path)
+        os.makedirs(shard_directory, exist_ok=True)
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=shard_directory, prefix=".tmp_")
+        try:
+            with os.fdopen(file_descriptor, "wb") as file:
+                file.write(photo)
+                if fsync:
+                    file.flush()
+                    os.fsync(file.fileno())
+            os.replace(temporary_path, path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        if fsync:
+            fsync_path(shard_directory) # So the rename survives a crash
+        return photo_hash, len(photo)
+
+    def sync(self, photo_hashes):
+        """
+        Syncs the files put with fsync=False, and their shard directories - each
+        directory once, however many of the photos are in it.
+        """
+        if not self.fsync:
+            return
+        shard_directories = set()
+        for photo_hash in set(photo_hashes):
+            fsync_path(self.path(photo_hash))
+            shard_directories.add(os.path.dirname(self.path(photo_hash)))
+        for shard_directory in shard_directories:
+            fsync_path(shard_directory)
+
+    def read(self, photo_hash: str) -> bytes:
+        with open(self.path(photo_hash), "rb") as file:
+            return file.read()
+
+    def read_view(self, photo_hash: str):
+        """
+        A read-only memory map of the photo, for decoding without copying it
+        (np.frombuffer accepts it). The file is unmapped when the map and any
+        arrays viewing it are garbage collected.
+        """
+        with open(self.path(photo_hash), "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def exists(self, photo_hash: str) -> bool:
+        return os.path.exists(self.path(photo_hash))
+
+    def delete(self, photo_hash: str, older_than: float | None = None) -> bool:
+        """
+        Only deletes the photo if it was last modified before older_than (a
+        time.time()) if given. Returns whether it was deleted.
+        """
+        path = self.path(photo_hash)
+        try:
+            if older_than is not None and os.path.getmtime(path) >= older_than:
+                return False
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def iterate_hashes(self, older_than: float | None = None):
+        """
+        Hashes of the stored photos - only those last modified before older_than
+        (a time.time()) if given.
+        """
+        for root, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.startswith(".tmp_"):
+                    continue
+                if older_than is not None and os.path.getmtime(os.path.join(root, filename)) >= older_than:
+                    continue
+                yield filename
+
+
+photo_store = PhotoStore(PHOTO_STORE_DIRECTORY)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Maintain the photo store")
+    parser.add_argument("command", choices=["move", "collect-garbage"],
+                        help="move: move photos held in the database into the store. " +
+                             "collect-garbage: delete stored photos no row references")
+    parser.add_argument("-b", "--batch_size", type=int, help="Photos moved per transaction", default=50)
+    return parser.parse_args()
+
+
+def main():
+    from src.database.CRUD import CRISP_database_interaction as cdi
+    args = parse_arguments()
+    if args.command == "move":
+        num_of_photos_moved = cdi.move_photos_to_photo_store(args.batch_size)
+        print(f"Moved {num_of_photos_moved} photos to {photo_store.directory}")
+        print("Run VACUUM FULL photo to give the space they used back to the filesystem")
+    else:
+        num_of_files_deleted = cdi.collect_photo_store_garbage(get_garbage_collection_cutoff())
+        print(f"Deleted {num_of_files_deleted} unreferenced photos from {photo_store.directory}")
+
+
+if __name__ == "__main__":
+    main()
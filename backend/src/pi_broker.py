@@ -0,0 +1,209 @@
+"""
+Runs the Pi connections in one process (the broker) shared by several API
+worker processes, so the API can run more than one worker - a long analysis
+in one worker then doesn't hold up capture control in another.
+
+Pi.registry, the SSH/SFTP sessions, the camera daemons, the preview streams and the
+health monitor all live in the broker. Functions that use them are decorated
+with @pi_broker_function, and in an API worker a call to one is sent to the
+broker over a Unix socket and run there. Arguments and results are pickled, a
+generator's items are sent as they are yielded, and exceptions are re-raised
+in the worker.
+
+Without PI_BROKER_SOCKET set the decorated functions run in-process, as with a
+single worker. To run with the broker:
+
+    export PI_BROKER_SOCKET=/tmp/crisp_pi_broker.sock
+    python -m src.pi_broker &
+    uvicorn api:app --host 0.0.0.0 --port 8000 --workers 4
+
+Only the broker's user can connect - the socket is mode 0600, and workers must
+know the authkey before anything is unpickled. The authkey is PI_BROKER_AUTHKEY
+if set, otherwise the broker generates one at start up into PI_BROKER_SOCKET.key
+(also mode 0600), which the workers read.
+"""
+import importlib
+import inspect
+import os
+import secrets
+import threading
+import traceback
+from functools import wraps
+from multiprocessing.connection import Client, Listener
+
+PI_BROKER_SOCKET = os.getenv("PI_BROKER_SOCKET")
+PI_BROKER_AUTHKEY = os.getenv("PI_BROKER_AUTHKEY")
+# Imported by the broker so their @pi_broker_function functions are registered
+PI_BROKER_MODULES = ("src.connection_functions", "src.camera_functions", "src.pi_health", "src.routers.photo")
+
+pi_broker_functions = {} # Name: function
+running_in_pi_broker = False
+local_connection = threading.local() # One broker connection per worker thread
+
+
+def using_pi_broker():
+    """
+    True in an API worker whose Pi calls go to the broker.
+    """
+    return PI_BROKER_SOCKET is not None and not running_in_pi_broker
+
+
+class PiBrokerError(Exception):
+    """
+    Raised in the worker when the broker's exception could not be pickled.
+    """
+
+
+def get_pi_broker_authkey_path(socket_path: str):
+    return f"{socket_path}.key"
+
+
+def write_pi_broker_authkey(socket_path: str) -> bytes:
+    """
+    A new key each time the broker starts, created 0600 rather than chmodded after.
+    """
+    authkey = secrets.token_hex(32).encode()
+    authkey_path = get_pi_broker_authkey_path(socket_path)
+    if os.path.lexists(authkey_path):
+        os.remove(authkey_path)
+    file_descriptor = os.open(authkey_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(file_descriptor, "wb") as authkey_file:
+        authkey_file.write(authkey)
+    return authkey
+
+
+def read_pi_broker_authkey(socket_path: str) -> bytes:
+    if PI_BROKER_AUTHKEY:
+        return PI_BROKER_AUTHKEY.encode()
+    with open(get_pi_broker_authkey_path(socket_path), "rb") as authkey_file:
+        return authkey_file.read()
+
+
+def connect_to_pi_broker():
+    return Client(PI_BROKER_SOCKET, family="AF_UNIX", authkey=read_pi_broker_authkey(PI_BROKER_SOCKET))
+
+
+def get_pi_broker_connection():
+    if getattr(local_connection, "connection", None) is None:
+        local_connection.connection = connect_to_pi_broker()
+    return local_connection.connection
+
+
+def receive_reply(connection):
+    status, value = connection.recv()
+    if status == "error":
+        raise value
+    return status, value
+
+
+def call_pi_broker(name: str, args: tuple, kwargs: dict):
+    connection = get_pi_broker_connection()
+    try:
+        connection.send((name, args, kwargs))
+        return receive_reply(connection)[1]
+    except (EOFError, OSError):
+        # Broker restarted - the next call reconnects
+        local_connection.connection = None
+        raise
+
+
+def iterate_pi_broker(name: str, args: tuple, kwargs: dict):
+    """
+    Generators get their own connection, so the thread can make other broker
+    calls between items (and a generator abandoned part way doesn't leave
+    items on the shared connection).
+    """
+    with connect_to_pi_broker() as connection:
+        connection.send((name, args, kwargs))
+        while (reply := receive_reply(connection))[0] == "item":
+            yield reply[1]
+
+
+def pi_broker_function(function):
+    name = f"{function.__module__}.{function.__qualname__}"
+    pi_broker_functions[name] = function
+
+    if inspect.isgeneratorfunction(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if using_pi_broker():
+                return iterate_pi_broker(name, args, kwargs)
+            return function(*args, **kwargs)
+    else:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if using_pi_broker():
+                return call_pi_broker(name, args, kwargs)
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def send_error(connection, error: Exception):
+    try:
+        connection.send(("error", error))
+    except Exception: # Unpicklable exception
+        connection.send(("error", PiBrokerError(f"{type(error).__name__}: {error}")))
+
+
+def handle_connection(connection):
+    with connection:
+        while True:
+            try:
+                name, args, kwargs = connection.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                result = pi_broker_functions[name](*args, **kwargs)
+                if inspect.isgenerator(result):
+                    try:
+                        for item in result:
+                            connection.send(("item", item))
+                    finally:
+                        result.close() # Worker went away mid-generator - stop e.g. the preview
+                    connection.send(("end", None))
+                else:
+                    connection.send(("result", result))
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            except Exception as e:
+                traceback.print_exc()
+                send_error(connection, e)
+
+
+def accept_connections(listener: Listener):
+    while True:
+        connection = listener.accept()
+        threading.Thread(target=handle_connection, args=(connection,), daemon=True, name="pi_broker_connection").start()
+
+
+def serve(socket_path: str):
+    global running_in_pi_broker
+    running_in_pi_broker = True
+    for module in PI_BROKER_MODULES:
+        importlib.import_module(module)
+    from src.network_functions import get_host_IP_address
+    from src.pi_health import pi_health_monitor
+    import asyncio
+    get_host_IP_address()
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path) # Left by a broker that didn't exit cleanly
+    authkey = PI_BROKER_AUTHKEY.encode() if PI_BROKER_AUTHKEY else write_pi_broker_authkey(socket_path)
+    previous_umask = os.umask(0o177) # So the socket is never connectable by other users, even before the chmod
+    try:
+        listener = Listener(socket_path, family="AF_UNIX", authkey=authkey)
+    finally:
+        os.umask(previous_umask)
+    os.chmod(socket_path, 0o600)
+    threading.Thread(target=accept_connections, args=(listener,), daemon=True, name="pi_broker_listener").start()
+    print(f"Pi broker listening on {socket_path}")
+    try:
+        asyncio.run(pi_health_monitor.run())
+    finally:
+        listener.close()
+
+
+if __name__ == "__main__":
+    if PI_BROKER_SOCKET is None:
+        raise SystemExit("Set PI_BROKER_SOCKET to the path of the broker's Unix socket")
+    serve(PI_BROKER_SOCKET)
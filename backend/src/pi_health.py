@@ -0,0 +1,159 @@
+"""
+Background health checks of the connected Pis. Every poll_interval seconds all
+Pis are probed at once (one SSH command each) and the results are cached, so
+status endpoints read the cache instead of SSHing in per request, and a beam
+run can refuse to start on a Pi that is unreachable, throttling or has lost
+its camera, rather than failing part way through.
+
+The poll loop is started in api.py's lifespan.
+"""
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+from src.classes.Pi import Pi
+from src.pi_broker import pi_broker_function
+from src.pi_orchestration import PiOperation, run_on_pis
+
+# One command so a poll costs one round trip per Pi. The camera daemon holds the
+# camera while running, so it is not listed then (and is evidently present). The
+# [c] stops pgrep matching this command itself.
+HEALTH_PROBE_COMMAND = """
+echo "disk_space=$(df -h / | grep '/' | awk '{print $3 " / " $2}' | head -n 1)"
+echo "cpu_temperature=$(cat /sys/class/thermal/thermal_zone0/temp 2>/dev/null)"
+echo "throttled=$(vcgencmd get_throttled 2>/dev/null | cut -d= -f2)"
+if pgrep -f '[c]amera_daemon.py' > /dev/null; then echo "cameras=daemon"
+else echo "cameras=$(libcamera-hello --list-cameras 2>/dev/null | grep -cE '^[0-9]+ :')"; fi
+"""
+
+# vcgencmd get_throttled bits - the low bits are current, the high bits "since boot"
+THROTTLED_FLAGS = {0: "under-voltage", 1: "arm frequency capped", 2: "throttled", 3: "soft temperature limit",
+                   16: "under-voltage has occurred", 17: "arm frequency capping has occurred",
+                   18: "throttling has occurred", 19: "soft temperature limit has occurred"}
+UNHEALTHY_THROTTLED_BITS = (0, 2) # Currently under-voltage or throttled
+MAXIMUM_CPU_TEMPERATURE = 80 # degrees C, the Pi throttles from 80-85
+
+
+@dataclass
+class PiHealth:
+    username: str
+    checked_at: float # time.time()
+    ssh_round_trip: float | None = None # s
+    disk_space: str | None = None # "used / total"
+    cpu_temperature: float | None = None # degrees C
+    throttled: list[str] = field(default_factory=list)
+    camera_present: bool | None = None
+    problems: list[str] = field(default_factory=list)
+
+    @property
+    def healthy(self):
+        return not self.problems
+
+    @property
+    def age(self):
+        return time.time() - self.checked_at
+
+
+def parse_throttled(throttled: str):
+    """
+    Returns (descriptions of the set flags, whether any make the Pi unhealthy).
+    """
+    value = int(throttled, 16)
+    flags = [description for bit, description in THROTTLED_FLAGS.items() if value & (1 << bit)]
+    return flags, any(value & (1 << bit) for bit in UNHEALTHY_THROTTLED_BITS)
+
+
+def probe_pi(pi: Pi) -> PiHealth:
+    health = PiHealth(username=pi.username, checked_at=time.time())
+    start_time = time.perf_counter()
+    _, stdout, _ = pi.ssh_client.exec_command("true", timeout=10)
+    stdout.channel.recv_exit_status()
+    health.ssh_round_trip = time.perf_counter() - start_time
+
+    _, stdout, _ = pi.ssh_client.exec_command(HEALTH_PROBE_COMMAND, timeout=10)
+    probe = dict(line.split("=", 1) for line in stdout.read().decode().splitlines() if "=" in line)
+    health.disk_space = probe.get("disk_space") or None
+    if probe.get("cpu_temperature"):
+        health.cpu_temperature = int(probe["cpu_temperature"]) / 1000
+        if health.cpu_temperature >= MAXIMUM_CPU_TEMPERATURE:
+            health.problems.append(f"CPU temperature is {health.cpu_temperature:.1f} C")
+    if probe.get("throttled"):
+        health.throttled, throttled_now = parse_throttled(probe["throttled"])
+        if throttled_now:
+            health.problems.append(f"Pi is {', '.join(health.throttled)}")
+    health.camera_present = probe.get("cameras") == "daemon" or int(probe.get("cameras") or 0) > 0
+    if not health.camera_present:
+        health.problems.append("No camera detected")
+    return health
+
+
+class PiHealthMonitor:
+
+    def __init__(self, poll_interval=30):
+        self.poll_interval = poll_interval
+        self.statuses: dict[str, PiHealth] = {}
+
+    def get(self, username: str) -> PiHealth | None:
+        return self.statuses.get(username)
+
+    def get_all(self) -> list[PiHealth]:
+        return list(self.statuses.values())
+
+    def is_reachable(self, username: str):
+        """
+        True until a poll has failed to reach the Pi.
+        """
+        health = self.get(username)
+        return health is None or health.ssh_round_trip is not None
+
+    async def poll(self, pis: list[Pi]):
+        operations = {pi.username: PiOperation(pi.username, probe_pi, (pi,)) for pi in pis}
+        async for pi_result in run_on_pis(operations, verbose=False):
+            if pi_result.succeeded:
+                self.statuses[pi_result.key] = pi_result.result
+            else:
+                self.statuses[pi_result.key] = PiHealth(username=pi_result.key, checked_at=time.time(),
+                                                        problems=[f"SSH probe failed: {pi_result.error}"])
+        for username in set(self.statuses) - {pi.username for pi in Pi.registry.all()}: # Deleted Pis
+            self.statuses.pop(username, None)
+
+    async def run(self):
+        while True:
+            try:
+                await self.poll(Pi.pis_connected_by_ssh())
+            except Exception as e:
+                print(f"Error polling Pi health: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    def check_before_run(self, usernames: list[str], max_age=10) -> list[str]:
+        """
+        Re-probes any of the Pis not checked in the last max_age seconds, then
+        returns a description of each problem (empty if all are ready).
+        Blocking, so call it from a thread rather than the event loop.
+        """
+        problems = []
+        pis_to_probe = []
+        for username in usernames:
+            if (pi := Pi.get_pi_with_username(username)) is None or not pi.ssh_status:
+                problems.append(f"{username}: not connected")
+            elif (health := self.get(username)) is None or health.age > max_age:
+                pis_to_probe.append(pi)
+        if pis_to_probe:
+            asyncio.run(self.poll(pis_to_probe))
+        for username in usernames:
+            if (health := self.get(username)) is not None:
+                problems += [f"{username}: {problem}" for problem in health.problems]
+        return problems
+
+
+pi_health_monitor = PiHealthMonitor()
+
+
+# The monitor runs wherever the Pis are connected - these reach it from any API worker
+@pi_broker_function
+def get_pi_health(username: str) -> PiHealth | None:
+    return pi_health_monitor.get(username)
+
+@pi_broker_function
+def check_pis_before_run(usernames: list[str], max_age=10) -> list[str]:
+    return pi_health_monitor.check_before_run(usernames, max_age)
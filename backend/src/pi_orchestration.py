@@ -0,0 +1,187 @@
+"""
+Runs blocking Pi operations (paramiko calls, database writes) on several Pis at
+once from asyncio, so an async endpoint can await a multi-Pi capture without
+blocking the event loop, and handle each Pi's result as soon as that Pi finishes
+rather than after the slowest one.
+
+The operations run on one thread pool shared by every request, instead of a new
+ThreadPoolExecutor per call. Anything an operation prints is kept with its Pi's
+result (and echoed prefixed with the Pi's label) rather than interleaved with
+the other Pis' output.
+
+An operation can be given a deadline, after which its cancel function is
+called (to kill the process on the Pi, so the thread waiting on it returns) and
+it is reported as timed out, without holding up the other Pis' results.
+
+Sync code (e.g. a def endpoint, which runs in a worker thread) uses
+run_on_pis_blocking.
+"""
+import asyncio
+import contextlib
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Hashable
+
+PI_EXECUTOR = ThreadPoolExecutor(max_workers=32, thread_name_prefix="pi_operation")
+CANCEL_TIMEOUT = 10 # s allowed for cancelling an operation, and then for it to return
+
+
+@dataclass
+class PiOperation:
+    label: str # Shown with the operation's output, usually the Pi's username
+    function: Callable
+    args: tuple = ()
+    deadline: float | None = None # s, None to wait as long as it takes
+    cancel: Callable | None = None # Stops the operation on the Pi once the deadline has passed
+
+
+@dataclass
+class PiResult:
+    key: Hashable
+    label: str
+    result: Any = None
+    error: Exception | None = None
+    output: list[str] = field(default_factory=list)
+    latency: float = 0.0 # s
+    timed_out: bool = False
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+    @property
+    def status(self):
+        if self.timed_out:
+            return "timed out"
+        return "succeeded" if self.succeeded else "failed"
+
+
+class PiOutput:
+    """
+    Replaces sys.stdout. Lines printed by a thread running a Pi operation are
+    added to that operation's output and echoed with its label - other threads
+    print as normal.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def start_capture(self, label: str, lines: list[str]):
+        self.local.label = label
+        self.local.lines = lines
+        self.local.partial_line = ""
+
+    def stop_capture(self):
+        if getattr(self.local, "partial_line", ""):
+            self.write("\n")
+        self.local.lines = None
+
+    def write(self, text: str):
+        if getattr(self.local, "lines", None) is None:
+            return self.stream.write(text)
+        *complete_lines, self.local.partial_line = (self.local.partial_line + text).split("\n")
+        for line in complete_lines:
+            self.local.lines.append(line)
+            self.stream.write(f"[{self.local.label}] {line}\n")
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def get_pi_output():
+    if not isinstance(sys.stdout, PiOutput):
+        sys.stdout = PiOutput(sys.stdout)
+    return sys.stdout
+
+
+def run_pi_operation(key: Hashable, operation: PiOperation, verbose=True):
+    pi_result = PiResult(key=key, label=operation.label)
+    pi_output = get_pi_output()
+    pi_output.start_capture(operation.label, pi_result.output)
+    start_time = time.perf_counter()
+    try:
+        pi_result.result = operation.function(*operation.args)
+    except Exception as e:
+        pi_result.error = e
+        if verbose:
+            print(f"Error: {e}")
+    finally:
+        pi_result.latency = time.perf_counter() - start_time
+        pi_output.stop_capture()
+    return pi_result
+
+
+async def cancel_pi_operation(key: Hashable, operation: PiOperation, future: asyncio.Future, verbose=True):
+    """
+    Returns the PiResult of an operation that missed its deadline. The thread
+    running it can't be stopped from here, so it is given CANCEL_TIMEOUT to
+    return once operation.cancel has stopped the work on the Pi.
+    """
+    pi_result = PiResult(key=key, label=operation.label, latency=operation.deadline, timed_out=True,
+                         error=TimeoutError(f"{operation.label} did not finish within {operation.deadline} s"))
+    loop = asyncio.get_running_loop()
+    if operation.cancel is not None:
+        try:
+            await asyncio.wait_for(loop.run_in_executor(PI_EXECUTOR, operation.cancel), CANCEL_TIMEOUT)
+        except Exception as e:
+            pi_result.error = TimeoutError(f"{pi_result.error}, and cancelling it failed: {e!r}")
+    try:
+        finished_result = await asyncio.wait_for(asyncio.shield(future), CANCEL_TIMEOUT)
+    except asyncio.TimeoutError:
+        if verbose:
+            print(f"{operation.label} is still running after being cancelled")
+        return pi_result
+    if finished_result.succeeded: # Finished as the deadline passed
+        return finished_result
+    pi_result.output = finished_result.output
+    return pi_result
+
+
+async def run_pi_operation_with_deadline(key: Hashable, operation: PiOperation, semaphore: asyncio.Semaphore | None, verbose=True):
+    async with semaphore or contextlib.nullcontext():
+        future = asyncio.get_running_loop().run_in_executor(PI_EXECUTOR, run_pi_operation, key, operation, verbose)
+        try:
+            # Shielded so the timeout doesn't discard the executor future, which cancel_pi_operation waits on
+            return await asyncio.wait_for(asyncio.shield(future), operation.deadline)
+        except asyncio.TimeoutError:
+            return await cancel_pi_operation(key, operation, future, verbose)
+
+
+async def run_on_pis(operations: dict[Hashable, PiOperation], verbose=True, max_concurrent: int | None = None) -> AsyncIterator[PiResult]:
+    """
+    Starts the operations (no more than max_concurrent at once, if given) and
+    yields each result as it completes. Errors and missed deadlines are returned
+    in the PiResult rather than raised, so one Pi failing doesn't lose the others'
+    results. verbose=False doesn't print the latencies and errors, for periodic
+    operations like health checks.
+    """
+    semaphore = asyncio.Semaphore(max_concurrent) if max_concurrent else None
+    tasks = [asyncio.ensure_future(run_pi_operation_with_deadline(key, operation, semaphore, verbose))
+             for key, operation in operations.items()]
+    for next_result in asyncio.as_completed(tasks):
+        pi_result = await next_result
+        if verbose:
+            print(f"{pi_result.label} {'finished' if pi_result.succeeded else pi_result.status} in {pi_result.latency:.2f} s")
+        yield pi_result
+
+
+async def gather_from_pis(operations: dict[Hashable, PiOperation], max_concurrent: int | None = None) -> dict[Hashable, PiResult]:
+    start_time = time.perf_counter()
+    results = {pi_result.key: pi_result async for pi_result in run_on_pis(operations, max_concurrent=max_concurrent)}
+    print(f"{len(operations)} Pi operations finished in {time.perf_counter() - start_time:.2f} s")
+    return results
+
+
+def run_on_pis_blocking(operations: dict[Hashable, PiOperation], max_concurrent: int | None = None) -> dict[Hashable, PiResult]:
+    """
+    For sync callers - must not be called from a thread running an event loop.
+    """
+    return asyncio.run(gather_from_pis(operations, max_concurrent))
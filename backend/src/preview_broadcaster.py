@@ -0,0 +1,120 @@
+"""
+Live preview of each camera, shared by every viewer. One thread per camera
+decodes the Pi's UDP stream, and each frame is downscaled and JPEG encoded once
+per requested width, however many viewers are watching at that width.
+
+A viewer is always sent the newest frame - frames that arrive while it is still
+receiving the previous one are dropped rather than queued, so a slow client sees
+a lower frame rate instead of a growing delay.
+"""
+import threading
+from typing import Iterator
+import cv2
+
+
+class PreviewBroadcaster:
+
+    def __init__(self, camera, jpeg_quality=80, frame_timeout=10):
+        self.camera = camera
+        self.jpeg_quality = jpeg_quality
+        self.frame_timeout = frame_timeout # s without a frame before viewers are disconnected
+        self.condition = threading.Condition()
+        self.frame = None
+        self.frame_number = 0
+        self.encoded_frames = {} # Width: (frame number, JPEG bytes)
+        self.encode_locks = {} # Width: lock, so concurrent viewers wait for one encode
+        self.num_of_viewers = 0
+        self.decoder_thread = None
+        self.stop_decoding = threading.Event()
+
+    @property
+    def running(self):
+        return self.decoder_thread is not None and self.decoder_thread.is_alive() and not self.stop_decoding.is_set()
+
+    def start(self):
+        """
+        Called with the condition held, so concurrent viewers wait for one start.
+        """
+        if self.decoder_thread is not None:
+            self.decoder_thread.join(timeout=5) # Still releasing the last stream
+        # Starting the stream stops the camera daemon, so is refused (PiBusyError) while a
+        # run or still holds the Pi, rather than waiting for it with the condition held
+        with self.camera.command_queue.turn(wait=False):
+            if not self.camera.stream_to_local_device():
+                raise Exception(f"Unable to start the stream on {self.camera.username}")
+        capture = self.camera.start_stream_capture()
+        self.stop_decoding = threading.Event()
+        self.decoder_thread = threading.Thread(target=self.decode, args=(capture, self.stop_decoding),
+                                               daemon=True, name=f"preview_{self.camera.username}")
+        self.decoder_thread.start()
+
+    def decode(self, capture, stop_decoding: threading.Event):
+        try:
+            while not stop_decoding.is_set():
+                ret, frame = capture.read()
+                if not ret:
+                    break
+                with self.condition:
+                    self.frame = frame
+                    self.frame_number += 1
+                    self.condition.notify_all()
+        finally:
+            capture.release()
+            with self.condition:
+                self.condition.notify_all()
+
+    def encode(self, frame_number: int, frame, width: int | None):
+        with self.condition:
+            encode_lock = self.encode_locks.setdefault(width, threading.Lock())
+        with encode_lock:
+            encoded_frame_number, jpeg = self.encoded_frames.get(width, (None, None))
+            if encoded_frame_number == frame_number:
+                return jpeg
+            if width is not None and width < frame.shape[1]:
+                height = round(frame.shape[0] * width / frame.shape[1])
+                frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+            ret, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+            if not ret:
+                raise Exception("Error encoding frame")
+            self.encoded_frames[width] = (frame_number, jpeg.tobytes())
+            return self.encoded_frames[width][1]
+
+    def subscribe(self, width: int | None = None) -> Iterator[bytes]:
+        """
+        Yields JPEGs of the newest frame, no wider than width (full size if None),
+        until the stream stops. The stream stops when its last viewer leaves.
+        """
+        with self.condition:
+            self.num_of_viewers += 1
+        try:
+            with self.condition:
+                if not self.running:
+                    self.start()
+                last_frame_number = self.frame_number
+            while True:
+                with self.condition:
+                    self.condition.wait_for(lambda: self.frame_number > last_frame_number or not self.running,
+                                            timeout=self.frame_timeout)
+                    if self.frame_number == last_frame_number: # Stream stopped or stalled
+                        return
+                    frame, last_frame_number = self.frame, self.frame_number
+                yield self.encode(last_frame_number, frame, width)
+        finally:
+            with self.condition:
+                self.num_of_viewers -= 1
+                if self.num_of_viewers == 0:
+                    self.stop_decoding.set()
+                    self.encoded_frames.clear()
+
+
+preview_broadcasters: dict[str, PreviewBroadcaster] = {}
+preview_broadcasters_lock = threading.Lock()
+
+def get_preview_broadcaster(username: str, camera) -> PreviewBroadcaster:
+    """
+    A Pi reconnecting gets a new Camera, and so a new broadcaster.
+    """
+    with preview_broadcasters_lock:
+        if (preview_broadcaster := preview_broadcasters.get(username)) is None or preview_broadcaster.camera is not camera:
+            preview_broadcaster = preview_broadcasters[username] = PreviewBroadcaster(camera)
+        return preview_broadcaster
@@ -1,3 +1,4 @@
+import json
 from datetime import datetime
 from fastapi import HTTPException, Response, APIRouter
 from fastapi.responses import JSONResponse
@@ -6,6 +7,9 @@ import pytz
 from sqlmodel import Session, select
 from src.fitting_functions import plot_physical_units_ODR_bortfeld
 from src.single_camera_analysis import get_beam_center_coords
+from src.frame_stack_store import delete_frame_stack
+from src.frame_timing import load_frame_metadata, summarise_frame_timing
+from src.clock_alignment import find_synchronised_frame_sets, sensor_timestamps_to_backend_time
 from src.scintillation_light_pinpointing import build_weighted_directional_vector_of_beam_center, compute_weighted_bragg_peak_depth, convert_beam_center_coords_to_penetration_depths, pinpoint_bragg_peak
 from src.database.models import BeamRun, CameraAnalysis, CameraAnalysisPlot, CameraSettingsLink, CameraSetupLink, Experiment, Photo, Settings, Setup
 from src.database.database import engine
@@ -143,9 +147,12 @@ def add_test_settings(beam_run_id: int, camera_id: int, test_settings_body: rb.C
                                      .where(CameraSettingsLink.camera_id == camera_id))
         all_camera_settings = session.exec(camera_settings_statement).all()
         if len(all_camera_settings) > 0:
+            camera_settings_ids = [camera_settings.id for camera_settings in all_camera_settings]
             for camera_settings in all_camera_settings:
                 session.delete(camera_settings)
             session.commit()
+            for camera_settings_id in camera_settings_ids:
+                delete_frame_stack(camera_settings_id)
 
 
     for gain in gain_range:
@@ -170,9 +177,12 @@ def add_real_settings(beam_run_id: int, camera_id: int, real_settings_body: rb.C
                                      .where(CameraSettingsLink.camera_id == camera_id))
         all_camera_settings = session.exec(camera_settings_statement).all()
         if len(all_camera_settings) > 0:
+            camera_settings_ids = [camera_settings.id for camera_settings in all_camera_settings]
             for camera_settings in all_camera_settings:
                 session.delete(camera_settings)
             session.commit()
+            for camera_settings_id in camera_settings_ids:
+                delete_frame_stack(camera_settings_id)
 
         settings_id = cdi.add_settings(real_settings_body.frame_rate, preset_lens_position, real_settings_body.gain)["id"]
         camera_settings_id = cdi.add_camera_settings_link_with_beam_run(camera_id,
@@ -238,9 +248,12 @@ def update_test_settings(beam_run_id: int, camera_id: int, test_settings_body: r
                                      .where(CameraSettingsLink.camera_id == camera_id))
         all_camera_settings = session.exec(camera_settings_statement).all()
         if len(all_camera_settings) > 0:
+            camera_settings_ids = [camera_settings.id for camera_settings in all_camera_settings]
             for camera_settings in all_camera_settings:
                 session.delete(camera_settings)
             session.commit()
+            for camera_settings_id in camera_settings_ids:
+                delete_frame_stack(camera_settings_id)
 
     for gain in gain_range:
         settings_id = cdi.add_settings(test_settings_body.frame_rate, preset_lens_position, float(gain))["id"]
@@ -265,9 +278,12 @@ def update_real_settings(beam_run_id: int, camera_id: int, real_settings_body: r
                                      .where(CameraSettingsLink.camera_id == camera_id))
         all_camera_settings = session.exec(camera_settings_statement).all()
         if len(all_camera_settings) > 0:
+            camera_settings_ids = [camera_settings.id for camera_settings in all_camera_settings]
             for camera_settings in all_camera_settings:
                 session.delete(camera_settings)
             session.commit()
+            for camera_settings_id in camera_settings_ids:
+                delete_frame_stack(camera_settings_id)
 
         settings_id = cdi.add_settings(real_settings_body.frame_rate, preset_lens_position, real_settings_body.gain)["id"]
         camera_settings_id = cdi.add_camera_settings_link_with_beam_run(camera_id,
@@ -296,7 +312,8 @@ def get_real_settings_(beam_run_id: int, camera_id: int) -> rb.GetNumberOfImages
         camera_settings = session.exec(camera_settings_statement).one()
         return rb.GetNumberOfImagesAndRaw(id=camera_id,
                                           number_of_images=camera_settings.number_of_images,
-                                          take_raw_images=camera_settings.take_raw_images)
+                                          take_raw_images=camera_settings.take_raw_images,
+                                          reduced_colour_channel=camera_settings.reduced_colour_channel)
 
 @router.put("/real/{beam_run_id}/number-of-images/camera/{camera_id}")
 def update_number_of_images_and_take_raw(beam_run_id: int, camera_id: int, real_settings_body: rb.UpdateNumberOfImagesAndRaw):
@@ -307,6 +324,7 @@ def update_number_of_images_and_take_raw(beam_run_id: int, camera_id: int, real_
         camera_settings = session.exec(camera_settings_statement).one()
         camera_settings.number_of_images = real_settings_body.number_of_images
         camera_settings.take_raw_images = real_settings_body.take_raw_images
+        camera_settings.reduced_colour_channel = real_settings_body.reduced_colour_channel
         session.commit()
     return rb.UpdateNumberOfImagesAndRawResponse(id=camera_id)
 
@@ -388,10 +406,75 @@ def get_is_data_taken(beam_run_id: int) -> rb.GetTestBeamRunDataTaken:
         test_photos = session.exec(test_photos_statement).all()
         if len(test_photos) > 0:
             return rb.GetTestBeamRunDataTaken(id=beam_run_id, data_taken=True)
+        # Main runs reduced on the Pi store their statistics instead of photos
+        reduced_camera_settings_statement = (select(CameraSettingsLink)
+                                             .where(CameraSettingsLink.beam_run_id == beam_run_id)
+                                             .where(CameraSettingsLink.reduced_frame_statistics.isnot(None)))
+        if session.exec(reduced_camera_settings_statement).first() is not None:
+            return rb.GetTestBeamRunDataTaken(id=beam_run_id, data_taken=True)
         return rb.GetTestBeamRunDataTaken(id=beam_run_id, data_taken=False)
 
 
 
+@router.get("/frame-timing/{beam_run_id}")
+def get_frame_timing(beam_run_id: int, response: Response) -> list[rb.GetFrameTimingResponse]:
+    """
+    Achieved frame rate, jitter and the slowest capture stage for each camera in
+    the run, from the metadata stored with each photo.
+    """
+    with Session(engine) as session:
+        camera_settings_statement = (select(CameraSettingsLink, Settings)
+                                     .join(Settings, CameraSettingsLink.settings_id == Settings.id)
+                                     .where(CameraSettingsLink.beam_run_id == beam_run_id))
+        all_camera_settings = session.exec(camera_settings_statement).all()
+    
+    frame_timings = []
+    for camera_settings, settings in all_camera_settings:
+        frame_metadata = load_frame_metadata(cdi.get_photo_metadata_by_camera_settings_link_id(camera_settings.id))
+        if not frame_metadata:
+            continue
+        frame_timing = summarise_frame_timing(frame_metadata, settings.frame_rate)
+        frame_timings.append(rb.GetFrameTimingResponse(id=camera_settings.id,
+                                                       camera_id=camera_settings.camera_id,
+                                                       **frame_timing))
+    response.headers["Content-Range"] = str(len(frame_timings))
+    return frame_timings
+
+
+@router.get("/clock-offsets/{beam_run_id}")
+def get_clock_offsets(beam_run_id: int, response: Response) -> list[rb.GetClockOffsetResponse]:
+    clock_offsets = [rb.GetClockOffsetResponse(id=clock_offset["camera_settings_link_id"], camera_id=camera_id,
+                                               sensor_clock_offset=clock_offset["sensor_clock_offset"],
+                                               wall_clock_offset=clock_offset["wall_clock_offset"],
+                                               clock_offset_uncertainty=clock_offset["clock_offset_uncertainty"])
+                     for camera_id, clock_offset in cdi.get_clock_offsets_by_beam_run_id(beam_run_id).items()]
+    response.headers["Content-Range"] = str(len(clock_offsets))
+    return clock_offsets
+
+
+@router.get("/synchronised-frames/{beam_run_id}")
+def get_synchronised_frames(beam_run_id: int, response: Response, tolerance: float = 1.0) -> list[rb.GetSynchronisedFrameSetResponse]:
+    """
+    Sets of photos, one per camera, taken within tolerance ms of each other, using
+    the clock offsets measured before the run. Cameras without a measured offset are left out.
+    """
+    frame_times = {}
+    for camera_id, clock_offset in cdi.get_clock_offsets_by_beam_run_id(beam_run_id).items():
+        photo_ids, sensor_timestamps = [], []
+        for photo_id, photo_metadata in cdi.get_photo_ids_and_metadata_by_camera_settings_link_id(clock_offset["camera_settings_link_id"]):
+            if (sensor_timestamp := json.loads(photo_metadata).get("SensorTimestamp")) is not None:
+                photo_ids.append(photo_id)
+                sensor_timestamps.append(sensor_timestamp)
+        order = np.argsort(sensor_timestamps)
+        frame_times[camera_id] = ([photo_ids[i] for i in order],
+                                  sensor_timestamps_to_backend_time(sensor_timestamps, clock_offset["sensor_clock_offset"])[order])
+
+    frame_sets = [rb.GetSynchronisedFrameSetResponse(id=count, backend_time=backend_time, photo_ids=photo_ids)
+                  for count, (backend_time, photo_ids) in enumerate(find_synchronised_frame_sets(frame_times, int(tolerance * 10**6)))]
+    response.headers["Content-Range"] = str(len(frame_sets))
+    return frame_sets
+
+
 # @router.get("/test/data-taken/{beam_run_id}")
 # def get_is_data_taken(beam_run_id: int) -> rb.GetTestBeamRunDataTaken:
 #     with Session(engine) as session:
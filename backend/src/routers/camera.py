@@ -15,6 +15,7 @@ from src.classes.JSON_request_bodies import request_bodies as rb
 from src.database.models import BeamRun, Camera, CameraAnalysis, CameraSettingsLink, CameraSetupLink, Experiment, OpticalAxisEnum, Setup
 
 from src.database.CRUD import CRISP_database_interaction as cdi
+from src.pi_health import get_pi_health
 
 router = APIRouter(
     prefix="/camera",
@@ -35,13 +36,20 @@ def get_pi_statuses(response: Response):
     pi_status_response = []
     for pi_status in pi_status_array:
         camera_id = cdi.get_camera_id_from_username(pi_status.username)
-        pi_status_response += [
-                                rb.CameraStatusResponse(id=camera_id,
-                                                        username=pi_status.username,
-                                                        IPAddress=pi_status.IPAddress,
-                                                        connectionStatus=pi_status.connectionStatus,
-                                                        cameraModel=pi_status.cameraModel)
-                              ]
+        camera_status = rb.CameraStatusResponse(id=camera_id,
+                                                username=pi_status.username,
+                                                IPAddress=pi_status.IPAddress,
+                                                connectionStatus=pi_status.connectionStatus,
+                                                cameraModel=pi_status.cameraModel)
+        if pi_status.connectionStatus and (pi_health := get_pi_health(pi_status.username)) is not None:
+            camera_status.healthy = pi_health.healthy
+            camera_status.healthProblems = pi_health.problems
+            camera_status.healthCheckedAt = pi_health.checked_at
+            camera_status.diskSpace = pi_health.disk_space
+            camera_status.cpuTemperature = pi_health.cpu_temperature
+            camera_status.throttled = pi_health.throttled
+            camera_status.sshRoundTrip = pi_health.ssh_round_trip
+        pi_status_response += [camera_status]
 
     response.headers["Content-Range"] = str(len(pi_status_response))
     return pi_status_response
@@ -1,6 +1,5 @@
 from datetime import datetime
 from io import BytesIO
-import pickle
 from fastapi import HTTPException, Response, APIRouter
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
@@ -80,38 +79,37 @@ def get_camera_analysis(beam_run_id: int, camera_id: int):
                                     )
 
         # if camera_analysis.average_image is not None:
-        unpickled_image = pickle.loads(camera_analysis.average_image)
-        unpickled_image = unpickled_image.astype(np.uint8)
+        rounded_average_image = camera_analysis.average_image.astype(np.uint8)
 
         colour_channel = camera_analysis.colour_channel
         print(f"\n\n\n COLOUR CHSANNNERL: {colour_channel}")
-        print(f"unpickeled image {unpickled_image.shape}")
-        skeleton_image = np.zeros((unpickled_image.shape[0], unpickled_image.shape[1], 3), dtype=np.uint8)
+        print(f"rounded average image {rounded_average_image.shape}")
+        skeleton_image = np.zeros((rounded_average_image.shape[0], rounded_average_image.shape[1], 3), dtype=np.uint8)
         print("\n\n\n\n\n\n\n I GOT HERE \n\n\n\n")
         if colour_channel == ColourChannelEnum.RED:
             skeleton_image[:,:,0] = 0 #blue channel
             skeleton_image[:,:,1] = 0 #green channel
-            skeleton_image[:,:,2] = unpickled_image #red channel
+            skeleton_image[:,:,2] = rounded_average_image #red channel
             print("I AT LEAST GOT HERE")
         elif colour_channel == ColourChannelEnum.GREEN:
             print("IN GREEEN \n\n")
             
             skeleton_image[:,:,0] = 0 #blue channel
-            skeleton_image[:,:,1] = unpickled_image #green channel
+            skeleton_image[:,:,1] = rounded_average_image #green channel
             skeleton_image[:,:,2] = 0 #red channel
 
         elif colour_channel == ColourChannelEnum.BLUE:
             print("INBLUER \n\n")
 
-            skeleton_image[:,:,0] = unpickled_image #blue channel
+            skeleton_image[:,:,0] = rounded_average_image #blue channel
             skeleton_image[:,:,1] = 0 #green channel
             skeleton_image[:,:,2] = 0 #red channel
 
         else:
             print("I ENDED UP HERE???? \n\n")
-            skeleton_image = cv2.cvtColor(unpickled_image, cv2.COLOR_GRAY2BGR)
+            skeleton_image = cv2.cvtColor(rounded_average_image, cv2.COLOR_GRAY2BGR)
 
-        # pil_image = Image.fromarray(unpickled_image)
+        # pil_image = Image.fromarray(rounded_average_image)
         success, encoded_image = cv2.imencode('.jpg', skeleton_image)
 
         if success:
@@ -489,9 +489,6 @@ def populate_hq_distortion_params_api():
     with open("/code/src/calibration_testing_19_11_24/top_hq_distortion_data/top_hq_camera_calibration.pkl", "rb") as data:
         camera_matrix, distortion_coefficients = pickle.load(data)
     
-    camera_matrix = pickle.dumps(camera_matrix)
-    distortion_coefficients = pickle.dumps(distortion_coefficients)
-    
     setup_camera_id = cdi.get_setup_camera_id(top_hq_cam_id, setup_id)
     cdi.update_distortion_calibration_pattern_size_z_dim(setup_camera_id, 1) # mock input
     cdi.update_distortion_calibration_pattern_size_non_z_dim(setup_camera_id, 1) # mock input
@@ -131,11 +131,8 @@ def add_homography_calibration_settings(plane: str, setup_camera_id: int, payloa
             raise HTTPException(status_code=400, detail=f"Invalid plane: {plane}. Must be 'near' or 'far'.")
         
         if old_camera_settings_id is not None:
+            cdi.delete_photos_by_camera_settings_link_id(old_camera_settings_id)
             camera_settings = session.get(CameraSettingsLink, old_camera_settings_id)
-            photos_statement = select(Photo).where(Photo.camera_settings_link_id == old_camera_settings_id)
-            photos = session.exec(photos_statement).all()
-            for photo in photos:
-                session.delete(photo)
             session.delete(camera_settings)
             session.commit()
         
@@ -195,11 +192,8 @@ def update_homography_calibration_settings(plane: str, setup_camera_id: int, pay
             raise HTTPException(status_code=400, detail=f"Invalid plane: {plane}. Must be 'near' or 'far'.")
         
         if old_camera_settings_id is not None:
+            cdi.delete_photos_by_camera_settings_link_id(old_camera_settings_id)
             camera_settings = session.get(CameraSettingsLink, old_camera_settings_id)
-            photos_statement = select(Photo).where(Photo.camera_settings_link_id == old_camera_settings_id)
-            photos = session.exec(photos_statement).all()
-            for photo in photos:
-                session.delete(photo)
             session.delete(camera_settings)
             session.commit()
         
@@ -269,7 +263,7 @@ def save_homography_parameters(plane: str, setup_camera_id: int, horizontal_flip
             raise HTTPException(status_code=503, detail="Multiple photos found, reset this calibration!")
         photo = photos[0]
         try:
-            status = perform_homography_calibration(username, setup_id, plane, image_point_transforms=transforms, photo_bytes=photo.photo)
+            status = perform_homography_calibration(username, setup_id, plane, image_point_transforms=transforms, photo_bytes=cdi.get_photo_bytes(photo))
         except Exception as e:
             print(f"Error performing homography calibration: {e}")
             status = False
@@ -290,10 +284,7 @@ def reset_homography(plane: str, setup_camera_id: int):
             setup_camera.far_face_calibration_photo_camera_settings_id = None
 
         ### Delete corresponding photos ###
-        photos_statement = select(Photo).where(Photo.camera_settings_link_id == camera_settings_id)
-        photos = session.exec(photos_statement).all()
-        for photo in photos:
-            session.delete(photo)
+        cdi.delete_photos_by_camera_settings_link_id(camera_settings_id)
         session.commit()
 
         ### Delete corresponding camera settings link ###
@@ -1,11 +1,14 @@
+import asyncio
+import dataclasses
 from datetime import datetime
 from fastapi import HTTPException, Response, APIRouter
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse
 from pydantic import BaseModel
 import pytz
 from sqlmodel import Session, select
 from src.create_homographies import ImagePointTransforms, test_grid_recognition_for_gui
 from src.gain_automation import ColourChannel, set_optimal_settings, show_saturated_points
+from src.sensor_crop import record_scintillator_edges_frame_size, restore_full_frame_if_cropped
 from src.database.database import engine
 
 
@@ -19,6 +22,9 @@ from src.classes.JSON_request_bodies import request_bodies as rb
 from src.database.models import BeamRun, Camera, CameraSettingsLink, CameraSetupLink, Experiment, Photo, Settings
 from src.classes import Camera as PiCamera #TODO This may be a bit awkward
 from src.database.CRUD import CRISP_database_interaction as cdi
+from src.pi_broker import pi_broker_function
+from src.pi_health import check_pis_before_run
+from src.photo_store import guess_media_type
 
 router = APIRouter(
     prefix="/photo",
@@ -30,6 +36,21 @@ def delete_photo_by_id_api(photo_id: int):
     cdi.delete_photo_by_id(photo_id)
     return rb.PhotoDeleteResponse(id=photo_id)
 
+@router.get("/file/{photo_id}")
+def get_photo_file(photo_id: int):
+    """
+    The photo as taken, not base64 encoded. Photos in the photo store are sent
+    from their file rather than read into memory first.
+    """
+    try:
+        path, media_type = cdi.get_photo_path_and_media_type(photo_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if path is not None:
+        return FileResponse(path, media_type=media_type)
+    photo_bytes = cdi.get_photo_from_id(photo_id)
+    return Response(content=photo_bytes, media_type=guess_media_type(photo_bytes))
+
 # @router.post("scintillator-edges/{setup_camera_id}")
 # def take_picture(setup_camera_id: str):
 #     with Session(engine) as session:
@@ -46,6 +67,7 @@ def delete_photo_by_id_api(photo_id: int):
     
 
 
+@pi_broker_function
 def take_scintillator_edge_image(username: str, camera_settings_id:int, imageSettings: ImageSettings, context: PhotoContext):
     
     try:
@@ -53,14 +75,16 @@ def take_scintillator_edge_image(username: str, camera_settings_id:int, imageSet
         # Pi with this username will have been deleted after SSH check if it disconnected.
         if (pi := Pi.get_pi_with_username(username)) is None:
             raise Exception(f"No pi instantiated with the username {username}")
-        full_file_path = pi.camera.capture_image_without_making_settings(camera_settings_id, imageSettings, context)
-        added_photo_id = pi.camera.transfer_image_overwrite(imageSettings, camera_settings_id, full_file_path)
+        with pi.command_queue.turn():
+            full_file_path = pi.camera.capture_image_without_making_settings(camera_settings_id, imageSettings, context)
+            added_photo_id = pi.camera.transfer_image_overwrite(imageSettings, camera_settings_id, full_file_path)
         return added_photo_id
     
     except Exception as e:
         raise Exception(f"Error trying to take a picture: {e}")
     
 
+@pi_broker_function
 def take_distortion_calibration_image(username: str, camera_settings_id:int, imageSettings: ImageSettings, context: PhotoContext):
     
     try:
@@ -68,8 +92,9 @@ def take_distortion_calibration_image(username: str, camera_settings_id:int, ima
         # Pi with this username will have been deleted after SSH check if it disconnected.
         if (pi := Pi.get_pi_with_username(username)) is None:
             raise Exception(f"No pi instantiated with the username {username}")
-        full_file_path = pi.camera.capture_image_without_making_settings(camera_settings_id, imageSettings, context)
-        photo_bytes = pi.camera.transfer_image_without_writing_to_database(imageSettings, camera_settings_id, full_file_path)
+        with pi.command_queue.turn():
+            full_file_path = pi.camera.capture_image_without_making_settings(camera_settings_id, imageSettings, context)
+            photo_bytes = pi.camera.transfer_image_without_writing_to_database(imageSettings, camera_settings_id, full_file_path)
         return photo_bytes
     
     except Exception as e:
@@ -103,6 +128,8 @@ def take_picture(setup_camera_id: int):
     image_settings = ImageSettings(filename=filename, gain=gain, timeDelay=timeDelay, format=format)
     photo_id = take_scintillator_edge_image(camera.username, camera_settings_id, image_settings, PhotoContext.GENERAL)
     cdi.update_scintillator_edges_camera_settings_id(setup_camera_id, camera_settings_id)
+    # Run frames are cropped within this size
+    record_scintillator_edges_frame_size(camera_settings_id, cdi.get_photo_from_id(photo_id))
     return {"id": photo_id} #TODO is this id going to cause problems???
 
 
@@ -136,8 +163,9 @@ def get_scintillator_edge_photo_data(setup_camera_id: int):
     if len(photos) > 1:
         raise Exception("Multiple Scintillator Edge Pictures have been found")
     photo = photos[0]
-    height, width = get_image_bytestring_frame_size(photo.photo)
-    photo_base64 = base64.b64encode(photo.photo).decode("utf-8")
+    photo_bytes = cdi.get_photo_bytes(photo)
+    height, width = get_image_bytestring_frame_size(photo_bytes)
+    photo_base64 = base64.b64encode(photo_bytes).decode("utf-8")
     photo_response = rb.ScintillatorEdgePhotoGet(id=setup_camera_id, #TODO This is janky, really this should be meta data in a setup camera body
                                                  camera_settings_id=photo.camera_settings_link_id,
                                                  photo=photo_base64,
@@ -193,14 +221,27 @@ def save_distortion_image_to_database(setup_camera_id: int, distortion_photo_bod
         photo_id = cdi.add_photo(camera_settings_id, distortion_photo_body.photo)["id"]
     return rb.DistortionCalibrationSaveResponse(id=setup_camera_id)
 
+def encode_photo_base64(photo_bytes: bytes) -> str:
+    """
+    Saved distortion calibration photos are the base64 text the frontend sends,
+    rather than an image - those are given as they are.
+    """
+    if guess_media_type(photo_bytes) == "application/octet-stream":
+        return photo_bytes.decode("ascii")
+    return base64.b64encode(photo_bytes).decode("utf-8")
+
 @router.get("/distortion-calibration/{setup_camera_id}")
 def get_all_distortion_calibration_images(setup_camera_id: int, response: Response):
     with Session(engine) as session:
         setup_camera = session.get(CameraSetupLink, setup_camera_id)
         camera_settings_id = setup_camera.distortion_calibration_camera_settings_link
-        distortion_calibration_images = cdi.get_photo_from_camera_settings_link_id(camera_settings_id)
-        response.headers["Content-Range"] = str(len(distortion_calibration_images))
-        return distortion_calibration_images
+    # The photo bytes are in the photo store, not the rows
+    distortion_calibration_images = [rb.DistortionCalibrationPhotoGet(id=photo.id,
+                                                                      camera_settings_link_id=photo.camera_settings_link_id,
+                                                                      photo=encode_photo_base64(cdi.get_photo_bytes(photo)))
+                                     for photo in cdi.get_photo_from_camera_settings_link_id(camera_settings_id)]
+    response.headers["Content-Range"] = str(len(distortion_calibration_images))
+    return distortion_calibration_images
 
 @router.post("/homography-calibration/{plane}/{setup_camera_id}")
 def take_homography_calibration_image(plane: str, setup_camera_id: int):
@@ -219,11 +260,7 @@ def take_homography_calibration_image(plane: str, setup_camera_id: int):
         else:
             raise HTTPException(status_code=400, detail=f"Invalid plane: {plane}. Must be 'near' or 'far'.")
         
-        old_photos_statement = select(Photo).where(Photo.camera_settings_link_id == camera_settings_id)
-        old_photos = session.exec(old_photos_statement).all()
-        for old_photo in old_photos:
-            session.delete(old_photo)
-        session.commit()
+        cdi.delete_photos_by_camera_settings_link_id(camera_settings_id)
 
         camera_settings = session.get(CameraSettingsLink, camera_settings_id)
 
@@ -318,7 +355,8 @@ def get_test_run_overlays(camera_settings_id: int, response: Response):
         photo_statement = select(Photo).where(Photo.camera_settings_link_id == camera_settings_id)
         photo = session.exec(photo_statement).one()
         horizontal_start, horizontal_end, vertical_start, vertical_end = cdi.get_scintillator_edges_by_photo_id(photo.id)
-        image = load_image_byte_string_to_opencv(photo.photo)
+        image = load_image_byte_string_to_opencv(cdi.get_photo_bytes(photo))
+        image = restore_full_frame_if_cropped(image, camera_settings_id)
         for count, colour_channel in enumerate(ColourChannel):
             is_saturated, overlayed_image = show_saturated_points(image,
                                         horizontal_start,
@@ -346,15 +384,14 @@ def get_real_run_photo(beam_run_id: int, camera_id: int, response: Response):
         photos = sorted(photos, key=lambda photo: photo.id)
         photo_list = []
         for photo in photos:
-            photo_base64 = base64.b64encode(photo.photo).decode("utf-8")
+            photo_base64 = base64.b64encode(cdi.get_photo_bytes(photo)).decode("utf-8")
             photo_list += [rb.RealRunPhotoGet(id=photo.id, camera_id=camera_id, photo=photo_base64)]
         response.headers["Content-Range"] = str(len(photo_list))
         
         return photo_list
     
 
-@router.post("/beam-run/real/{beam_run_id}")
-def take_real_beam_run_images(beam_run_id: int):
+def get_real_run_camera_settings(beam_run_id: int):
     all_camera_settings_ids = []
     with Session(engine) as session:
         camera_settings_statement = select(CameraSettingsLink).where(CameraSettingsLink.beam_run_id == beam_run_id)
@@ -365,17 +402,38 @@ def take_real_beam_run_images(beam_run_id: int):
         experiment_statement = select(Experiment).join(BeamRun).join(CameraSettingsLink).where(CameraSettingsLink.id == all_camera_settings_ids[0]) #TODO a bit janky with [0]
         experiment = session.exec(experiment_statement).one()
         experiment_id = experiment.id  
+    print(f"Settings of {cdi.get_settings_by_id(cdi.get_settings_id_by_camera_settings_id(all_camera_settings_ids[0]))}")
+    return experiment_id, all_camera_settings_ids
+
+async def check_pis_ready_for_run(camera_settings_link_ids: list[int]):
+    """
+    Raises a 409 if any of the run's Pis failed its latest health check, so a run
+    isn't started on a Pi that will fail part way through it.
+    """
+    usernames = await asyncio.to_thread(lambda: list({get_username_by_camera_settings_link_id(camera_settings_link_id)
+                                                      for camera_settings_link_id in camera_settings_link_ids}))
+    if problems := await asyncio.to_thread(check_pis_before_run, usernames):
+        raise HTTPException(status_code=409, detail=f"Pis not ready for the run: {'; '.join(problems)}")
 
-        # TODO Maybe have a try here and return with the issue as well as what was completed??
-        print("\n\n\n GONNA DO A THINGGY in realllllll")
-        print(f"FOr my next trick i shall input experiment id {experiment_id} and all camera settings ids {all_camera_settings_ids}")
-        print(f"Settings of {cdi.get_settings_by_id(cdi.get_settings_id_by_camera_settings_id(all_camera_settings_ids[0]))}")
-        results_dict = take_multiple_videos_for_main_run(experiment_id, all_camera_settings_ids) #TODO Temporary [0] and single video for a little test
-        print("DONE A THINGY \n\n\n")
-        return rb.RealRunPhotoPostResponse(id=beam_run_id)
-
-@router.post("/beam-run/test/{beam_run_id}")
-def take_test_beam_run_images(beam_run_id: int):  
+@router.post("/beam-run/real/{beam_run_id}")
+async def take_real_beam_run_images(beam_run_id: int):
+    # Database and Pi work runs on threads, so the event loop is free while the Pis capture
+    experiment_id, all_camera_settings_ids = await asyncio.to_thread(get_real_run_camera_settings, beam_run_id)
+    await check_pis_ready_for_run(all_camera_settings_ids)
+
+    # A Pi that fails or misses its deadline doesn't lose the others' frames - the response has each camera's status
+    pi_results = {}
+    async for pi_result in take_multiple_videos_for_main_run_as_completed(experiment_id, all_camera_settings_ids):
+        if not pi_result.succeeded:
+            print(f"Error in main run video capture for camera settings link id {pi_result.key}: {pi_result.error}")
+        pi_results[pi_result.key] = pi_result
+    camera_statuses = await asyncio.to_thread(get_camera_run_statuses, pi_results)
+    return rb.RealRunPhotoPostResponse(id=beam_run_id, camera_statuses=camera_statuses)
+
+def get_test_run_camera_settings(beam_run_id: int):
+    """
+    Returns the experiment id and the camera settings link ids of the run grouped by camera.
+    """
     with Session(engine) as session:
         camera_settings_statement = select(CameraSettingsLink).where(CameraSettingsLink.beam_run_id == beam_run_id)
         all_camera_settings = session.exec(camera_settings_statement).all()
@@ -392,15 +450,31 @@ def take_test_beam_run_images(beam_run_id: int):
             camera_and_settings_ids[count, 0] = camera_id
             camera_and_settings_ids[count, 1] = camera_settings_id
 
-        unique_camera_ids = np.unique(camera_and_settings_ids[:, 0])
-        grouped_camera_settings = [camera_and_settings_ids[camera_and_settings_ids[:, 0] == cam_id, 1].tolist() for cam_id in unique_camera_ids]
+    unique_camera_ids = np.unique(camera_and_settings_ids[:, 0])
+    grouped_camera_settings = [camera_and_settings_ids[camera_and_settings_ids[:, 0] == cam_id, 1].tolist() for cam_id in unique_camera_ids]
+    return experiment_id, grouped_camera_settings
 
-        # TODO Maybe have a try here and return with the issue as well as what was completed??
-        print("\n\n\n About to take pictures")
-        results_dict = take_multiple_videos_for_test_run(experiment_id, grouped_camera_settings) #TODO SHOULD BE MULTIPLE PRESUMABLY
-        print(f"\n\n\n Pictures taken \n\n")
-        
-        for photo_id_array in results_dict.values():
-            set_optimal_settings(photo_id_array, threshold=5) #TODO Blue channel hardcoded currently
-        return rb.RealRunPhotoPostResponse(id=beam_run_id)
+@router.post("/beam-run/test/{beam_run_id}")
+async def take_test_beam_run_images(beam_run_id: int):  
+    experiment_id, grouped_camera_settings = await asyncio.to_thread(get_test_run_camera_settings, beam_run_id)
+    await check_pis_ready_for_run([camera_settings_link_id_array[0] for camera_settings_link_id_array in grouped_camera_settings])
+    camera_settings_by_first_id = {camera_settings_link_id_array[0]: camera_settings_link_id_array
+                                   for camera_settings_link_id_array in grouped_camera_settings}
+
+    # Each Pi's optimal settings are found as soon as its test run is in, rather than after the slowest Pi.
+    # A Pi that failed gets none, and a Pi whose settings can't be found has that as its error - either way
+    # the other Pis' results are still returned
+    pi_results = {}
+    async for pi_result in take_multiple_videos_for_test_run_as_completed(experiment_id, grouped_camera_settings):
+        if not pi_result.succeeded:
+            print(f"Error in test run video capture for camera settings link id {pi_result.key}: {pi_result.error}")
+        else:
+            try:
+                await asyncio.to_thread(set_optimal_settings, camera_settings_by_first_id[pi_result.key], pi_result.result, threshold=5) #TODO Blue channel hardcoded currently
+            except Exception as e:
+                print(f"Error setting optimal settings for camera settings link id {pi_result.key}: {e}")
+                pi_result = dataclasses.replace(pi_result, error=Exception(f"Test run captured, but optimal settings could not be set: {e}"))
+        pi_results[pi_result.key] = pi_result
+    camera_statuses = await asyncio.to_thread(get_camera_run_statuses, pi_results)
+    return rb.RealRunPhotoPostResponse(id=beam_run_id, camera_statuses=camera_statuses)
     
@@ -13,20 +13,16 @@ import cv2 as cv
 
 def pinpoint_bragg_peak(camera_analysis_id_list):
     try:
-        camera_id_list = []
-        # TODO - could make new function which gets setup_id and camera_id from camera_analysis_id
-        # TODO - add validation to check cam analyses from same beam run
-        for camera_analysis_id in camera_analysis_id_list:
-            camera_settings_link_id = cdi.get_camera_settings_link_id_by_camera_analysis_id(camera_analysis_id)
-            camera_id_list.append(cdi.get_camera_and_settings_ids(camera_settings_link_id)["camera_id"])
-        beam_run_id = cdi.get_beam_run_id_by_camera_settings_link_id(camera_settings_link_id)
-        experiment_id = cdi.get_experiment_id_from_beam_run_id(beam_run_id)
-        setup_id = cdi.get_setup_id_from_experiment_id(experiment_id)
+        contexts = cdi.get_camera_analysis_contexts(camera_analysis_id_list, with_average_image=False)
+        beam_run_ids = {context.beam_run_id for context in contexts}
+        if len(beam_run_ids) != 1:
+            raise ValueError(f"Camera analyses {camera_analysis_id_list} are from more than one beam run: {beam_run_ids}")
+        beam_run_id = contexts[0].beam_run_id
         
-        bragg_peak_pixel_list = [cdi.get_bragg_peak_pixel(camera_analysis_id) for camera_analysis_id in camera_analysis_id_list]
-        bragg_peak_pixel_error_list = [cdi.get_unc_bragg_peak_pixel(camera_analysis_id) for camera_analysis_id in camera_analysis_id_list]
+        bragg_peak_pixel_list = [context.bragg_peak_pixel for context in contexts]
+        bragg_peak_pixel_error_list = [context.unc_bragg_peak_pixel for context in contexts]
         
-        cameras = [AbstractCamera.setup(camera_id, setup_id) for camera_id in camera_id_list]
+        cameras = [AbstractCamera.setup(context.camera_id, context.setup_id, context.camera_setup) for context in contexts]
         weighted_bragg_peak_position, unc_weighted_bragg_peak_position = (
             extract_weighted_average_3d_physical_position(cameras, bragg_peak_pixel_list, bragg_peak_pixel_error_list, scintillator_present=True))
         
@@ -273,12 +269,9 @@ def convert_beam_center_coords_to_penetration_depths(camera_analysis_id: int, un
     cdi.delete_failed_pinpoints_image_by_camera_analysis_id(camera_analysis_id)
     
     # Create camera object
-    camera_settings_link_id = cdi.get_camera_settings_link_id_by_camera_analysis_id(camera_analysis_id)
-    camera_id = cdi.get_camera_and_settings_ids(camera_settings_link_id)["camera_id"]
-    beam_run_id = cdi.get_beam_run_id_by_camera_settings_link_id(camera_settings_link_id)
-    experiment_id = cdi.get_experiment_id_from_beam_run_id(beam_run_id)
-    setup_id = cdi.get_setup_id_from_experiment_id(experiment_id)
-    camera = AbstractCamera.setup(camera_id, setup_id)
+    context = cdi.get_camera_analysis_context(camera_analysis_id, with_average_image=False)
+    beam_run_id = context.beam_run_id
+    camera = AbstractCamera.setup(context.camera_id, context.setup_id, context.camera_setup)
     
     beam_center_incident_position = np.array(cdi.get_beam_incident_3d_position(beam_run_id))
     unc_beam_center_initial_position = np.array(cdi.get_unc_beam_incident_3d_position(beam_run_id))
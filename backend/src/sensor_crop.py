@@ -0,0 +1,108 @@
+"""
+Main and test run frames can be cropped on the Pi to the scintillator (plus a
+margin), so only that window is encoded, transferred and decoded. The window is
+stored on the camera settings link in full frame pixels. Cropped frames are put
+back at that offset in an otherwise empty full frame before distortion
+correction, the automated ROI or the homographies see them, as these all work
+in full frame pixel coordinates.
+"""
+import cv2 as cv
+import numpy as np
+from src.database.CRUD import CRISP_database_interaction as cdi
+
+# Pixels this close to a scintillator edge are left out of its saturation check
+SCINTILLATOR_EDGE_INSET = 5
+
+
+def get_setup_id_by_camera_settings_link_id(camera_settings_link_id: int):
+    beam_run_id = cdi.get_beam_run_id_by_camera_settings_link_id(camera_settings_link_id)
+    experiment_id = cdi.get_experiment_id_from_beam_run_id(beam_run_id)
+    return cdi.get_setup_id_from_experiment_id(experiment_id)
+
+
+def get_scintillator_edges_frame_size(camera_id: int, setup_id: int):
+    """
+    The scintillator edges are picked on a full frame photo, so its size is the
+    full frame size - recorded on its camera settings link when it is taken.
+    Photos taken before then are decoded once, and their size recorded. Returns
+    None if there is no such photo.
+    """
+    camera_settings_id = cdi.get_scintillator_edges_photo_camera_settings_id(camera_id, setup_id)
+    if camera_settings_id is None:
+        return None
+    if (full_frame_size := cdi.get_full_frame_size(camera_settings_id)) is not None:
+        return full_frame_size
+    photos = cdi.get_photo_from_camera_settings_link_id(camera_settings_id)
+    if not photos:
+        return None
+    return record_scintillator_edges_frame_size(camera_settings_id, cdi.get_photo_bytes(photos[0]))
+
+
+def record_scintillator_edges_frame_size(camera_settings_id: int, photo_bytes: bytes):
+    image = cv.imdecode(np.frombuffer(photo_bytes, np.uint8), cv.IMREAD_COLOR)
+    full_frame_size = [image.shape[0], image.shape[1]]
+    cdi.update_full_frame_size(camera_settings_id, full_frame_size)
+    return full_frame_size
+
+
+def get_scintillator_window(camera_settings_link_id: int):
+    """
+    Returns [x, y, width, height] of the scintillator in full frame pixels, or
+    None if the scintillator edges have not been set for this camera.
+    """
+    camera_id = cdi.get_camera_and_settings_ids(camera_settings_link_id)["camera_id"]
+    setup_id = get_setup_id_by_camera_settings_link_id(camera_settings_link_id)
+    horizontal_limits = cdi.get_horizontal_scintillator_limits(camera_id, setup_id)
+    vertical_limits = cdi.get_vertical_scintillator_limits(camera_id, setup_id)
+    if None in horizontal_limits or None in vertical_limits:
+        return None
+    return [min(horizontal_limits), min(vertical_limits),
+            abs(horizontal_limits[1] - horizontal_limits[0]), abs(vertical_limits[1] - vertical_limits[0])]
+
+
+def inset_window(window: list[int], inset: int = SCINTILLATOR_EDGE_INSET):
+    """
+    [x, y, width, height] shrunk by inset on every side, as
+    gain_automation.restrict_to_region_of_interest does to the scintillator.
+    """
+    x, y, width, height = window
+    return [x + inset, y + inset, max(0, width - 2 * inset), max(0, height - 2 * inset)]
+
+
+def determine_crop_window(camera_settings_link_id: int, margin: int):
+    """
+    Returns ([x, y, width, height], [frame height, frame width]), or (None, None)
+    if the scintillator edges have not been set for this camera.
+    """
+    if (scintillator_window := get_scintillator_window(camera_settings_link_id)) is None:
+        return None, None
+    camera_id = cdi.get_camera_and_settings_ids(camera_settings_link_id)["camera_id"]
+    setup_id = get_setup_id_by_camera_settings_link_id(camera_settings_link_id)
+    if (full_frame_size := get_scintillator_edges_frame_size(camera_id, setup_id)) is None:
+        return None, None
+
+    frame_height, frame_width = full_frame_size
+    x, y, width, height = scintillator_window
+    x_start = max(0, x - margin)
+    x_end = min(frame_width, x + width + margin)
+    y_start = max(0, y - margin)
+    y_end = min(frame_height, y + height + margin)
+    return [x_start, y_start, x_end - x_start, y_end - y_start], full_frame_size
+
+
+def restore_full_frame(image: np.ndarray, crop_window: list[int], full_frame_size: list[int]):
+    """
+    Pixels outside the crop window are zero.
+    """
+    x, y, width, height = crop_window
+    full_frame = np.zeros((full_frame_size[0], full_frame_size[1]) + image.shape[2:], dtype=image.dtype)
+    full_frame[y:y+height, x:x+width] = image
+    return full_frame
+
+
+def restore_full_frame_if_cropped(image: np.ndarray, camera_settings_link_id: int):
+    crop_window, full_frame_size = cdi.get_crop_window(camera_settings_link_id)
+    if crop_window is None:
+        return image
+    return restore_full_frame(image, crop_window, full_frame_size)
+
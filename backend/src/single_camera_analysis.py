@@ -124,30 +124,26 @@ def rotate_pixel_back_to_original_beam_direction(original_image_beam_direction,
 
 def source_params_from_database(camera_analysis_id: int):
     
-    camera_settings_link_id = cdi.get_camera_settings_link_id_by_camera_analysis_id(camera_analysis_id)
-    beam_run_id = cdi.get_beam_run_id_by_camera_settings_link_id(camera_settings_link_id)
-    camera_id = cdi.get_camera_and_settings_ids(camera_settings_link_id)["camera_id"]
-    experiment_id = cdi.get_experiment_id_from_beam_run_id(beam_run_id)
-    setup_id = cdi.get_setup_id_from_experiment_id(experiment_id)
+    context = cdi.get_camera_analysis_context(camera_analysis_id) # One query for everything below
     
-    print("Camera settings link ID: ", camera_settings_link_id)
-    print("Beam run ID: ", beam_run_id)
-    print("Camera ID: ", camera_id)
-    print("Setup ID: ", setup_id)
-    print("Experiment ID: ", experiment_id)
+    print("Camera settings link ID: ", context.camera_settings_link_id)
+    print("Beam run ID: ", context.beam_run_id)
+    print("Camera ID: ", context.camera_id)
+    print("Setup ID: ", context.setup_id)
+    print("Experiment ID: ", context.experiment_id)
     
-    beam_energy = cdi.get_beam_run_ESS_beam_energy(beam_run_id)
-    average_image = cdi.get_average_image(camera_analysis_id)
+    beam_energy = context.beam_energy
+    average_image = context.average_image
     
-    num_of_images_used_in_average = cdi.get_num_of_successfully_captured_images_by_camera_settings_link_id(camera_settings_link_id) # validate against zero images
+    num_of_images_used_in_average = context.num_of_images # validate against zero images
     unc_average_image = np.sqrt(average_image / num_of_images_used_in_average) # Poissonian error on mean used here
     
     average_image, unc_average_image = average_image.astype(np.float64), unc_average_image.astype(np.float64) # TODO - fix because cv2 does not support float16
     
-    image_beam_direction = cdi.get_image_beam_direction(camera_id, setup_id)
-    colour_channel = cdi.get_colour_channel(camera_analysis_id)
-    scintillator_edges = np.array([cdi.get_horizontal_scintillator_limits(camera_id, setup_id),
-                          cdi.get_vertical_scintillator_limits(camera_id, setup_id)]) # [horizontal_roi_dimensions, vertical_roi_dimensions]
+    image_beam_direction = context.camera_setup.image_beam_direction
+    colour_channel = context.colour_channel
+    scintillator_edges = np.array([context.camera_setup.horizontal_scintillator_limits,
+                                   context.camera_setup.vertical_scintillator_limits]) # [horizontal_roi_dimensions, vertical_roi_dimensions]
     return beam_energy, image_beam_direction, colour_channel, average_image, unc_average_image, scintillator_edges
 
 
@@ -0,0 +1,108 @@
+"""
+Optional compression of the frame tar stream sent from the Pis to the backend.
+Used by video_script on the Pi (copied there alongside it) and by Camera on the
+backend, so both ends agree on the format.
+
+zstandard and lz4 are optional (the backend's transfer-codecs extra) - only the
+codec in use needs installing, on both the Pi and the backend.
+"""
+import time
+
+TRANSFER_CODECS = ("none", "zstd", "lz4")
+ARCHIVE_EXTENSIONS = {"none": ".tar", "zstd": ".tar.zst", "lz4": ".tar.lz4"}
+DEFAULT_LEVELS = {"zstd": 3, "lz4": 0}
+
+
+def import_codec_module(codec: str):
+    try:
+        if codec == "zstd":
+            import zstandard
+            return zstandard
+        if codec == "lz4":
+            import lz4.frame
+            return lz4.frame
+    except ImportError as e:
+        raise ImportError(f"The {codec} transfer codec needs the {'zstandard' if codec == 'zstd' else 'lz4'} package: {e}")
+    raise ValueError(f"Unknown transfer codec {codec}, expected one of {TRANSFER_CODECS}")
+
+
+def get_codec_from_archive_name(archive_name: str):
+    for codec, extension in ARCHIVE_EXTENSIONS.items():
+        if codec != "none" and archive_name.endswith(extension):
+            return codec
+    return "none"
+
+
+class CompressedWriter:
+    """
+    Write-only file object compressing into stream (left open on close).
+    flush() compresses everything written so far, so a frame streamed
+    mid-run can be decoded by the backend without waiting for the next one.
+
+    compression_time is the CPU time spent compressing, for the benchmark.
+    """
+    def __init__(self, stream, codec: str, level=None):
+        self.stream = stream
+        self.codec = codec
+        self.level = DEFAULT_LEVELS.get(codec) if level is None else level
+        self.compression_time = 0.0
+        if codec == "zstd":
+            zstandard = import_codec_module(codec)
+            self.flush_block = zstandard.FLUSH_BLOCK
+            self.flush_frame = zstandard.FLUSH_FRAME
+            self.writer = zstandard.ZstdCompressor(level=self.level).stream_writer(stream, closefd=False)
+        elif codec == "lz4":
+            # An lz4 frame can only be flushed by ending it - the decoder reads on across frames
+            self.compressor = import_codec_module(codec).LZ4FrameCompressor(compression_level=self.level)
+            self.frame_started = False
+        elif codec != "none":
+            raise ValueError(f"Unknown transfer codec {codec}, expected one of {TRANSFER_CODECS}")
+
+    def write(self, data):
+        start_time = time.process_time()
+        if self.codec == "zstd":
+            self.writer.write(data)
+        elif self.codec == "lz4":
+            if not self.frame_started:
+                self.stream.write(self.compressor.begin())
+                self.frame_started = True
+            self.stream.write(self.compressor.compress(data))
+        else:
+            self.stream.write(data)
+        self.compression_time += time.process_time() - start_time
+        return len(data)
+
+    def end_block(self, end_frame=False):
+        if self.codec == "zstd":
+            self.writer.flush(self.flush_frame if end_frame else self.flush_block)
+        elif self.codec == "lz4" and self.frame_started:
+            self.stream.write(self.compressor.flush())
+            self.frame_started = False
+
+    def flush(self):
+        self.end_block()
+        self.stream.flush()
+
+    def close(self):
+        self.end_block(end_frame=True)
+        self.stream.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def open_decompressed_stream(stream, codec: str):
+    """
+    Returns a readable file object of the decompressed stream.
+    """
+    if codec == "none":
+        return stream
+    if codec == "zstd":
+        return import_codec_module(codec).ZstdDecompressor().stream_reader(stream, read_across_frames=True, closefd=False)
+    if codec == "lz4":
+        return import_codec_module(codec).LZ4FrameFile(stream, mode="rb")
+    raise ValueError(f"Unknown transfer codec {codec}, expected one of {TRANSFER_CODECS}")
@@ -31,7 +31,7 @@ TODO: ADD A FLAG FOR IN CASE AWB IS NEEDED IN EXPERIMENT
 Setting flag recovers AWB and colour gains are omitted
 """
 import argparse
-from picamera2 import Picamera2, Metadata
+from picamera2 import Picamera2, Metadata, MappedArray
 from PIL import Image
 import numpy as np
 import os
@@ -40,22 +40,37 @@ import json
 import shutil
 import logging
 import tarfile
+import hashlib
+import io
 import socket # get hostname without passing into SSH command
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from libcamera import controls
+from transfer_codec import TRANSFER_CODECS, ARCHIVE_EXTENSIONS, CompressedWriter, open_decompressed_stream
 
 
 def get_relative_time(start_time):
     return time.time() - start_time
 
 def setup_logging(directory_path):
-    
-    logging.basicConfig(
-        filename=f"{directory_path}/metadata.log",
-        level=logging.INFO,  # You can adjust the level (DEBUG, INFO, etc.)
-        format='%(asctime)s - %(message)s',  # Format includes timestamp
-        filemode='a'  # Use 'a' to append to the log file (not overwrite)
-    )
+    """
+    Returns the metadata.log handler - the camera daemon removes it after the
+    run, as it logs many runs (basicConfig would do nothing once it has set
+    up its own log).
+    """
+    handler = logging.FileHandler(f"{directory_path}/metadata.log", mode="a") # Append rather than overwrite
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s')) # Format includes timestamp
+    root_logger = logging.getLogger()
+    root_logger.addHandler(handler)
+    root_logger.setLevel(logging.INFO) # You can adjust the level (DEBUG, INFO, etc.)
     logging.info("Beginning to log...")
+    return handler
+
+
+def stop_logging(handler):
+    logging.getLogger().removeHandler(handler)
+    handler.close()
     
 
 def lens_position_type(value):
@@ -78,6 +93,15 @@ def gain_type(value):
         raise argparse.ArgumentTypeError("Gain must be between 1.0 and 16.0")
     return fvalue
 
+def ram_budget_type(value):
+    try:
+        fvalue = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("RAM budget must be a float (in MB).")
+    if fvalue <= 0:
+        raise argparse.ArgumentTypeError("RAM budget must be greater than 0 MB")
+    return fvalue
+
 def frame_rate_type(value):
     try:
         fvalue = float(value)
@@ -87,9 +111,10 @@ def frame_rate_type(value):
         raise argparse.ArgumentTypeError("Frame rate must be between 5*10**-3 and 90 fps")
     return fvalue
 
-def parse_arguments():
+def parse_arguments(argv=None):
     """
     Update choices to restrict the valid range of these args entered by a user.
+    argv defaults to the command line - the camera daemon passes its own.
     
     NOTE - All parent parser args must go before subparser command!
     Examples:
@@ -105,6 +130,10 @@ def parse_arguments():
     parser.add_argument("-fr", "--frame_rate", type=frame_rate_type, help="Specify frame rate (will be converted to an exposure time)", default=1.0) # in fps
     parser.add_argument("-c", "--colour", type=str, choices=["r", "g", "b", "all"], help="Specify colour channel to save from image (one channel or all) ", default="all")
     parser.add_argument("-raw", "--save_dng", action="store_true", help="Save images in DNG format (in addition to the primary format to be transferred to local device)")
+    parser.add_argument("-crop", "--crop_window", type=int, nargs=4, metavar=("X", "Y", "WIDTH", "HEIGHT"), help="Only encode this window of the frame (in full frame pixels)", default=None)
+    parser.add_argument("-st", "--stream_target", type=str, help="Stream each saved frame as a tar member to stdout ('-') or a FIFO path, instead of packaging a tarball at the end", default=None)
+    parser.add_argument("-tc", "--transfer_codec", type=str, choices=TRANSFER_CODECS, help="Compress the tar stream/tarball sent to the backend", default="none")
+    parser.add_argument("-tcl", "--transfer_codec_level", type=int, help="Compression level of the transfer codec (codec default if not given)", default=None)
     
     # Add after python <script_name> to specify the subcommand to run
     subparsers = parser.add_subparsers(dest="command", help="sub-commands are (main / test)", required=True)
@@ -115,24 +144,48 @@ def parse_arguments():
     main_run_parser.add_argument("-g", "--gain", type=gain_type, help="Gain Setting", default=1.0)
     main_run_parser.add_argument("-i", "--print_info", action="store_true", help="Flag for whether to print control information and quit script")
     main_run_parser.add_argument("-csl", "--camera_settings_link_id", type=int, help="Stores the camera setting link ID of the in the CameraSettings table that holds these images' settings")
+    main_run_parser.add_argument("-pw", "--pipeline_workers", type=int, help="Number of writer threads saving frames while capture continues (0 saves each frame before the next capture)", default=0)
+    main_run_parser.add_argument("-red", "--reduce", action="store_true", help="Accumulate the per-pixel mean and variance of the -c colour channel and save one .npy instead of every frame")
+    main_run_parser.add_argument("-ram", "--ram_budget", type=ram_budget_type, help="Maximum RAM (in MB) held by captured frames waiting to be saved in pipelined mode", default=1024)
+    main_run_parser.add_argument("-mif", "--max_frames_in_flight", type=int, help="Maximum captured frames waiting to be saved in pipelined mode, whatever the RAM budget (sets the camera's buffer count)", default=MAX_FRAMES_IN_FLIGHT)
     
     # Sub arguments for test beam run
     test_run_parser = subparsers.add_parser("test_run", help="Perform test beam run imaging")
     test_run_parser.add_argument('--gain_list', type=json.loads, help='Pass a list as JSON', required=True)
     test_run_parser.add_argument('--cs_id_array', type=json.loads, help='Pass a list as JSON', required=True)
+    test_run_parser.add_argument("-agt", "--analogue_gain_tolerance", type=float, help="How close the frame's AnalogueGain must be to the requested gain", default=0.2)
+    test_run_parser.add_argument("-dgt", "--digital_gain_tolerance", type=float, help="How close the frame's DigitalGain must be to 1.0", default=0.05)
+    test_run_parser.add_argument("-swt", "--settle_wait_time", type=float, help="Maximum time (s) to wait for each gain to settle", default=5.0)
+    test_run_parser.add_argument("-roi", "--saturation_roi", type=int, nargs=4, metavar=("X", "Y", "WIDTH", "HEIGHT"), help="Save per-channel saturation statistics of this window (full frame pixels) to a JSON", default=None)
+    test_run_parser.add_argument("-sat", "--saturation_threshold", type=int, help="Pixel value counted as saturated", default=250)
+    test_run_parser.add_argument("-so", "--statistics_only", action="store_true", help="Only save the saturation statistics, not the images")
     # test_run_parser.add_argument("-min", "--minimum_gain", type=float, required=True)
     # test_run_parser.add_argument("-max", "--maximum_gain", type=float, required=True)
     # test_run_parser.add_argument("-step", "--gain_increment", type=float, required=True)
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    args.frame_metadata = {} # Filled as frames are saved, then sent with each frame in the tar
     
     if (args.bit_depth == 16) and args.colour == "all":
             raise ValueError("Can only use bit depths higher than 8 when a single colour channel is inputted with -c flag.")
+    if args.crop_window is not None:
+        x, y, width, height = args.crop_window
+        if x < 0 or y < 0 or width <= 0 or height <= 0:
+            raise ValueError("-crop/--crop_window needs a non-negative offset and a positive width and height.")
     if args.command == "main_run":
         if not args.print_info and (args.num_of_images is None or args.camera_settings_link_id is None):
                 raise ValueError("-num/--num_of_images and -csl/camera_settings_link_id is required if not using the -i flag.")
         if args.print_info and not args.logging:
             args.logging = True
+        if args.pipeline_workers < 0:
+            raise ValueError("-pw/--pipeline_workers cannot be negative.")
+        if args.max_frames_in_flight < 1:
+            raise ValueError("-mif/--max_frames_in_flight must be at least 1.")
+        if args.reduce and args.colour == "all":
+            raise ValueError("-red/--reduce requires a single colour channel inputted with the -c flag.")
+    if args.command == "test_run":
+        if args.statistics_only and args.saturation_roi is None:
+            raise ValueError("-so/--statistics_only requires a -roi/--saturation_roi to compute statistics over.")
     return args
 
 def convert_framerate_to_frame_duration(framerate):
@@ -145,6 +198,28 @@ def convert_framerate_to_frame_duration(framerate):
     return round(10**6/framerate)
 
 
+def build_controls_dict(args, frame_duration, gain=None):
+    """
+    Fixed exposure and colour processing shared by main and test runs. Gain is
+    left out when it is set per image (test runs).
+    """
+    controls_dict = {
+        "ColourGains": (1.0, 1.0),
+        "NoiseReductionMode": 0,
+        "Contrast": 1.0,
+        "Saturation": 1.0,
+        "Sharpness": 1.0,
+        "FrameDurationLimits": (frame_duration, frame_duration),
+        "ExposureTime": int(frame_duration / 2)
+    }
+    if gain is not None:
+        controls_dict["AnalogueGain"] = gain
+    if args.lens_position is not None:
+        controls_dict["AfMode"] = controls.AfModeEnum.Manual
+        controls_dict["LensPosition"] = args.lens_position
+    return controls_dict
+
+
 def check_directory_exists(directory_path: str):
     # Check if the directory exists
     if not os.path.exists(directory_path):
@@ -160,8 +235,36 @@ def check_directory_exists(directory_path: str):
     return directory_path
     
 
+def check_crop_window(picam2, args):
+    """
+    A window running off the frame would be padded by PIL rather than raising,
+    so it is checked against the main stream once the camera is configured.
+    """
+    if args.crop_window is None:
+        return
+    x, y, width, height = args.crop_window
+    frame_width, frame_height = picam2.camera_config["main"]["size"]
+    if x + width > frame_width or y + height > frame_height:
+        raise ValueError(f"Crop window {args.crop_window} does not fit in the {frame_width}x{frame_height} frame")
+    logging.info(f"Frames cropped to {width}x{height} at offset ({x}, {y})")
+
+
+def crop_array(array, crop_window):
+    """
+    A view - nothing is copied.
+    """
+    if crop_window is None:
+        return array
+    x, y, width, height = crop_window
+    return array[y:y+height, x:x+width]
+
+
 def process_frame(image, args):
 
+    if args.crop_window is not None:
+        x, y, width, height = args.crop_window
+        image = image.crop((x, y, x + width, y + height))
+    
     if args.colour == "all":
         return image  # Skip bit depth and colour selection logic - just exit the function
     
@@ -229,7 +332,9 @@ def take_main_run_images(picam2, args, frame_duration, start_time):
         logging.info(f"Image {i} capture started at t = : {get_relative_time(start_time)}")
         
         logging.info(f"Image {i} capture requested at t = : {get_relative_time(start_time)}")
+        capture_start_time = time.time()
         r = picam2.capture_request()
+        capture_duration = time.time() - capture_start_time
         if not r:
             logging.warning(f"Image {i} failed to capture!")
             continue
@@ -250,7 +355,8 @@ def take_main_run_images(picam2, args, frame_duration, start_time):
         if args.save_dng:
             raw_path = f"{args.directory_name}/image_{i:0{num_digits}d}.dng"
             r.save_dng(raw_path)
-        logging.info(f"Image {i} dng took {time.time() - dng_start_time} to save")
+        dng_duration = time.time() - dng_start_time
+        logging.info(f"Image {i} dng took {dng_duration} to save")
         
         # Convert the captured raw image data into a frame that can be processed.
         jpeg_start_time = time.time()
@@ -258,9 +364,12 @@ def take_main_run_images(picam2, args, frame_duration, start_time):
         image = process_frame(frame, args)
         filename = f"main_run_image_{(i):0{num_digits}d}_cslID_{args.camera_settings_link_id}.{args.format}"
         image.save(f"{args.directory_name}/{filename}", format=args.format)
-        logging.info(f"Image {i} {args.format} took {time.time() - jpeg_start_time} to save")
-        
+        encode_duration = time.time() - jpeg_start_time
+        logging.info(f"Image {i} {args.format} took {encode_duration} to save")
+        frame_metadata = build_frame_metadata(i, r.get_metadata(), capture_duration=capture_duration,
+                                              dng_duration=dng_duration, encode_duration=encode_duration)
         r.release()
+        stream_saved_file(args, f"{args.directory_name}/{filename}", frame_metadata)
     
     # Images processed after all of the capturing is complete
     # for i, frame in enumerate(frames, 1):
@@ -271,6 +380,354 @@ def take_main_run_images(picam2, args, frame_duration, start_time):
     logging.info(f"{args.num_of_images} images saved to directory.")
     return 1
 
+def estimate_request_memory(picam2):
+    """
+    Bytes held by one completed request (every configured stream buffer),
+    and bytes of the PIL image made from the main stream by a writer.
+    Only valid once the camera has been configured.
+    """
+    request_bytes = 0
+    for stream in ("main", "lores", "raw"):
+        stream_config = picam2.camera_config.get(stream)
+        if not stream_config:
+            continue
+        framesize = stream_config.get("framesize") or stream_config["stride"] * stream_config["size"][1]
+        request_bytes += framesize
+    width, height = picam2.camera_config["main"]["size"]
+    image_bytes = width * height * 4 # make_image can return RGBA
+    return request_bytes, image_bytes
+
+
+MAX_FRAMES_IN_FLIGHT = 6 # Camera buffers come from the Pi's CMA pool, which is far smaller than its RAM
+
+def determine_frames_in_flight(request_bytes, image_bytes, args):
+    """
+    Number of captured requests allowed to wait for a writer. Each writer also
+    holds a decoded PIL image, so that is taken off the budget first. At least
+    one request is always allowed in flight, otherwise nothing could be saved.
+    However large the budget, no more than args.max_frames_in_flight are
+    allowed, as each needs its own camera buffer and allocating too many fails
+    when the camera is configured.
+    """
+    ram_budget_bytes = args.ram_budget * 10**6
+    available_bytes = ram_budget_bytes - args.pipeline_workers * image_bytes
+    frames_in_flight = max(1, min(int(available_bytes // request_bytes), args.max_frames_in_flight))
+    logging.info(f"Pipelined capture: {request_bytes/10**6:.1f} MB per request, {frames_in_flight} requests " +
+                 f"allowed in flight within a {args.ram_budget} MB budget (at most {args.max_frames_in_flight})")
+    return frames_in_flight
+
+
+def configure_camera_for_pipelining(picam2, args):
+    """
+    Requests keep hold of their camera buffers until released by a writer, so the
+    buffer count must cover the frames in flight plus one for the camera to fill.
+    The still configuration is applied once to learn the buffer sizes, then 
+    reapplied with the required buffer count.
+    """
+    picam2.configure(picam2.create_still_configuration(raw={}, display=None))
+    request_bytes, image_bytes = estimate_request_memory(picam2)
+    frames_in_flight = determine_frames_in_flight(request_bytes, image_bytes, args)
+    capture_config = picam2.create_still_configuration(raw={}, display=None, buffer_count=frames_in_flight + 1)
+    picam2.configure(capture_config)
+    return frames_in_flight
+
+
+FRAME_METADATA_PAX_KEY = "CRISP.frame_metadata"
+FRAME_SHA256_PAX_KEY = "CRISP.sha256" # Streamed members only - tarballs have a manifest
+FRAME_METADATA_KEYS = ("SensorTimestamp", "ExposureTime", "AnalogueGain", "DigitalGain", "FrameDuration")
+
+def build_frame_metadata(i, request_metadata, **durations):
+    """
+    The Picamera2 metadata needed for frame timing plus the capture and save
+    durations (s) of one frame. It travels in the frame's tar header, so it is
+    kept to a few hundred bytes.
+    """
+    frame_metadata = {"index": i}
+    for key in FRAME_METADATA_KEYS:
+        if key in request_metadata:
+            frame_metadata[key] = request_metadata[key]
+    for name, duration in durations.items():
+        if duration is not None:
+            frame_metadata[name] = round(duration, 6)
+    return frame_metadata
+
+
+def write_main_run_frame(r, i, args, num_digits, start_time, capture_duration=None, submitted_time=None):
+    """
+    Run by the writer threads. The request is always released so its buffer
+    returns to the camera, even if the save fails. The time a frame waited for
+    a free writer is recorded, as a growing wait means the writers are the bottleneck.
+    """
+    try:
+        dng_start_time = time.time()
+        writer_wait_duration = dng_start_time - submitted_time if submitted_time is not None else None
+        if args.save_dng:
+            raw_path = f"{args.directory_name}/image_{i:0{num_digits}d}.dng"
+            r.save_dng(raw_path)
+        dng_duration = time.time() - dng_start_time
+        logging.info(f"Image {i} dng took {dng_duration} to save")
+
+        jpeg_start_time = time.time()
+        frame = r.make_image("main")
+        image = process_frame(frame, args)
+        filename = f"main_run_image_{(i):0{num_digits}d}_cslID_{args.camera_settings_link_id}.{args.format}"
+        image.save(f"{args.directory_name}/{filename}", format=args.format)
+        encode_duration = time.time() - jpeg_start_time
+        logging.info(f"Image {i} {args.format} took {encode_duration} to save (finished at t = : {get_relative_time(start_time)})")
+        frame_metadata = build_frame_metadata(i, r.get_metadata(), capture_duration=capture_duration,
+                                              writer_wait_duration=writer_wait_duration,
+                                              dng_duration=dng_duration, encode_duration=encode_duration)
+    finally:
+        r.release()
+    stream_saved_file(args, f"{args.directory_name}/{filename}", frame_metadata)
+
+
+def log_frame_interval_statistics(sensor_timestamps, frame_duration):
+    """
+    SensorTimestamp is in nanoseconds, frame_duration in microseconds. The 
+    intervals between consecutive sensor timestamps are what the requested
+    frame rate actually achieved.
+    """
+    if len(sensor_timestamps) < 2:
+        return None
+    intervals = np.diff(np.array(sensor_timestamps, dtype=np.int64)) / 10**3
+    logging.info(f"Requested frame interval: {frame_duration} us")
+    logging.info(f"Achieved frame interval: mean = {np.mean(intervals):.1f} us, std = {np.std(intervals):.1f} us, " +
+                 f"max = {np.max(intervals):.1f} us ({np.sum(intervals > 1.5 * frame_duration)} frames dropped or delayed)")
+    return intervals
+
+
+def take_main_run_images_pipelined(picam2, args, frame_duration, start_time, frames_in_flight):
+    """
+    The capture loop only grabs requests and hands them to the writer pool, so
+    saving a frame (DNG, make_image, encoding) overlaps the exposure of the next.
+    The semaphore bounds the requests held in RAM - if the writers fall behind, 
+    capture waits for a buffer rather than the Pi running out of memory.
+    """
+    num_digits = len(str(args.num_of_images))
+    
+    if not update_controls(picam2, args, frame_duration):
+        raise Exception("Image controls not applied within max attempts")
+    
+    free_slots = threading.BoundedSemaphore(frames_in_flight)
+    sensor_timestamps = []
+    futures = []
+    with ThreadPoolExecutor(max_workers=args.pipeline_workers) as writers:
+        for i in range(1, args.num_of_images + 1):
+            free_slots.acquire()
+            capture_start_time = time.time()
+            r = picam2.capture_request()
+            capture_duration = time.time() - capture_start_time
+            if not r:
+                free_slots.release()
+                logging.warning(f"Image {i} failed to capture!")
+                continue
+            sensor_timestamp = r.get_metadata().get("SensorTimestamp")
+            sensor_timestamps.append(sensor_timestamp)
+            logging.info(f"Image {i} captured at t = : {get_relative_time(start_time)} (SensorTimestamp = {sensor_timestamp})")
+            
+            future = writers.submit(write_main_run_frame, r, i, args, num_digits, start_time,
+                                    capture_duration=capture_duration, submitted_time=time.time())
+            future.add_done_callback(lambda _: free_slots.release())
+            futures.append(future)
+    
+    # Re-raise any writer exception now that all frames have been handled
+    for future in futures:
+        future.result()
+    
+    log_frame_interval_statistics(sensor_timestamps, frame_duration)
+    logging.info(f"{args.num_of_images} images saved to directory.")
+    return 1
+
+def select_array_channel(array, picam2, colour):
+    """
+    Picamera2 names formats after libcamera, so a "BGR888" array is ordered [R, G, B] 
+    and an "RGB888" array [B, G, R]. This matches the channel make_image would give.
+    """
+    main_format = picam2.camera_config["main"]["format"]
+    channel_order = "rgb" if main_format in ("BGR888", "XBGR8888") else "bgr"
+    return array[:, :, channel_order.index(colour)]
+
+
+def compute_mean_and_variance(pixel_sum, pixel_sum_of_squares, frame_count):
+    """
+    Unbiased per-pixel variance from the running sums. Rounding in the float32
+    accumulators can give tiny negative variances for constant pixels, so clip at 0.
+    """
+    mean = pixel_sum / frame_count
+    if frame_count < 2:
+        return mean, np.zeros_like(mean)
+    variance = (pixel_sum_of_squares - frame_count * mean**2) / (frame_count - 1)
+    np.clip(variance, 0, None, out=variance)
+    return mean, variance
+
+
+def take_main_run_images_reduced(picam2, args, frame_duration, start_time):
+    """
+    Rather than saving every frame, the chosen colour channel is accumulated into
+    float32 running sums straight from the camera buffer (MappedArray, no copy).
+    Only the per-pixel mean and variance are saved, stacked in one .npy with the
+    number of frames used in its filename.
+    """
+    num_digits = len(str(args.num_of_images))
+    
+    if not update_controls(picam2, args, frame_duration):
+        raise Exception("Image controls not applied within max attempts")
+    
+    pixel_sum = None
+    pixel_sum_of_squares = None
+    squared_frame = None
+    frame_count = 0
+    for i in range(1, args.num_of_images + 1):
+        print(f"Capturing image {i}")
+        r = picam2.capture_request()
+        if not r:
+            logging.warning(f"Image {i} failed to capture!")
+            continue
+        try:
+            logging.info(f"Image {i} captured at t = : {get_relative_time(start_time)} (SensorTimestamp = {r.get_metadata().get('SensorTimestamp')})")
+            if args.save_dng:
+                r.save_dng(f"{args.directory_name}/image_{i:0{num_digits}d}.dng")
+            
+            with MappedArray(r, "main") as mapped_frame:
+                channel = select_array_channel(crop_array(mapped_frame.array, args.crop_window), picam2, args.colour)
+                if pixel_sum is None:
+                    pixel_sum = np.zeros(channel.shape, dtype=np.float32)
+                    pixel_sum_of_squares = np.zeros(channel.shape, dtype=np.float32)
+                    squared_frame = np.empty(channel.shape, dtype=np.float32)
+                pixel_sum += channel
+                np.square(channel, out=squared_frame, dtype=np.float32)
+                pixel_sum_of_squares += squared_frame
+            frame_count += 1
+        finally:
+            r.release()
+    
+    if frame_count == 0:
+        raise Exception("No images captured to reduce")
+    
+    mean, variance = compute_mean_and_variance(pixel_sum, pixel_sum_of_squares, frame_count)
+    filename = f"main_run_reduced_frames_{frame_count}_cslID_{args.camera_settings_link_id}.npy"
+    np.save(f"{args.directory_name}/{filename}", np.stack((mean, variance)).astype(np.float32))
+    stream_saved_file(args, f"{args.directory_name}/{filename}")
+    logging.info(f"{frame_count} images reduced to mean and variance at t = : {get_relative_time(start_time)}")
+    return 1
+
+class FrameStreamer:
+    """
+    Writes frames to a tar stream (compressed with the transfer codec) as soon as
+    they are saved, so the backend can read and store them while the capture is
+    still running. Writer threads in pipelined mode share the stream, hence the lock.
+    Each member's sha256 is in its header, so the backend can verify it.
+    
+    When streaming to stdout, the script's prints are moved to stderr so they do
+    not corrupt the archive.
+    
+    If the backend stops reading (the stream breaks), the capture carries on
+    saving frames, and finish_transfer packages them into a tarball with a
+    manifest - the backend then transfers the frames it doesn't hold from that.
+    """
+    def __init__(self, stream_target, transfer_codec="none", transfer_codec_level=None):
+        if stream_target == "-":
+            self.raw_stream = sys.stdout.buffer
+            sys.stdout = sys.stderr
+        else:
+            self.raw_stream = open(stream_target, "wb") # Blocks until the FIFO has a reader
+        self.stream = CompressedWriter(self.raw_stream, transfer_codec, transfer_codec_level)
+        hostname = socket.gethostname()
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        self.archive_name = f"{hostname}_{timestamp}_video_frames"
+        self.lock = threading.Lock()
+        self.tar = tarfile.open(fileobj=self.stream, mode="w|", format=tarfile.PAX_FORMAT)
+        self.closed = False
+        self.broken = False
+    
+    def add(self, file_path, frame_metadata=None):
+        with self.lock:
+            if self.broken:
+                return
+            tarinfo = self.tar.gettarinfo(file_path, f"{self.archive_name}/{os.path.basename(file_path)}")
+            add_frame_metadata_to_tarinfo(tarinfo, frame_metadata)
+            with open(file_path, "rb") as file:
+                file_bytes = file.read()
+            tarinfo.pax_headers[FRAME_SHA256_PAX_KEY] = hashlib.sha256(file_bytes).hexdigest()
+            try:
+                self.tar.addfile(tarinfo, io.BytesIO(file_bytes))
+                self.stream.flush()
+            except OSError as e:
+                self.break_stream(e)
+    
+    def break_stream(self, error):
+        """
+        Stops streaming - called with the lock held.
+        """
+        self.broken = True
+        if self.raw_stream is sys.__stdout__.buffer: # stderr goes down the same SSH channel
+            sys.stdout = sys.stderr = open(os.devnull, "w")
+        logging.warning(f"Frame stream broken ({error}), frames will be packaged into a tarball instead")
+    
+    def close(self):
+        """
+        Also called on failure, so the backend still receives a valid archive
+        of the frames saved before the error.
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            try:
+                self.tar.close() # Writes the end of archive blocks
+                self.stream.close()
+                if self.stream.codec != "none":
+                    logging.info(f"{self.stream.codec} compression took {self.stream.compression_time:.2f} s of CPU time")
+            except OSError as e:
+                if not self.broken:
+                    self.break_stream(e)
+            finally:
+                if self.raw_stream is not sys.__stdout__.buffer:
+                    try:
+                        self.raw_stream.close()
+                    except OSError:
+                        pass
+
+
+def open_frame_streamer(args):
+    """
+    None when not streaming - frames are packaged into a tarball at the end instead.
+    """
+    if args.stream_target is None:
+        return None
+    return FrameStreamer(args.stream_target, args.transfer_codec, args.transfer_codec_level)
+
+
+def add_frame_metadata_to_tarinfo(tarinfo, frame_metadata):
+    if frame_metadata:
+        tarinfo.pax_headers = {FRAME_METADATA_PAX_KEY: json.dumps(frame_metadata, separators=(",", ":"))}
+
+
+def stream_saved_file(args, file_path, frame_metadata=None):
+    """
+    The frame metadata is also kept for the tarball, when not streaming.
+    """
+    if frame_metadata is not None:
+        args.frame_metadata[os.path.basename(file_path)] = frame_metadata
+    if args.frame_streamer is not None:
+        args.frame_streamer.add(file_path, frame_metadata)
+
+
+def finish_transfer(args, start_time):
+    """
+    Frames already streamed only need the archive closing, otherwise (or if the
+    stream broke) the tarball is built now that all frames are saved.
+    """
+    if args.frame_streamer is not None:
+        args.frame_streamer.close()
+        if not args.frame_streamer.broken:
+            logging.info(f"Frame stream closed at t = {get_relative_time(start_time)}")
+            return 0
+    return package_images_for_transfer(args.directory_name, start_time, args.frame_metadata,
+                                       args.transfer_codec, args.transfer_codec_level)
+
+
 def exclude_log_and_raw(tarinfo):
     """
     dng files can be chosen to be saved, but will not be transferred to
@@ -278,10 +735,12 @@ def exclude_log_and_raw(tarinfo):
     """
     if tarinfo.name.endswith((".log", ".dng")):
         return None
+    if tarinfo.name.endswith((".manifest.json", *ARCHIVE_EXTENSIONS.values())): # From an earlier packaging of this directory
+        return None
     return tarinfo
 
 
-def package_images_for_transfer(directory_path, start_time):
+def package_images_for_transfer(directory_path, start_time, frame_metadata=None, transfer_codec="none", transfer_codec_level=None):
     """
     - Should check if all images taken?
     
@@ -291,14 +750,46 @@ def package_images_for_transfer(directory_path, start_time):
     hostname = socket.gethostname()
     timestamp = time.strftime("%Y%m%d-%H%M%S") # Needs a unique name to not be overwritten on the backend
     archive_name = f"{hostname}_{timestamp}_video_frames"
-    archive_location = f"{directory_path}/{archive_name}.tar"  # Full path to save the tar file
+    archive_location = f"{directory_path}/{archive_name}{ARCHIVE_EXTENSIONS[transfer_codec]}"  # Full path to save the tar file
+    frame_metadata = frame_metadata or {}
+    
+    def add_frame_metadata(tarinfo):
+        if (tarinfo := exclude_log_and_raw(tarinfo)) is not None:
+            add_frame_metadata_to_tarinfo(tarinfo, frame_metadata.get(os.path.basename(tarinfo.name)))
+        return tarinfo
     
-    with tarfile.open(archive_location, "w") as tar:
-        tar.add(directory_path, archive_name, filter=exclude_log_and_raw)
+    # The name lets tarfile skip the archive itself when adding the directory
+    with open(archive_location, "wb") as archive_file, \
+         CompressedWriter(archive_file, transfer_codec, transfer_codec_level) as compressed_file, \
+         tarfile.open(archive_location, "w|", fileobj=compressed_file, format=tarfile.PAX_FORMAT) as tar:
+        tar.add(directory_path, archive_name, filter=add_frame_metadata)
     logging.info(f"Tar archive created for {hostname} at t = {get_relative_time(start_time)}")
+    write_transfer_manifest(archive_location, transfer_codec)
+    logging.info(f"Transfer manifest written at t = {get_relative_time(start_time)}")
     return 0
 
 
+def write_transfer_manifest(archive_location, transfer_codec="none"):
+    """
+    Lists each file in the tarball with its sha256 and the offset of its header
+    in the (uncompressed) tar, so the backend can verify each frame and resume a
+    failed transfer from the first frame it does not hold yet.
+    """
+    members = []
+    with open(archive_location, "rb") as archive_file, \
+         tarfile.open(fileobj=open_decompressed_stream(archive_file, transfer_codec), mode="r|") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            members.append({"name": member.name,
+                            "offset": member.offset,
+                            "size": member.size,
+                            "sha256": hashlib.sha256(tar.extractfile(member).read()).hexdigest()})
+    with open(f"{archive_location}.manifest.json", "w") as manifest_file:
+        json.dump({"archive": os.path.basename(archive_location), "transfer_codec": transfer_codec,
+                   "members": members}, manifest_file)
+
+
 def main_run(args):
     try:
         start_time = time.time()
@@ -307,8 +798,11 @@ def main_run(args):
             setup_logging(args.directory_name)
             
         picam2 = Picamera2()
-        capture_config = picam2.create_still_configuration(raw={}, display=None)
-        picam2.configure(capture_config)
+        if args.pipeline_workers and not (args.print_info or args.reduce):
+            frames_in_flight = configure_camera_for_pipelining(picam2, args)
+        else:
+            capture_config = picam2.create_still_configuration(raw={}, display=None)
+            picam2.configure(capture_config)
     
         if args.print_info:
             print("Trying to print info")
@@ -316,28 +810,22 @@ def main_run(args):
             logging.info(f"Available controls: {picam2.camera_controls}")
             return 0
         
+        check_crop_window(picam2, args)
+        args.frame_streamer = open_frame_streamer(args)
         frame_duration = convert_framerate_to_frame_duration(args.frame_rate)
         
-        controls_dict = {
-            "AnalogueGain": args.gain,
-            "ColourGains": (1.0, 1.0),
-            "NoiseReductionMode": 0,
-            "Contrast": 1.0,
-            "Saturation": 1.0,
-            "Sharpness": 1.0,
-            "FrameDurationLimits": (frame_duration, frame_duration),
-            "ExposureTime": int(frame_duration / 2)
-        }
-        if args.lens_position is not None:
-            controls_dict["AfMode"] = controls.AfModeEnum.Manual
-            controls_dict["LensPosition"] = args.lens_position
-            
+        controls_dict = build_controls_dict(args, frame_duration, gain=args.gain)
         picam2.set_controls(controls_dict)
         picam2.start()
         logging.info("Camera started at t = :", get_relative_time(start_time))
-        ret = take_main_run_images(picam2, args, frame_duration, start_time)
+        if args.reduce:
+            ret = take_main_run_images_reduced(picam2, args, frame_duration, start_time)
+        elif args.pipeline_workers:
+            ret = take_main_run_images_pipelined(picam2, args, frame_duration, start_time, frames_in_flight)
+        else:
+            ret = take_main_run_images(picam2, args, frame_duration, start_time)
         if ret:
-            package_images_for_transfer(args.directory_name, start_time)
+            finish_transfer(args, start_time)
         print("Image capture complete")
         return 0
     
@@ -347,52 +835,127 @@ def main_run(args):
     finally:
         if 'picam2' in locals():
             picam2.stop()
+        if getattr(args, "frame_streamer", None) is not None:
+            args.frame_streamer.close()
 
 
-def take_test_run_images(picam2, args, frame_duration, start_time):
+def compute_saturation_statistics(array, picam2, saturation_threshold, percentiles=(50, 99, 99.9)):
+    """
+    Per-channel statistics of an 8 bit frame (or window of one). A histogram is
+    used so the percentiles come from a cumulative sum rather than a sort.
+    """
+    statistics = {}
+    for colour, channel_name in zip("rgb", ("red", "green", "blue")):
+        channel = select_array_channel(array, picam2, colour)
+        histogram = np.bincount(channel.ravel(), minlength=256)
+        cumulative_histogram = np.cumsum(histogram)
+        pixel_count = int(cumulative_histogram[-1])
+        saturated_pixels = int(histogram[saturation_threshold:].sum())
+        statistics[channel_name] = {
+            "saturated_pixels": saturated_pixels,
+            "saturated_fraction": saturated_pixels / pixel_count,
+            "max": int(np.flatnonzero(histogram)[-1]),
+            "mean": float(np.dot(histogram, np.arange(histogram.size)) / pixel_count),
+            "percentiles": {str(p): int(np.searchsorted(cumulative_histogram, p / 100 * pixel_count)) for p in percentiles},
+        }
+    return statistics
+
+
+def save_saturation_statistics(args, image_statistics):
+    """
+    One JSON for the whole sweep, added to the transfer like the images.
+    """
+    file_path = f"{args.directory_name}/test_run_saturation_statistics.json"
+    with open(file_path, "w") as file:
+        json.dump({"saturation_threshold": args.saturation_threshold,
+                   "roi": args.saturation_roi,
+                   "images": image_statistics}, file)
+    stream_saved_file(args, file_path)
+
 
+def capture_request_once_gain_settles(picam2, gain, args):
+    """
+    Returns the first request whose metadata shows the AnalogueGain within
+    tolerance of the requested gain and the DigitalGain back within tolerance
+    of 1.0 (it compensates while the analogue gain changes), along with the
+    number of frames discarded. Returns None for the request if the gain has not
+    settled within args.settle_wait_time.
+    """
+    deadline = time.time() + args.settle_wait_time
+    frames_discarded = 0
+    while time.time() < deadline:
+        r = picam2.capture_request()
+        metadata = Metadata(r.get_metadata())
+        if (abs(metadata.AnalogueGain - gain) <= args.analogue_gain_tolerance and
+            abs(metadata.DigitalGain - 1.0) <= args.digital_gain_tolerance):
+            return r, frames_discarded
+        r.release()
+        frames_discarded += 1
+    return None, frames_discarded
+
+
+def take_test_run_images(picam2, args, frame_duration, start_time):
+    """
+    The camera keeps streaming through the gain sweep - each gain is applied
+    in place and the first frame captured at that gain is kept.
+    """
     gains = args.gain_list
     num_of_images = len(gains)
     num_digits = len(str(num_of_images))
-
-    # frames = [] 
-    # successful_capture = [] # list of all cs_ids of captured images
+    
+    if not picam2.started:
+        picam2.start()
+    
+    settle_times = []
+    image_statistics = []
     for count, gain in enumerate(gains, start=1):
         print(f"Capturing image {count}")
         logging.info(f"Image {count} capture started at t = : {get_relative_time(start_time)}")
         
+        settle_start_time = time.time()
         picam2.set_controls({"AnalogueGain": gain})
-        picam2.start()
-
-        # Found this many discards was needed for digital gain to settle towards 1.0
-        for _ in range(10):
-            discarded_frame = picam2.capture_request()
-            discarded_frame.release()
-        
-        logging.info(f"Image {count} Metadata: {picam2.capture_metadata()}")
-        r = picam2.capture_request()
+        r, frames_discarded = capture_request_once_gain_settles(picam2, gain, args)
+        settle_time = get_relative_time(settle_start_time)
         if not r:
-            logging.warning(f"Image {count} failed to capture!")
+            logging.warning(f"Image {count} failed to capture - gain {gain} did not settle within {args.settle_wait_time} s")
             continue
-
-        if args.save_dng:
-            raw_path = f"{args.directory_name}/image_{count:0{num_digits}d}.dng"
-            r.save_dng(raw_path)
+        settle_times.append(settle_time)
+        logging.info(f"Gain {gain} settled after {settle_time:.3f} s ({frames_discarded} frames discarded)")
+        logging.info(f"Image {count} Metadata: {r.get_metadata()}")
+        request_metadata = r.get_metadata()
         
-        # Convert the captured raw image data into a frame that can be processed.
-        frame = r.make_image("main")
+        try:
+            if args.save_dng:
+                raw_path = f"{args.directory_name}/image_{count:0{num_digits}d}.dng"
+                r.save_dng(raw_path)
+            
+            if args.saturation_roi is not None:
+                with MappedArray(r, "main") as mapped_frame:
+                    channel_statistics = compute_saturation_statistics(crop_array(mapped_frame.array, args.saturation_roi),
+                                                                       picam2, args.saturation_threshold)
+                image_statistics.append({"cs_id": args.cs_id_array[count-1], "gain": gain,
+                                         "analogue_gain": r.get_metadata().get("AnalogueGain"),
+                                         "channels": channel_statistics})
+            
+            # Convert the captured raw image data into a frame that can be processed.
+            encode_start_time = time.time()
+            frame = None if args.statistics_only else r.make_image("main")
+        finally:
+            r.release() # The camera keeps streaming, so buffers are returned straight away
+        if frame is None:
+            continue
         image = process_frame(frame, args)
         filename = f"test_run_image_cslID_{args.cs_id_array[count-1]}.{args.format}"
         image.save(f"{args.directory_name}/{filename}", format=args.format)
-        r.release()
-        picam2.stop() # ready for controls to be updated again
-    
-    # Images processed after all of the capturing is complete
-    # for i, frame in enumerate(frames):
-    #     image = process_frame(frame, args)
-    #     filename = f"test_run_image_cslID_{successful_capture[i]}.{args.format}"
-    #     image.save(f"{args.directory_name}/{filename}", format=args.format)
+        frame_metadata = build_frame_metadata(count, request_metadata, settle_duration=settle_time,
+                                              encode_duration=time.time() - encode_start_time)
+        stream_saved_file(args, f"{args.directory_name}/{filename}", frame_metadata)
     
+    if args.saturation_roi is not None:
+        save_saturation_statistics(args, image_statistics)
+    if settle_times:
+        logging.info(f"Gain settle times (s) - mean: {np.mean(settle_times):.3f}, max: {np.max(settle_times):.3f}, " +
+                     f"total: {np.sum(settle_times):.3f} over {len(settle_times)} gains")
     logging.info(f"{num_of_images} images saved to directory.")
     
     return 1
@@ -407,29 +970,18 @@ def test_run(args):
         picam2 = Picamera2()
         capture_config = picam2.create_still_configuration(raw={}, display=None)
         picam2.configure(capture_config)
+        check_crop_window(picam2, args)
         
         frame_duration = convert_framerate_to_frame_duration(args.frame_rate)
         # Gain control moved to inside take_test_run_images function
-        controls_dict = {
-            "ColourGains": (1.0, 1.0),
-            "NoiseReductionMode": 0,
-            "Contrast": 1.0,
-            "Saturation": 1.0,
-            "Sharpness": 1.0,
-            "FrameDurationLimits": (frame_duration, frame_duration),
-            "ExposureTime": int(frame_duration / 2)
-        }
-        
-        if args.lens_position is not None:
-            controls_dict["AfMode"] = controls.AfModeEnum.Manual
-            controls_dict["LensPosition"] = args.lens_position
-        
+        controls_dict = build_controls_dict(args, frame_duration)
         picam2.set_controls(controls_dict)
+        args.frame_streamer = open_frame_streamer(args)
         
-        logging.info("Camera started at t = :", get_relative_time(start_time))
+        logging.info(f"Camera started at t = : {get_relative_time(start_time)}")
         ret = take_test_run_images(picam2, args, frame_duration, start_time)
         if ret:
-            package_images_for_transfer(args.directory_name, start_time)
+            finish_transfer(args, start_time)
         print("Image capture complete")
         return 0
     
@@ -439,13 +991,19 @@ def test_run(args):
     finally:
         if 'picam2' in locals():
             picam2.stop()
+        if getattr(args, "frame_streamer", None) is not None:
+            args.frame_streamer.close()
 
 def main():
+    """
+    The exit status is non-zero if the run failed - needed when streaming, where
+    the last line of stdout cannot be checked.
+    """
     args = parse_arguments()
     if args.command == 'main_run':
-        main_run(args)
+        return main_run(args)
     if args.command == 'test_run':
-        test_run(args)
+        return test_run(args)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,44 @@
+"""
+Loading what a camera analysis reads of the database takes one query, and gives
+the same values as the getters (a session per value) did. The scratch rows are
+those of benchmarks/analysis_context_benchmark.py, deleted after.
+"""
+import pytest
+
+from benchmarks.analysis_context_benchmark import (QueryCounter, add_scratch_beam_run, camera_values, camera_values_with_getters,
+                                                   check_equal, delete_scratch_rows, source_params_with_getters)
+from src.database.CRUD import CRISP_database_interaction as cdi
+from src.database.models import BeamRun, Camera, CameraAnalysis, Setup
+from src.homography_pinpointing import AbstractCamera
+from src.single_camera_analysis import source_params_from_database
+
+
+@pytest.fixture(scope="module")
+def scratch_beam_run(database_engine):
+    rows = add_scratch_beam_run(num_of_cameras=2, num_of_images=10)
+    yield rows
+    delete_scratch_rows(rows)
+
+
+def test_source_params_from_database_takes_one_query(scratch_beam_run):
+    camera_analysis_id = scratch_beam_run[CameraAnalysis][0]
+    with QueryCounter() as query_counter:
+        params = source_params_from_database(camera_analysis_id)
+    assert query_counter.num_of_queries == 1
+    check_equal("source_params_from_database", params, source_params_with_getters(camera_analysis_id))
+
+
+def test_cameras_from_beam_run_contexts_take_one_query(scratch_beam_run):
+    beam_run_id, setup_id = scratch_beam_run[BeamRun][0], scratch_beam_run[Setup][0]
+    with QueryCounter() as query_counter:
+        contexts = cdi.get_camera_analysis_contexts_by_beam_run_id(beam_run_id, with_average_image=False)
+        cameras = [AbstractCamera.setup(context.camera_id, context.setup_id, context.camera_setup) for context in contexts]
+    assert query_counter.num_of_queries == 1
+    for camera, camera_id in zip(cameras, scratch_beam_run[Camera], strict=True):
+        check_equal("AbstractCamera", camera_values(camera), camera_values_with_getters(camera_id, setup_id))
+
+
+def test_abstract_camera_setup_takes_one_query(scratch_beam_run):
+    with QueryCounter() as query_counter:
+        AbstractCamera.setup(scratch_beam_run[Camera][0], scratch_beam_run[Setup][0])
+    assert query_counter.num_of_queries == 1
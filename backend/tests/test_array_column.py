@@ -0,0 +1,62 @@
+"""
+The NumpyArray column's encoding, and the unpickler converting the pickled
+arrays left from before it - no database needed.
+"""
+import io
+import os
+import pickle
+import numpy as np
+import pytest
+
+from src.database.array_column import ARRAY_MAGIC, DATA_ALIGNMENT, ArrayUnpickler, decode_array, encode_array
+
+ARRAYS = {
+    "average image": np.arange(4 * 6 * 3, dtype=np.float64).reshape(4, 6, 3),
+    "homography": np.eye(3) * 1.5,
+    "uint16 frame": np.arange(12, dtype=np.uint16).reshape(3, 4),
+    "big endian": np.arange(5, dtype=">i4"),
+    "scalar": np.array(2.5, dtype=np.float32),
+    "empty": np.zeros((0, 3)),
+    "not contiguous": np.arange(20.0).reshape(4, 5)[:, ::2],
+}
+
+
+@pytest.mark.parametrize("array", ARRAYS.values(), ids=ARRAYS.keys())
+def test_round_trip(array):
+    data = encode_array(array)
+    assert data.startswith(ARRAY_MAGIC)
+    decoded = decode_array(data)
+    assert decoded.dtype == array.dtype and decoded.shape == array.shape
+    assert np.array_equal(decoded, array)
+    assert not decoded.flags.writeable # A view of the bytes, not a copy
+    assert (len(data) - decoded.nbytes) % DATA_ALIGNMENT == 0 # The data starts aligned
+
+
+def test_lists_are_stored_as_arrays():
+    assert np.array_equal(decode_array(encode_array([[1.0, 2.0], [3.0, 4.0]])), np.array([[1.0, 2.0], [3.0, 4.0]]))
+
+
+def test_only_arrays_of_numbers_are_encoded():
+    with pytest.raises(TypeError, match="Only arrays of numbers"):
+        encode_array(np.array([{"a": 1}], dtype=object))
+    with pytest.raises(ValueError, match="Not an encoded array"):
+        decode_array(pickle.dumps(np.eye(3)))
+
+
+@pytest.mark.parametrize("array", ARRAYS.values(), ids=ARRAYS.keys())
+def test_pickled_arrays_are_unpickled(array):
+    unpickled = ArrayUnpickler(io.BytesIO(pickle.dumps(array))).load()
+    assert np.array_equal(unpickled, array)
+    assert unpickled.dtype == pickle.loads(pickle.dumps(array)).dtype # As numpy unpickles it
+
+
+class RunsCode:
+    def __reduce__(self):
+        return (os.system, ("echo unpickled",))
+
+
+@pytest.mark.parametrize("value", [RunsCode(), {"a": 1}.items, np.array([RunsCode()], dtype=object)],
+                         ids=["os.system", "builtins", "object array"])
+def test_other_globals_are_rejected(value):
+    with pytest.raises(pickle.UnpicklingError, match="is not allowed in a pickled array"):
+        ArrayUnpickler(io.BytesIO(pickle.dumps(value))).load()
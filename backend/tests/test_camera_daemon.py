@@ -0,0 +1,105 @@
+"""
+The camera daemon's replies, run with fake_picamera2 (camera_daemon.py --fake)
+as it is on a Pi - one daemon serves every command, as it does for a Pi's runs.
+"""
+import json
+import os
+import subprocess
+import sys
+import numpy as np
+import pytest
+
+SCRIPT_DIRECTORY = os.path.join(os.path.dirname(__file__), "..", "src") # Run from here, as from the Pi's home directory
+FRAME_RATE = "30" # Fast runs - the fake waits out each frame duration
+
+
+@pytest.fixture(scope="module")
+def daemon(tmp_path_factory):
+    log_directory = tmp_path_factory.mktemp("camera_daemon")
+    with open(log_directory / "stderr", "w") as stderr:
+        process = subprocess.Popen([sys.executable, "camera_daemon.py", "--fake", "-log", str(log_directory / "camera_daemon.log")],
+                                   cwd=SCRIPT_DIRECTORY, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr, text=True)
+        try:
+            assert json.loads(process.stdout.readline())["status"] == "ready"
+            yield process
+            assert send(process, "shutdown")["status"] == "ok"
+            assert process.wait(timeout=30) == 0
+        finally:
+            if process.poll() is None:
+                process.kill()
+
+
+request_ids = iter(range(1, 1000))
+
+def send(daemon, command: str, **fields) -> dict:
+    request_id = next(request_ids)
+    daemon.stdin.write(json.dumps({"id": request_id, "command": command, **fields}) + "\n")
+    daemon.stdin.flush()
+    reply = json.loads(daemon.stdout.readline())
+    assert reply["id"] == request_id
+    return reply
+
+
+def assert_packaged(directory, expected_filenames: list[str]):
+    """
+    The run's files, and the tarball and manifest it is transferred as.
+    """
+    filenames = sorted(os.listdir(directory))
+    assert [filename for filename in filenames if filename.endswith((".jpeg", ".npy", ".json")) and "manifest" not in filename] \
+        == sorted(expected_filenames)
+    assert sum(filename.endswith("_video_frames.tar") for filename in filenames) == 1
+    assert sum(filename.endswith("_video_frames.tar.manifest.json") for filename in filenames) == 1
+
+
+def test_still(daemon, tmp_path):
+    reply = send(daemon, "still", path=str(tmp_path / "still"), gain=2.0)
+    assert reply["status"] == "ok"
+    assert reply["result"]["path"] == str(tmp_path / "still.jpeg")
+    assert reply["result"]["settle_frames"] >= 0
+    with open(tmp_path / "still.jpeg", "rb") as file:
+        assert file.read(3) == b"\xff\xd8\xff"
+
+
+@pytest.mark.parametrize("run_arguments", [[], ["-pw", "2"]], ids=["plain", "pipelined"])
+def test_main_run(daemon, tmp_path, run_arguments):
+    directory = tmp_path / "main_run"
+    reply = send(daemon, "main_run", argv=["-dir", str(directory), "-fr", FRAME_RATE, "-log",
+                                           "main_run", "-num", "3", "-g", "2", "-csl", "7", *run_arguments])
+    assert reply["status"] == "ok", reply.get("error")
+    assert reply["result"]["directory"] == str(directory)
+    assert reply["result"]["stream_broken"] is False
+    assert_packaged(directory, [f"main_run_image_{i}_cslID_7.jpeg" for i in range(1, 4)])
+    with open(directory / "metadata.log") as log:
+        assert "Beginning to log..." in log.read() # The run's own log, as the script writes
+
+
+def test_main_run_reduced(daemon, tmp_path):
+    directory = tmp_path / "main_run"
+    reply = send(daemon, "main_run", argv=["-dir", str(directory), "-fr", FRAME_RATE, "-c", "b",
+                                           "main_run", "-num", "3", "-g", "2", "-csl", "7", "-red"])
+    assert reply["status"] == "ok", reply.get("error")
+    assert_packaged(directory, ["main_run_reduced_frames_3_cslID_7.npy"])
+    assert not os.path.exists(directory / "metadata.log") # Without -log
+    reduced_frames = np.load(directory / "main_run_reduced_frames_3_cslID_7.npy")
+    assert reduced_frames.shape[0] == 2 # Stacked mean and variance
+
+
+def test_test_run(daemon, tmp_path):
+    directory = tmp_path / "test_run"
+    reply = send(daemon, "test_run", argv=["-dir", str(directory), "-fr", FRAME_RATE,
+                                           "test_run", "--gain_list", "[1.0, 2.0]", "--cs_id_array", "[5, 6]",
+                                           "-roi", "10", "10", "100", "100"])
+    assert reply["status"] == "ok", reply.get("error")
+    assert_packaged(directory, ["test_run_image_cslID_5.jpeg", "test_run_image_cslID_6.jpeg",
+                                "test_run_saturation_statistics.json"])
+    with open(directory / "test_run_saturation_statistics.json") as file:
+        saturation_statistics = json.load(file)
+    assert saturation_statistics["roi"] == [10, 10, 100, 100]
+    assert [(image["cs_id"], image["gain"]) for image in saturation_statistics["images"]] == [(5, 1.0), (6, 2.0)]
+
+
+def test_invalid_run_is_an_error_reply(daemon, tmp_path):
+    reply = send(daemon, "main_run", argv=["-dir", str(tmp_path), "main_run"]) # No -num or -csl
+    assert reply["status"] == "error"
+    assert "-num/--num_of_images" in reply["error"]
+    assert send(daemon, "ping")["status"] == "ok" # Still serving
@@ -0,0 +1,61 @@
+"""
+The saved distortion calibration photos are listed with their bytes read from
+the photo store (the rows hold only the hash).
+"""
+import base64
+from datetime import datetime, timezone
+import cv2
+import numpy as np
+import pytest
+from fastapi import Response
+from sqlmodel import Session, delete
+
+from src.database.models import Camera, CameraSettingsLink, CameraSetupLink, Photo, Settings, Setup
+from src.photo_store import photo_store
+
+
+@pytest.fixture
+def setup_camera_id(database_engine, tmp_path, monkeypatch):
+    monkeypatch.setattr(photo_store, "directory", str(tmp_path))
+    with Session(database_engine) as session:
+        setup = Setup(name="distortion_calibration_test", date_created=datetime.now(timezone.utc),
+                      date_last_edited=datetime.now(timezone.utc))
+        camera = Camera(username="distortion_calibration_test", ip_address="0.0.0.0", password="", model="test")
+        settings = Settings(frame_rate=1, lens_position=0.0, gain=-2.0)
+        session.add_all([setup, camera, settings])
+        session.flush()
+        camera_settings_link = CameraSettingsLink(camera_id=camera.id, settings_id=settings.id)
+        session.add(camera_settings_link)
+        session.flush()
+        setup_camera = CameraSetupLink(camera_id=camera.id, setup_id=setup.id,
+                                       distortion_calibration_camera_settings_link=camera_settings_link.id)
+        session.add(setup_camera)
+        session.commit()
+        ids = setup.id, camera.id, settings.id, camera_settings_link.id, setup_camera.id
+    yield ids[-1]
+    setup_id, camera_id, settings_id, camera_settings_link_id, setup_camera_id = ids
+    with Session(database_engine) as session:
+        session.exec(delete(CameraSetupLink).where(CameraSetupLink.id == setup_camera_id))
+        session.exec(delete(Photo).where(Photo.camera_settings_link_id == camera_settings_link_id))
+        session.exec(delete(CameraSettingsLink).where(CameraSettingsLink.id == camera_settings_link_id))
+        session.exec(delete(Settings).where(Settings.id == settings_id))
+        session.exec(delete(Camera).where(Camera.id == camera_id))
+        session.exec(delete(Setup).where(Setup.id == setup_id))
+        session.commit()
+
+
+def test_listed_photos_have_their_bytes(setup_camera_id):
+    from src.database.CRUD import CRISP_database_interaction as cdi
+    from src.routers.photo import get_all_distortion_calibration_images
+
+    camera_settings_link_id = cdi.get_setup_camera_by_id(setup_camera_id).distortion_calibration_camera_settings_link
+    jpeg = cv2.imencode(".jpg", np.zeros((8, 8, 3), np.uint8))[1].tobytes()
+    saved_base64 = base64.b64encode(jpeg) # As save_distortion_image_to_database is sent it
+    photo_ids = [cdi.add_photo(camera_settings_link_id, photo)["id"] for photo in (saved_base64, jpeg)]
+
+    response = Response()
+    photos = get_all_distortion_calibration_images(setup_camera_id, response)
+    assert response.headers["Content-Range"] == "2"
+    assert [photo.id for photo in photos] == photo_ids
+    assert all(photo.camera_settings_link_id == camera_settings_link_id for photo in photos)
+    assert all(base64.b64decode(photo.photo) == jpeg for photo in photos)
@@ -0,0 +1,118 @@
+"""
+Frame stacks in a tmp dir - appending frames across chunks, the frames.json
+manifest a failed transfer resumes from, reading frames back (or decoding the
+photo for those not held) and evicting the least recently written stacks.
+"""
+import os
+import time
+import cv2
+import numpy as np
+import pytest
+
+from src import frame_stack_store
+from src.frame_stack_store import (FrameStack, FrameStackIngest, FrameStackWriter, collect_frame_stack_garbage,
+                                   evict_frame_stacks, get_frame_stack_directory, list_frame_stacks, load_frames,
+                                   read_frame_stack_manifest)
+
+CHUNK_SIZE = 2
+FRAME_SHAPE = (4, 6, 3)
+
+
+def make_frame(value: int) -> np.ndarray:
+    return np.full(FRAME_SHAPE, value, np.uint8)
+
+
+def test_frames_are_read_back_across_chunks(tmp_path):
+    with FrameStackWriter(1, str(tmp_path), CHUNK_SIZE) as writer:
+        for photo_id in range(10, 15):
+            writer.append(photo_id, make_frame(photo_id))
+    assert sorted(os.listdir(get_frame_stack_directory(1, str(tmp_path)))) == \
+        ["chunk_00000.npy", "chunk_00001.npy", "chunk_00002.npy", "frames.json"]
+
+    frame_stack = FrameStack.open(1, str(tmp_path))
+    assert len(frame_stack) == 5 and 14 in frame_stack and 15 not in frame_stack
+    for photo_id in range(10, 15):
+        assert np.array_equal(frame_stack.get_frame(photo_id), make_frame(photo_id))
+    assert frame_stack.get_frame(15) is None
+    assert not frame_stack.get_frame(10).flags.writeable
+    assert FrameStack.open(2, str(tmp_path)) is None # No stack
+
+
+def test_manifest_is_written_as_each_chunk_fills(tmp_path):
+    stack_directory = get_frame_stack_directory(1, str(tmp_path))
+    writer = FrameStackWriter(1, str(tmp_path), CHUNK_SIZE)
+    for photo_id in range(10, 13):
+        writer.append(photo_id, make_frame(photo_id))
+    # The transfer fails before the third frame is recorded
+    assert read_frame_stack_manifest(stack_directory) == \
+        {"chunk_size": CHUNK_SIZE, "frame_shape": list(FRAME_SHAPE), "photo_ids": [10, 11]}
+
+    with FrameStackWriter(1, str(tmp_path), chunk_size=8) as writer: # Resumes with the stack's own chunk size
+        assert writer.chunk_size == CHUNK_SIZE
+        for photo_id in range(10, 14):
+            writer.append(photo_id, make_frame(photo_id)) # 10 and 11 are already held
+    assert read_frame_stack_manifest(stack_directory)["photo_ids"] == [10, 11, 12, 13]
+    frame_stack = FrameStack.open(1, str(tmp_path))
+    assert all(np.array_equal(frame_stack.get_frame(photo_id), make_frame(photo_id)) for photo_id in range(10, 14))
+
+
+def test_frame_of_another_shape_raises(tmp_path):
+    with FrameStackWriter(1, str(tmp_path), CHUNK_SIZE) as writer:
+        writer.append(10, make_frame(10))
+        with pytest.raises(ValueError, match="not \\(4, 6, 3\\)"):
+            writer.append(11, np.zeros((2, 2, 3), np.uint8))
+    assert read_frame_stack_manifest(get_frame_stack_directory(1, str(tmp_path)))["photo_ids"] == [10]
+
+
+def test_ingest_decodes_frames_and_load_frames_falls_back_to_the_photo(tmp_path, monkeypatch):
+    png_bytes = {photo_id: cv2.imencode(".png", make_frame(photo_id))[1].tobytes() for photo_id in (10, 11, 12)}
+    with FrameStackIngest(str(tmp_path), CHUNK_SIZE) as frame_stack_ingest:
+        frame_stack_ingest.add_frame(1, 10, png_bytes[10])
+        frame_stack_ingest.add_frame(1, 11, b"not an image") # Left out, as a DNG would be
+        frame_stack_ingest.add_frame(1, 12, png_bytes[12])
+    assert FrameStack.open(1, str(tmp_path)).photo_ids == [10, 12]
+
+    decoded_photo_ids = []
+    def get_photo_buffer_from_id(photo_id):
+        decoded_photo_ids.append(photo_id)
+        return png_bytes[photo_id]
+    monkeypatch.setattr(frame_stack_store.cdi, "get_photo_buffer_from_id", get_photo_buffer_from_id)
+    frames = list(load_frames(1, [10, 11, 12], str(tmp_path)))
+    assert all(np.array_equal(frame, make_frame(photo_id)) for frame, photo_id in zip(frames, (10, 11, 12)))
+    assert decoded_photo_ids == [11]
+
+
+def write_stack(directory: str, camera_settings_link_id: int, last_written: float):
+    with FrameStackWriter(camera_settings_link_id, directory, CHUNK_SIZE) as writer:
+        for photo_id in range(CHUNK_SIZE):
+            writer.append(photo_id, np.random.default_rng(photo_id).integers(0, 256, (64, 64, 3), np.uint8))
+    os.utime(os.path.join(get_frame_stack_directory(camera_settings_link_id, directory), "frames.json"),
+             (last_written, last_written))
+
+
+@pytest.fixture
+def frame_stacks_directory(tmp_path):
+    """
+    Stacks 1 to 4, written in that order.
+    """
+    now = time.time()
+    for camera_settings_link_id in (3, 1, 4, 2):
+        write_stack(str(tmp_path), camera_settings_link_id, now - 100 * (5 - camera_settings_link_id))
+    return str(tmp_path)
+
+
+def test_least_recently_written_stacks_are_evicted(frame_stacks_directory):
+    frame_stacks = list_frame_stacks(frame_stacks_directory)
+    assert [camera_settings_link_id for camera_settings_link_id, _, _ in frame_stacks] == [1, 2, 3, 4]
+    stack_size = max(size for _, _, size in frame_stacks)
+
+    assert evict_frame_stacks(frame_stacks_directory, 2.5 * stack_size / 10**9, keep_camera_settings_link_ids={1}) == 2
+    assert [camera_settings_link_id for camera_settings_link_id, _, _ in list_frame_stacks(frame_stacks_directory)] == [1, 4]
+    assert evict_frame_stacks(frame_stacks_directory, 2.5 * stack_size / 10**9) == 0 # Within the size
+
+
+def test_garbage_collection_deletes_stacks_without_photos(frame_stacks_directory, monkeypatch):
+    monkeypatch.setattr(frame_stack_store.cdi, "get_camera_settings_link_ids_with_photos",
+                        lambda camera_settings_link_ids: [2, 3, 4])
+    assert collect_frame_stack_garbage(frame_stacks_directory, max_size_gb=100) == 1
+    assert [camera_settings_link_id for camera_settings_link_id, _, _ in list_frame_stacks(frame_stacks_directory)] == [2, 3, 4]
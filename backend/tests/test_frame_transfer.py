@@ -0,0 +1,245 @@
+"""
+Adding a run's tarball to the database - checking each frame against the Pi's
+transfer manifest (and a streamed frame's header), resuming after the frames
+already held, and falling back to the tarball when a frame stream breaks. The
+tarball and manifest are packaged by video_script, as on the Pi, in a tmp dir
+standing in for the Pi's filesystem. No database is needed - photos go to a
+recording PhotoIngest.
+"""
+import hashlib
+import io
+import json
+import os
+import tarfile
+import time
+import pytest
+
+from src.classes import Camera as camera_module
+from src.classes.Camera import Camera, FrameStreamBroken
+from src.classes.PiRegistry import PiCommandQueue
+from src.database.CRUD import CRISP_database_interaction as cdi
+
+CAMERA_SETTINGS_LINK_ID = 7
+NUM_OF_FRAMES = 4
+
+
+class RecordingPhotoIngest:
+    """
+    Stands in for cdi.PhotoIngest - photos get ids from 100, in order.
+    """
+
+    def __init__(self, batch_size=None):
+        self.photo_ids = []
+        self.added = [] # (camera_settings_link_id, photo bytes, photo metadata)
+
+    def add(self, camera_settings_link_id, photo, photo_metadata=None, on_added=None):
+        self.added.append((camera_settings_link_id, photo, photo_metadata))
+        self.photo_ids.append(99 + len(self.added))
+
+    def add_held(self, photo_id, on_added=None):
+        self.photo_ids.append(photo_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class NullFrameStackIngest:
+
+    def add_frame(self, *args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+def frame_bytes(frame_number: int) -> bytes:
+    return b"\xff\xd8\xff" + f"frame {frame_number}".encode() * 1000
+
+
+def frame_name(frame_number: int) -> str:
+    return f"main_run_image_{frame_number}_cslID_{CAMERA_SETTINGS_LINK_ID}.jpeg"
+
+
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+@pytest.fixture
+def run_directory(tmp_path, video_script):
+    """
+    A main run's directory on the 'Pi', packaged for transfer. Returns the
+    directory, the tarball's path and its manifest.
+    """
+    directory = tmp_path / "experiment_id_1" / "real_beam_run_id_2"
+    directory.mkdir(parents=True)
+    frame_metadata = {}
+    for frame_number in range(1, NUM_OF_FRAMES + 1):
+        (directory / frame_name(frame_number)).write_bytes(frame_bytes(frame_number))
+        frame_metadata[frame_name(frame_number)] = {"frame_number": frame_number}
+    video_script.package_images_for_transfer(str(directory), time.time(), frame_metadata)
+    tarball_path, = [str(directory / filename) for filename in os.listdir(directory) if filename.endswith(".tar")]
+    with open(f"{tarball_path}.manifest.json") as manifest_file:
+        manifest = json.load(manifest_file)
+    return directory, tarball_path, manifest
+
+
+def add_tarball(tarball_path: str, offset=0, **kwargs) -> RecordingPhotoIngest:
+    photo_ingest = RecordingPhotoIngest()
+    with open(tarball_path, "rb") as tarball:
+        tarball.seek(offset)
+        with tarfile.open(fileobj=tarball, mode="r|") as tar:
+            for member in tar:
+                Camera.add_tar_member_to_database(tar, member, photo_ingest, **kwargs)
+    return photo_ingest
+
+
+def frame_numbers(photo_ingest: RecordingPhotoIngest) -> list[int]:
+    return [json.loads(photo_metadata)["frame_number"] for _, _, photo_metadata in photo_ingest.added]
+
+
+def test_frames_are_added_in_order_with_their_checksums(run_directory):
+    _, tarball_path, manifest = run_directory
+    manifest_sha256s = {entry["name"]: entry["sha256"] for entry in manifest["members"]}
+    photo_ingest = add_tarball(tarball_path, manifest_sha256s=manifest_sha256s)
+
+    assert frame_numbers(photo_ingest) == list(range(1, NUM_OF_FRAMES + 1))
+    for frame_number, (camera_settings_link_id, photo, photo_metadata) in enumerate(photo_ingest.added, start=1):
+        assert camera_settings_link_id == CAMERA_SETTINGS_LINK_ID
+        assert photo == frame_bytes(frame_number)
+        assert json.loads(photo_metadata)["sha256"] == sha256(photo) # How a resumed transfer recognises it
+
+
+def test_resume_point_is_the_first_frame_not_held(run_directory):
+    _, tarball_path, manifest = run_directory
+    held_photo_ids = {sha256(frame_bytes(1)): 11, sha256(frame_bytes(2)): 12}
+    offset, photo_id_array = Camera.find_transfer_resume_point(manifest, held_photo_ids)
+    assert photo_id_array == [11, 12]
+    assert offset == next(entry["offset"] for entry in manifest["members"] if entry["name"].endswith(frame_name(3)))
+
+    # The tar can be read from there, as the resumed download is
+    manifest_sha256s = {entry["name"]: entry["sha256"] for entry in manifest["members"]}
+    photo_ingest = add_tarball(tarball_path, offset, manifest_sha256s=manifest_sha256s, held_photo_ids=held_photo_ids)
+    assert frame_numbers(photo_ingest) == [3, 4]
+
+
+def test_resume_point_when_nothing_or_everything_is_held(run_directory):
+    _, _, manifest = run_directory
+    assert Camera.find_transfer_resume_point(manifest, {}) == (manifest["members"][0]["offset"], []) # The first frame's header
+    every_frame_held = {sha256(frame_bytes(frame_number)): frame_number for frame_number in range(1, NUM_OF_FRAMES + 1)}
+    assert Camera.find_transfer_resume_point(manifest, every_frame_held) == (None, list(range(1, NUM_OF_FRAMES + 1)))
+    assert Camera.find_transfer_resume_point(None, every_frame_held) == (0, []) # No manifest (packaged before them)
+    compressed_manifest = {**manifest, "transfer_codec": "zstd"}
+    assert Camera.find_transfer_resume_point(compressed_manifest, every_frame_held) == (0, []) # Read from the start
+
+
+def test_held_frames_are_not_added_again(run_directory):
+    _, tarball_path, _ = run_directory
+    photo_ingest = add_tarball(tarball_path, held_photo_ids={sha256(frame_bytes(2)): 12})
+    assert frame_numbers(photo_ingest) == [1, 3, 4]
+    assert photo_ingest.photo_ids == [100, 12, 101, 102] # In tar order
+
+
+def test_frame_not_matching_the_manifest_raises(run_directory):
+    _, tarball_path, manifest = run_directory
+    manifest_sha256s = {entry["name"]: entry["sha256"] for entry in manifest["members"]}
+    corrupted_name = next(name for name in manifest_sha256s if name.endswith(frame_name(2)))
+    manifest_sha256s[corrupted_name] = sha256(b"another frame")
+    with pytest.raises(Exception, match="does not match its checksum in the transfer manifest"):
+        add_tarball(tarball_path, manifest_sha256s=manifest_sha256s)
+
+
+def test_streamed_frame_not_matching_its_header_raises(tmp_path):
+    tarball_path = str(tmp_path / "streamed.tar")
+    with tarfile.open(tarball_path, "w", format=tarfile.PAX_FORMAT) as tar:
+        for frame_number, header_sha256 in ((1, sha256(frame_bytes(1))), (2, sha256(b"another frame"))):
+            tarinfo = tarfile.TarInfo(frame_name(frame_number))
+            tarinfo.size = len(frame_bytes(frame_number))
+            tarinfo.pax_headers = {Camera.FRAME_SHA256_PAX_KEY: header_sha256}
+            tar.addfile(tarinfo, io.BytesIO(frame_bytes(frame_number)))
+    with pytest.raises(Exception, match="does not match the checksum in its header"):
+        add_tarball(tarball_path)
+
+
+class LocalSFTPFile:
+
+    def __init__(self, path: str):
+        self.file = open(path, "rb")
+
+    def stat(self):
+        return os.fstat(self.file.fileno())
+
+    def seek(self, offset: int):
+        self.file.seek(offset)
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def prefetch(self, *args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.file.close()
+
+
+class LocalSFTPClient:
+    """
+    The Pi's filesystem is the local one.
+    """
+
+    def listdir(self, path: str):
+        return os.listdir(path)
+
+    def open(self, path: str, mode="rb", bufsize=-1):
+        return LocalSFTPFile(path)
+
+
+class LocalPersistentSFTP:
+
+    def get_client(self):
+        return LocalSFTPClient()
+
+
+@pytest.fixture
+def camera(tmp_path, monkeypatch):
+    """
+    A Camera whose 'Pi' is tmp_path, streaming runs without the daemon.
+    """
+    camera = Camera("testpi", "fake", None, LocalPersistentSFTP(), PiCommandQueue())
+    camera.experiment_directory = f"{tmp_path}/experiment_id_"
+    camera.use_camera_daemon = False
+    monkeypatch.setattr(camera, "build_main_run_command", lambda *args, **kwargs: "python video_script.py main_run")
+    monkeypatch.setattr(cdi, "PhotoIngest", RecordingPhotoIngest)
+    monkeypatch.setattr(camera_module, "FrameStackIngest", NullFrameStackIngest)
+    return camera
+
+
+def test_broken_stream_falls_back_to_the_tarball(run_directory, camera, monkeypatch):
+    streamed_photo_ids = {sha256(frame_bytes(1)): 11, sha256(frame_bytes(2)): 12} # Added before the stream broke
+    monkeypatch.setattr(cdi, "get_photo_ids_by_sha256", lambda camera_settings_link_ids: streamed_photo_ids)
+    def break_stream(command):
+        raise FrameStreamBroken("Frame stream broke after 2 frames")
+    monkeypatch.setattr(camera, "execute_video_script_streamed", break_stream)
+
+    assert camera.run_main_run_script_streamed(1, 2, CAMERA_SETTINGS_LINK_ID) == [11, 12, 100, 101]
+
+
+def test_broken_stream_without_a_tarball_raises(run_directory, camera, monkeypatch):
+    directory, tarball_path, _ = run_directory
+    os.remove(tarball_path)
+    monkeypatch.setattr(cdi, "get_photo_ids_by_sha256", lambda camera_settings_link_ids: {})
+    def break_stream(command):
+        raise FrameStreamBroken("Frame stream broke after 0 frames")
+    monkeypatch.setattr(camera, "execute_video_script_streamed", break_stream)
+
+    with pytest.raises(Exception, match="the run's tarball could not be transferred") as exc_info:
+        camera.run_main_run_script_streamed(1, 2, CAMERA_SETTINGS_LINK_ID)
+    assert isinstance(exc_info.value.__cause__, FrameStreamBroken)
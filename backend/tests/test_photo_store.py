@@ -0,0 +1,43 @@
+"""
+PhotoStore's garbage collection grace period - a file put again restarts it, so
+deleting an unreferenced file can't race a PhotoIngest about to refer to it.
+"""
+import os
+import time
+
+from src.photo_store import GARBAGE_COLLECTION_GRACE_PERIOD, PhotoStore
+
+
+def age(path: str, seconds: float):
+    modified = time.time() - seconds
+    os.utime(path, (modified, modified))
+
+
+def test_put_again_restarts_the_grace_period(tmp_path):
+    photo_store = PhotoStore(str(tmp_path), fsync=False)
+    photo_hash, _ = photo_store.put(b"photo")
+    age(photo_store.path(photo_hash), 2 * GARBAGE_COLLECTION_GRACE_PERIOD)
+    cutoff = time.time() - GARBAGE_COLLECTION_GRACE_PERIOD
+    assert list(photo_store.iterate_hashes(cutoff)) == [photo_hash]
+
+    assert photo_store.put(b"photo") == (photo_hash, 5)
+    assert list(photo_store.iterate_hashes(cutoff)) == []
+    assert not photo_store.delete(photo_hash, older_than=cutoff)
+    assert photo_store.exists(photo_hash)
+
+
+def test_delete_only_older_than(tmp_path):
+    photo_store = PhotoStore(str(tmp_path), fsync=False)
+    photo_hash, _ = photo_store.put(b"photo")
+    assert not photo_store.delete(photo_hash, older_than=time.time() - GARBAGE_COLLECTION_GRACE_PERIOD)
+    age(photo_store.path(photo_hash), 2 * GARBAGE_COLLECTION_GRACE_PERIOD)
+    assert photo_store.delete(photo_hash, older_than=time.time() - GARBAGE_COLLECTION_GRACE_PERIOD)
+    assert not photo_store.exists(photo_hash)
+    assert not photo_store.delete(photo_hash) # Already gone
+
+
+def test_sync_a_batch(tmp_path):
+    photo_store = PhotoStore(str(tmp_path))
+    photo_hashes = [photo_store.put(f"photo {i}".encode(), fsync=False)[0] for i in range(4)]
+    photo_store.sync(photo_hashes + photo_hashes[:1]) # A photo twice in a batch is synced once
+    assert all(photo_store.read(photo_hash) == f"photo {i}".encode() for i, photo_hash in enumerate(photo_hashes))
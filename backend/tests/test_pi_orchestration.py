@@ -0,0 +1,81 @@
+"""
+run_on_pis against the mock SSH Pis of benchmarks/orchestration_benchmark.py -
+some finish, one stalls part way through its command and never exits, like a Pi
+hung in a run.
+"""
+import asyncio
+import paramiko
+import pytest
+
+from benchmarks.orchestration_benchmark import cancel_remote_command, connect_to_mock_pi, run_remote_command, start_mock_pi
+from src.pi_orchestration import PiOperation, run_on_pis
+
+COMMAND_DURATION = 0.2 # s, of the fastest mock Pi
+NUM_OF_IMAGES = 4 # Progress lines printed per command
+DEADLINE = 2 # s
+COMMAND = "python video_script.py main_run"
+
+
+@pytest.fixture(scope="module")
+def host_key():
+    return paramiko.RSAKey.generate(2048)
+
+
+@pytest.fixture
+def ssh_clients(host_key):
+    """
+    Two mock Pis that finish and one that stalls, by username.
+    """
+    ssh_clients = {}
+    for pi_number, username in enumerate(["mockpi1", "mockpi2", "stalledpi"], start=1):
+        port = start_mock_pi(host_key, pi_number * COMMAND_DURATION, NUM_OF_IMAGES, stall=username == "stalledpi")
+        ssh_clients[username] = connect_to_mock_pi(port, username)
+    yield ssh_clients
+    for ssh_client in ssh_clients.values():
+        ssh_client.close()
+
+
+def collect(operations: dict, **kwargs):
+    """
+    The results in the order run_on_pis yields them.
+    """
+    async def collect_results():
+        return [pi_result async for pi_result in run_on_pis(operations, **kwargs)]
+    return asyncio.run(collect_results())
+
+
+def test_deadline_times_out_only_the_stalled_pi(ssh_clients):
+    cancelled = []
+    def cancel(username):
+        cancelled.append(username)
+        cancel_remote_command(username)
+    operations = {username: PiOperation(username, run_remote_command, (ssh_client, COMMAND, username),
+                                        deadline=DEADLINE, cancel=lambda username=username: cancel(username))
+                  for username, ssh_client in ssh_clients.items()}
+    pi_results = collect(operations, verbose=False)
+
+    assert [pi_result.key for pi_result in pi_results] == ["mockpi1", "mockpi2", "stalledpi"] # As each finished
+    results = {pi_result.key: pi_result for pi_result in pi_results}
+    for username in ("mockpi1", "mockpi2"):
+        assert results[username].succeeded
+        assert results[username].result == 0
+        assert results[username].output == [f"Capturing image {i}" for i in range(1, NUM_OF_IMAGES + 1)]
+    stalled_result = results["stalledpi"]
+    assert stalled_result.timed_out and stalled_result.status == "timed out"
+    assert isinstance(stalled_result.error, TimeoutError)
+    assert stalled_result.latency == DEADLINE
+    assert stalled_result.output == [f"Capturing image {i}" for i in range(1, NUM_OF_IMAGES // 2 + 1)] # Kept from before it stalled
+    assert cancelled == ["stalledpi"]
+
+
+def test_failure_is_returned_with_the_other_results(ssh_clients):
+    def fail():
+        raise RuntimeError("Camera not found")
+    operations = {username: PiOperation(username, run_remote_command, (ssh_client, COMMAND, username))
+                  for username, ssh_client in ssh_clients.items() if username != "stalledpi"}
+    operations["brokenpi"] = PiOperation("brokenpi", fail)
+    results = {pi_result.key: pi_result for pi_result in collect(operations, verbose=False, max_concurrent=2)}
+
+    assert results.keys() == operations.keys()
+    assert results["brokenpi"].status == "failed" and str(results["brokenpi"].error) == "Camera not found"
+    assert results["mockpi1"].succeeded and results["mockpi2"].succeeded
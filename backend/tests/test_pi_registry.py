@@ -0,0 +1,132 @@
+"""
+Concurrency stress tests of PiRegistry and PiCommandQueue (no Pis needed).
+Many threads register, look up and unregister Pis at once, race to register
+the same username, and take turns on one command queue.
+"""
+import sys
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+
+from src.classes.PiRegistry import PiBusyError, PiCommandQueue, PiRegistry
+
+NUM_OF_THREADS = 32
+NUM_OF_PIS = 200 # Registrations (and commands) per thread
+
+
+@pytest.fixture(autouse=True)
+def frequent_thread_switches():
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6) # Switch threads as often as possible
+    yield
+    sys.setswitchinterval(switch_interval)
+
+
+def run_threads(num_of_threads: int, target, *args):
+    start = threading.Barrier(num_of_threads)
+    errors = []
+    def run(thread_number):
+        start.wait() # All at once, to maximise contention
+        try:
+            target(thread_number, *args)
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=run, args=(thread_number,)) for thread_number in range(num_of_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors, errors[0]
+
+
+def make_pi(username: str, camera_id: int):
+    return SimpleNamespace(username=username, camera_id=camera_id)
+
+
+def test_distinct_registrations():
+    """
+    Each thread registers its own Pis, then unregisters every other one.
+    """
+    registry = PiRegistry()
+    def register_and_unregister(thread_number):
+        pis = [make_pi(f"pi_{thread_number}_{i}", thread_number * NUM_OF_PIS + i) for i in range(NUM_OF_PIS)]
+        for pi in pis:
+            registry.register(pi)
+            assert registry.get(pi.username) is pi
+        for pi in pis[::2]:
+            assert registry.unregister(pi)
+    run_threads(NUM_OF_THREADS, register_and_unregister)
+
+    expected_usernames = {f"pi_{thread_number}_{i}" for thread_number in range(NUM_OF_THREADS) for i in range(1, NUM_OF_PIS, 2)}
+    registered_usernames = [pi.username for pi in registry.all()]
+    assert sorted(registered_usernames) == sorted(expected_usernames) # None lost or doubled
+    assert all(registry.get_by_camera_id(pi.camera_id) is pi for pi in registry.all())
+
+
+def test_same_username_race():
+    """
+    Every thread repeatedly registers a new Pi with the same username - every
+    registration but the first must replace exactly one Pi.
+    """
+    registry = PiRegistry()
+    replaced_counts = [0] * NUM_OF_THREADS
+    def register_same_username(thread_number):
+        for i in range(NUM_OF_PIS):
+            if registry.register(make_pi("pi", thread_number * NUM_OF_PIS + i)) is not None:
+                replaced_counts[thread_number] += 1
+    run_threads(NUM_OF_THREADS, register_same_username)
+
+    assert len(registry) == 1
+    assert sum(replaced_counts) == NUM_OF_THREADS * NUM_OF_PIS - 1
+
+
+def test_command_queue_never_overlaps():
+    """
+    Commands must never overlap, and a thread holding the queue can take it again.
+    """
+    command_queue = PiCommandQueue()
+    in_command = [0]
+    overlaps = [0]
+    completed = [0]
+    def run_commands(thread_number):
+        for _ in range(NUM_OF_PIS):
+            with command_queue.turn():
+                in_command[0] += 1
+                if in_command[0] > 1:
+                    overlaps[0] += 1
+                with command_queue.turn(): # Nested command on the same thread
+                    time.sleep(0)
+                in_command[0] -= 1
+                completed[0] += 1
+    run_threads(NUM_OF_THREADS, run_commands)
+
+    assert overlaps[0] == 0
+    assert completed[0] == NUM_OF_THREADS * NUM_OF_PIS
+    assert len(command_queue) == 0
+
+
+def test_command_queue_refuses_without_waiting_when_busy():
+    command_queue = PiCommandQueue()
+    with command_queue.turn(wait=False):
+        with command_queue.turn(wait=False): # The thread holding it can still take it
+            pass
+
+    holding, release = threading.Event(), threading.Event()
+    def hold():
+        with command_queue.turn():
+            holding.set()
+            release.wait()
+    holder = threading.Thread(target=hold)
+    holder.start()
+    holding.wait()
+    try:
+        with pytest.raises(PiBusyError):
+            with command_queue.turn(wait=False):
+                pass
+    finally:
+        release.set()
+        holder.join()
+    with command_queue.turn(wait=False):
+        pass
+    assert len(command_queue) == 0
@@ -0,0 +1,70 @@
+"""
+Frame tar streams through each transfer codec - written on the Pi a frame at a
+time, flushed after each, and read back by the backend as it arrives.
+"""
+import io
+import tarfile
+import pytest
+
+from src.transfer_codec import ARCHIVE_EXTENSIONS, CompressedWriter, get_codec_from_archive_name, open_decompressed_stream
+
+CODEC_PACKAGES = {"none": None, "zstd": "zstandard", "lz4": "lz4"}
+FRAMES = {f"main_run_image_{i}_cslID_7.jpeg": b"\xff\xd8\xff" + f"frame {i}".encode() * 5000 for i in range(1, 4)}
+
+
+@pytest.fixture(params=list(CODEC_PACKAGES))
+def codec(request):
+    if CODEC_PACKAGES[request.param] is not None:
+        pytest.importorskip(CODEC_PACKAGES[request.param])
+    return request.param
+
+
+def add_frame(tar: tarfile.TarFile, name: str, frame: bytes):
+    tarinfo = tarfile.TarInfo(name)
+    tarinfo.size = len(frame)
+    tar.addfile(tarinfo, io.BytesIO(frame))
+
+
+def read_frames(stream: io.BytesIO, codec: str) -> dict:
+    with tarfile.open(fileobj=open_decompressed_stream(stream, codec), mode="r|") as tar:
+        return {member.name: tar.extractfile(member).read() for member in tar}
+
+
+def test_round_trip(codec):
+    stream = io.BytesIO()
+    with CompressedWriter(stream, codec) as writer:
+        with tarfile.open(fileobj=writer, mode="w|") as tar:
+            for name, frame in FRAMES.items():
+                add_frame(tar, name, frame)
+                writer.flush()
+    assert not stream.closed # Left open for the rest of the transfer
+    if codec != "none":
+        assert len(stream.getvalue()) < sum(map(len, FRAMES.values())) # The frames repeat, so compress well
+    stream.seek(0)
+    assert read_frames(stream, codec) == FRAMES
+
+
+def test_flushed_data_can_be_read_before_the_next(codec):
+    stream = io.BytesIO()
+    writer = CompressedWriter(stream, codec)
+    frames = list(FRAMES.values())
+    writer.write(frames[0])
+    writer.flush() # Mid-run - the stream stays open for the next frame
+    decompressed = open_decompressed_stream(io.BytesIO(stream.getvalue()), codec)
+    assert decompressed.read(len(frames[0])) == frames[0]
+
+    writer.write(frames[1])
+    writer.close()
+    decompressed = open_decompressed_stream(io.BytesIO(stream.getvalue()), codec)
+    assert decompressed.read() == frames[0] + frames[1]
+
+
+def test_archive_name_gives_the_codec(codec):
+    assert get_codec_from_archive_name(f"1700000000_video_frames{ARCHIVE_EXTENSIONS[codec]}") == codec
+
+
+def test_unknown_codec_raises():
+    with pytest.raises(ValueError, match="Unknown transfer codec"):
+        CompressedWriter(io.BytesIO(), "gzip")
+    with pytest.raises(ValueError, match="Unknown transfer codec"):
+        open_decompressed_stream(io.BytesIO(), "gzip")
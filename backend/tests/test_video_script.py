@@ -0,0 +1,54 @@
+"""
+video_script's pipelined capture settings, against fake_picamera2, and the
+packaging of a run's frames for transfer.
+"""
+import os
+import tarfile
+import time
+import pytest
+
+
+def main_run_arguments(video_script, *arguments):
+    return video_script.parse_arguments(["-dir", "/tmp/unused", "main_run", "-num", "1", "-csl", "1", "-pw", "2", *arguments])
+
+
+@pytest.fixture
+def picam2(video_script):
+    picam2 = video_script.Picamera2()
+    yield picam2
+    picam2.close()
+
+
+def test_frames_in_flight_fill_the_ram_budget(video_script, picam2):
+    args = main_run_arguments(video_script, "-ram", "1")
+    picam2.configure(picam2.create_still_configuration(raw={}, display=None))
+    request_bytes, image_bytes = video_script.estimate_request_memory(picam2)
+    args.ram_budget = (2 * image_bytes + 3 * request_bytes) / 10**6 # Room for three requests after the writers' images
+    assert video_script.configure_camera_for_pipelining(picam2, args) == 3
+    assert picam2.camera_config["buffer_count"] == 4
+
+
+def test_frames_in_flight_are_capped_whatever_the_ram_budget(video_script, picam2):
+    args = main_run_arguments(video_script, "-ram", "1000000")
+    assert video_script.configure_camera_for_pipelining(picam2, args) == video_script.MAX_FRAMES_IN_FLIGHT
+    assert picam2.camera_config["buffer_count"] == video_script.MAX_FRAMES_IN_FLIGHT + 1
+
+    args = main_run_arguments(video_script, "-ram", "1000000", "-mif", "10") # A Pi with a larger CMA pool
+    assert video_script.configure_camera_for_pipelining(picam2, args) == 10
+
+
+def test_at_least_one_frame_in_flight(video_script, picam2):
+    args = main_run_arguments(video_script, "-ram", "0.001")
+    assert video_script.configure_camera_for_pipelining(picam2, args) == 1
+    with pytest.raises(ValueError, match="-mif/--max_frames_in_flight"):
+        main_run_arguments(video_script, "-mif", "0")
+
+
+def test_package_frames_without_metadata(video_script, tmp_path):
+    (tmp_path / "main_run_image_1_cslID_1.jpeg").write_bytes(b"\xff\xd8\xff")
+    video_script.package_images_for_transfer(str(tmp_path), time.time())
+    tarball_path, = [tmp_path / filename for filename in os.listdir(tmp_path) if filename.endswith(".tar")]
+    with tarfile.open(tarball_path) as tar:
+        frame, = [member for member in tar if member.isfile()]
+    assert frame.name.endswith("main_run_image_1_cslID_1.jpeg")
+    assert video_script.FRAME_METADATA_PAX_KEY not in frame.pax_headers